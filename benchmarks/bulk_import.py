@@ -0,0 +1,105 @@
+# Registo de vídeos em massa: vídeos por segundo a registar N ficheiros com uma tarefa process_video_upload
+# por vídeo e com tarefas register_videos_batch de B vídeos (uma transação e uma invalidação por lote).
+# As tarefas correm no próprio processo (Task.apply, com os sinais do worker: eventos e métricas), por isso
+# mede o custo da base de dados, do Redis e do armazenamento por conteúdo, sem o transporte do broker.
+# Conta também os commits na base de dados e as invalidações da listagem (incrementos da versão da lista).
+# Usa uma base de dados SQLite temporária (ou DATABASE_URL) e o Redis de REDIS_HOST/REDIS_PORT
+# (ou o fakeredis com --fake-redis).
+#
+# Exemplo:
+#   REDIS_HOST=localhost python benchmarks/bulk_import.py --videos 2000 --batch-size 200
+#   python benchmarks/bulk_import.py --fake-redis
+
+# Imports Gerais
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+WORKDIR = tempfile.mkdtemp(prefix="ualflix-bulk-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(WORKDIR, 'catalog.db')}")
+os.environ.setdefault("UPLOAD_DIR", os.path.join(WORKDIR, "videos"))
+os.environ.setdefault("CELERY_BROKER_URL", "memory://")
+os.environ.setdefault("CELERY_RESULT_BACKEND_URL", "cache+memory://")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "shared"))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "catalog_service"))
+
+# Imports Extra
+import redis
+from sqlalchemy import event
+
+# Imports dos Ficheiros
+import tasks
+from controller import LIST_VERSION_KEY
+from model import engine, init_db
+
+
+# Cria 'count' ficheiros pequenos com conteúdos diferentes em TEMP_UPLOAD_DIR (como uploads recebidos)
+def make_files(prefix: str, count: int, size: int) -> list:
+    items = []
+    for i in range(count):
+        path = os.path.join(tasks.TEMP_UPLOAD_DIR, f"{prefix}-{i}.mp4.part")
+        with open(path, "wb") as f:
+            f.write(f"{prefix}-{i}".encode().ljust(size, b"\0"))
+        items.append({"title": f"{prefix} {i}", "description": "Importação", "duration": 60,
+                      "temp_file_path": path, "original_filename": f"{prefix}-{i}.mp4"})
+    return items
+
+# Regista os vídeos com o método indicado e devolve vídeos/s, commits e invalidações da listagem
+def run(mode: str, items: list, batch_size: int, redis_client) -> dict:
+    commits = [0]
+    on_commit = lambda conn: commits.__setitem__(0, commits[0] + 1)
+    event.listen(engine, "commit", on_commit)
+    version_before = int(redis_client.get(LIST_VERSION_KEY) or 0)
+    started = time.perf_counter()
+    try:
+        if mode == "per_task":
+            for item in items:
+                tasks.process_video_upload.apply(
+                    args=(item["title"], item["description"], item["duration"], item["temp_file_path"],
+                          item["original_filename"]), throw=True)
+        else:
+            for start in range(0, len(items), batch_size):
+                tasks.register_videos_batch.apply(args=(items[start:start + batch_size],),
+                                                  kwargs={"stages": False}, throw=True)
+    finally:
+        elapsed = time.perf_counter() - started
+        event.remove(engine, "commit", on_commit)
+    return {
+        "videos": len(items),
+        "seconds": round(elapsed, 3),
+        "videos_per_s": round(len(items) / elapsed, 1),
+        "db_commits": commits[0],
+        "list_invalidations": int(redis_client.get(LIST_VERSION_KEY) or 0) - version_before,
+    }
+
+def main(args):
+    if args.fake_redis:
+        import fakeredis
+        server = fakeredis.FakeServer()
+        client = fakeredis.FakeRedis(server=server, decode_responses=True)
+        # O processo do "worker" (este) usa o mesmo servidor falso
+        tasks._task_redis = client
+    else:
+        client = redis.Redis(host=os.getenv("REDIS_HOST", "localhost"), port=int(os.getenv("REDIS_PORT", "6379")),
+                             decode_responses=True)
+    init_db()
+
+    results = {}
+    for mode in ("per_task", "batch"):
+        items = make_files(mode, args.videos, args.file_size)
+        results[mode] = run(mode, items, args.batch_size, client)
+    results["speedup"] = round(results["batch"]["videos_per_s"] / results["per_task"]["videos_per_s"], 2)
+    print(json.dumps({"batch_size": args.batch_size, "database": engine.url.get_backend_name(),
+                      "redis": "fakeredis" if args.fake_redis else "redis", **results}, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Vídeos registados por segundo, por tarefa e em lote")
+    parser.add_argument("--videos", type=int, default=1000)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--file-size", type=int, default=4096, help="Tamanho (bytes) de cada ficheiro gerado")
+    parser.add_argument("--fake-redis", action="store_true", help="Usa o fakeredis em vez de um Redis real")
+    main(parser.parse_args())
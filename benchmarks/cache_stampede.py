@@ -0,0 +1,166 @@
+# Verificação da proteção contra stampedes das caches do catálogo (cache.get_or_load / aget_or_load).
+# Dispara N pedidos concorrentes (500 por omissão) para a mesma chave em falta e conta as queries feitas à
+# base de dados, nas camadas síncrona (threads) e assíncrona (corrotinas):
+# - miss do detalhe de um vídeo (video:<id>)
+# - miss de uma página da listagem depois de uma escrita (nova versão da lista)
+# - entrada expirada (stale-while-revalidate: um pedido recalcula, os outros recebem o valor antigo)
+# Em cada cenário deve haver exatamente uma query por chave. Termina com código 1 se não for o caso.
+# A cache local do detalhe é limpa antes de cada cenário, para que os pedidos cheguem ao Redis.
+# Usa uma base de dados SQLite temporária e o Redis de REDIS_HOST/REDIS_PORT (ou o fakeredis com --fake-redis).
+#
+# Exemplo:
+#   REDIS_HOST=localhost python benchmarks/cache_stampede.py --concurrency 500
+#   python benchmarks/cache_stampede.py --fake-redis
+
+# Imports Gerais
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+WORKDIR = tempfile.mkdtemp(prefix="ualflix-stampede-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(WORKDIR, 'catalog.db')}")
+os.environ.setdefault("UPLOAD_DIR", WORKDIR)
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "shared"))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "catalog_service"))
+
+# Imports Extra
+import redis
+import redis.asyncio as aioredis
+from sqlalchemy import event
+
+# Imports dos Ficheiros
+import async_controller
+import controller
+from cache import encode_entry
+from model import Video, SessionLocal, AsyncSessionLocal, engine, init_db, make_async_engine
+
+
+# Conta as queries SELECT à tabela 'videos' (engines síncrono e assíncrono)
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT") and "videos" in statement:
+            with self._lock:
+                self.count += 1
+
+# Corre 'fn' em 'concurrency' threads ao mesmo tempo (todas esperam numa barreira antes de começar)
+def run_threads(fn, concurrency: int) -> list:
+    barrier = threading.Barrier(concurrency)
+
+    def call():
+        barrier.wait()
+        return fn()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(lambda _: call(), range(concurrency)))
+
+# Cenários da camada síncrona: cada thread usa a sua sessão, como um pedido na threadpool
+def sync_scenarios(redis_client: redis.Redis, counter: QueryCounter, concurrency: int) -> dict:
+    def with_session(fn):
+        def call():
+            db = SessionLocal()
+            try:
+                return fn(db)
+            finally:
+                db.close()
+        return call
+
+    results = {}
+    controller.video_local_cache.invalidate()
+    redis_client.delete("video:1")
+    counter.count = 0
+    run_threads(with_session(lambda db: controller.get_video(db, 1, redis_client)), concurrency)
+    results["video_miss"] = counter.count
+
+    controller.invalidate_list_cache(redis_client)
+    counter.count = 0
+    run_threads(with_session(lambda db: controller.list_videos(db, redis_client, limit=20)), concurrency)
+    results["list_miss_after_write"] = counter.count
+
+    # Entrada expirada há 1 s, ainda dentro da janela de stale-while-revalidate
+    controller.video_local_cache.invalidate()
+    redis_client.set("video:1", encode_entry(json.dumps({"id": 1, "title": "antigo"}), -1, 0.01), ex=60)
+    counter.count = 0
+    values = run_threads(with_session(lambda db: controller.get_video(db, 1, redis_client)), concurrency)
+    results["video_stale"] = counter.count
+    results["video_stale_served_old"] = sum(1 for v in values if v["title"] == "antigo")
+    return results
+
+# Cenários da camada assíncrona: corrotinas concorrentes, cada uma com a sua sessão assíncrona
+async def async_scenarios(redis_client: aioredis.Redis, async_engine, counter: QueryCounter,
+                          concurrency: int) -> dict:
+    async def gather(fn):
+        async def call():
+            async with AsyncSessionLocal(bind=async_engine) as db:
+                return await fn(db)
+        return await asyncio.gather(*[call() for _ in range(concurrency)])
+
+    results = {}
+    controller.video_local_cache.invalidate()
+    await redis_client.delete("video:1")
+    counter.count = 0
+    await gather(lambda db: async_controller.get_video(db, 1, redis_client))
+    results["video_miss"] = counter.count
+
+    await async_controller.invalidate_list_cache(redis_client)
+    counter.count = 0
+    await gather(lambda db: async_controller.list_videos(db, redis_client, limit=20))
+    results["list_miss_after_write"] = counter.count
+
+    controller.video_local_cache.invalidate()
+    await redis_client.set("video:1", encode_entry(json.dumps({"id": 1, "title": "antigo"}), -1, 0.01), ex=60)
+    counter.count = 0
+    values = await gather(lambda db: async_controller.get_video(db, 1, redis_client))
+    results["video_stale"] = counter.count
+    results["video_stale_served_old"] = sum(1 for v in values if v["title"] == "antigo")
+    return results
+
+def main(args):
+    if args.fake_redis:
+        import fakeredis
+        server = fakeredis.FakeServer()
+        redis_client = fakeredis.FakeRedis(server=server, decode_responses=True)
+        aredis_client = fakeredis.FakeAsyncRedis(server=server, decode_responses=True, max_connections=args.concurrency * 2)
+    else:
+        host, port = os.getenv("REDIS_HOST", "localhost"), int(os.getenv("REDIS_PORT", "6379"))
+        redis_client = redis.Redis(host=host, port=port, decode_responses=True)
+        aredis_client = aioredis.Redis(host=host, port=port, decode_responses=True)
+
+    init_db()
+    with SessionLocal() as db:
+        db.add_all([Video(title=f"Video {i}", description="Stampede", duration=60, file_path=f"/bench/{i}.mp4")
+                    for i in range(50)])
+        db.commit()
+
+    counter = QueryCounter()
+    event.listen(engine, "before_cursor_execute", counter)
+    async_engine = make_async_engine(engine)
+    event.listen(async_engine.sync_engine, "before_cursor_execute", counter)
+
+    started = time.perf_counter()
+    report = {
+        "concurrency": args.concurrency,
+        "sync": sync_scenarios(redis_client, counter, args.concurrency),
+        "async": asyncio.run(async_scenarios(aredis_client, async_engine, counter, args.concurrency)),
+    }
+    report["seconds"] = round(time.perf_counter() - started, 2)
+    queries = [v for layer in ("sync", "async") for k, v in report[layer].items() if not k.endswith("served_old")]
+    report["ok"] = all(q == 1 for q in queries)
+    print(json.dumps(report, indent=2))
+    sys.exit(0 if report["ok"] else 1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Queries à base de dados por chave com N misses concorrentes")
+    parser.add_argument("--concurrency", type=int, default=500)
+    parser.add_argument("--fake-redis", action="store_true", help="Usa o fakeredis em vez de um Redis real")
+    main(parser.parse_args())
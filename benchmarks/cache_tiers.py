@@ -0,0 +1,138 @@
+# Latência de controller.get_video (o detalhe de um vídeo) por nível da cache que responde:
+# - memory: hit na cache local do processo (sem ida ao Redis nem parse do JSON)
+# - redis: miss local, hit no Redis (uma ida ao Redis + orjson.loads)
+# - database: miss local e no Redis (query + escrita no Redis)
+# Mede também o parse de uma entrada com json.loads e orjson.loads, e a invalidação entre processos:
+# o tempo entre publicar um evento de alteração e a entrada desaparecer da cache local.
+# Usa uma base de dados SQLite temporária e o Redis de REDIS_HOST/REDIS_PORT (ou o fakeredis com --fake-redis).
+#
+# Exemplo:
+#   REDIS_HOST=localhost python benchmarks/cache_tiers.py --iterations 5000
+#   python benchmarks/cache_tiers.py --fake-redis
+
+# Imports Gerais
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+WORKDIR = tempfile.mkdtemp(prefix="ualflix-tiers-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(WORKDIR, 'catalog.db')}")
+os.environ.setdefault("UPLOAD_DIR", WORKDIR)
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "shared"))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "catalog_service"))
+
+# Imports Extra
+import orjson
+import redis
+import redis.asyncio as aioredis
+
+# Imports dos Ficheiros
+import async_controller
+import controller
+from model import Video, SessionLocal, init_db
+
+
+# Percentis (µs) de uma lista de durações (s)
+def summarize(samples: list) -> dict:
+    samples = sorted(samples)
+
+    def pct(p):
+        return round(samples[min(len(samples) - 1, int(p / 100 * len(samples)))] * 1e6, 1)
+    return {"n": len(samples), "p50_us": pct(50), "p95_us": pct(95), "p99_us": pct(99),
+            "mean_us": round(sum(samples) / len(samples) * 1e6, 1)}
+
+# Mede 'iterations' chamadas a get_video, preparando as caches antes de cada uma com 'prepare'
+def measure(db, redis_client, iterations: int, video_ids: list, prepare) -> list:
+    samples = []
+    for i in range(iterations):
+        video_id = video_ids[i % len(video_ids)]
+        prepare(video_id)
+        start = time.perf_counter()
+        controller.get_video(db, video_id, redis_client)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+# Tempo entre publicar um evento de alteração e a entrada sair da cache local (listener assíncrono)
+async def measure_invalidation(aredis_client, redis_client, db, video_id: int, rounds: int) -> list:
+    listener = asyncio.create_task(async_controller.listen_video_events(aredis_client))
+    await asyncio.sleep(0.2)
+    samples = []
+    try:
+        for _ in range(rounds):
+            controller.get_video(db, video_id, redis_client)
+            start = time.perf_counter()
+            controller.publish_video_event(redis_client, "update", video_id)
+            while controller.video_local_cache.get(f"video:{video_id}") is not None:
+                await asyncio.sleep(0)
+            samples.append(time.perf_counter() - start)
+    finally:
+        listener.cancel()
+    return samples
+
+def main(args):
+    if args.fake_redis:
+        import fakeredis
+        server = fakeredis.FakeServer()
+        redis_client = fakeredis.FakeRedis(server=server, decode_responses=True)
+        aredis_client = fakeredis.FakeAsyncRedis(server=server, decode_responses=True)
+    else:
+        host, port = os.getenv("REDIS_HOST", "localhost"), int(os.getenv("REDIS_PORT", "6379"))
+        redis_client = redis.Redis(host=host, port=port, decode_responses=True)
+        aredis_client = aioredis.Redis(host=host, port=port, decode_responses=True)
+
+    init_db()
+    with SessionLocal() as db:
+        db.add_all([Video(title=f"Video {i}", description="Níveis da cache " * 8, duration=60 + i,
+                          file_path=f"/bench/{i}.mp4", content_hash=f"{i:064x}")
+                    for i in range(args.videos)])
+        db.commit()
+        video_ids = [v.id for v in db.query(Video).all()]
+        local = controller.video_local_cache
+        keys = [f"video:{video_id}" for video_id in video_ids]
+
+        def cold(video_id):
+            local.invalidate(f"video:{video_id}")
+            redis_client.delete(f"video:{video_id}")
+
+        tiers = {
+            "database": measure(db, redis_client, args.iterations // 10 or 1, video_ids, cold),
+            "redis": measure(db, redis_client, args.iterations, video_ids,
+                             lambda video_id: local.invalidate(f"video:{video_id}")),
+        }
+        for video_id in video_ids:
+            controller.get_video(db, video_id, redis_client)
+        tiers["memory"] = measure(db, redis_client, args.iterations, video_ids, lambda video_id: None)
+
+        raw = json.dumps(controller.video_to_dict(db.get(Video, video_ids[0])))
+        parse = {}
+        for name, fn in (("json", json.loads), ("orjson", orjson.loads)):
+            samples = []
+            for _ in range(args.iterations):
+                start = time.perf_counter()
+                fn(raw)
+                samples.append(time.perf_counter() - start)
+            parse[name] = summarize(samples)
+
+        invalidation = asyncio.run(measure_invalidation(aredis_client, redis_client, db, video_ids[0], 50))
+        redis_client.delete(*keys)
+
+    print(json.dumps({
+        "iterations": args.iterations,
+        "videos": args.videos,
+        "redis": "fakeredis" if args.fake_redis else "redis",
+        "get_video": {tier: summarize(samples) for tier, samples in tiers.items()},
+        "parse": parse,
+        "pubsub_invalidation": summarize(invalidation),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Latência do detalhe de um vídeo por nível da cache")
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--videos", type=int, default=100)
+    parser.add_argument("--fake-redis", action="store_true", help="Usa o fakeredis em vez de um Redis real")
+    main(parser.parse_args())
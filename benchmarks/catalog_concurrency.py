@@ -0,0 +1,98 @@
+# Benchmark de concorrência do catalog_service: camada síncrona (threadpool) vs assíncrona (DB_ASYNC).
+# Arranca o catalog_service com uvicorn em cada modo, sempre com a mesma THREADPOOL_SIZE, e mantém
+# N clientes concorrentes (1000 por omissão) a pedir a listagem, o detalhe de vídeos e o /healthz.
+# Usa a base de dados e o Redis configurados pelas variáveis de ambiente do serviço (DB_HOST, REDIS_HOST, ...).
+#
+# Exemplo (1k clientes, threadpool fixa em 40 threads; pode ser preciso subir o 'ulimit -n'):
+#   DB_HOST=localhost REDIS_HOST=localhost python benchmarks/catalog_concurrency.py --concurrency 1000 --threads 40
+
+# Imports Gerais
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import subprocess
+import sys
+import time
+
+# Imports Extra
+import httpx
+
+# Imports dos Ficheiros
+from load_test import percentile, worker
+
+CATALOG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "catalog_service")
+SHARED_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "shared")
+
+
+# Arranca o catalog_service num processo uvicorn com o modo e a threadpool pedidos
+def start_server(port: int, db_async: bool, threads: int) -> subprocess.Popen:
+    env = dict(os.environ, DB_ASYNC=str(db_async).lower(), THREADPOOL_SIZE=str(threads),
+               PYTHONPATH=os.pathsep.join(filter(None, [SHARED_DIR, os.getenv("PYTHONPATH")])))
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--port", str(port), "--log-level", "warning"],
+        cwd=CATALOG_DIR, env=env)
+
+# Espera até o serviço responder ao /healthz
+async def wait_ready(client: httpx.AsyncClient, base: str, timeout: float = 60.0):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            if (await client.get(f"{base}/healthz")).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.5)
+    raise RuntimeError(f"O catalog_service não arrancou em {timeout}s")
+
+# Mede RPS e latências de um modo com 'concurrency' clientes durante 'duration' segundos
+async def run_mode(args, db_async: bool) -> dict:
+    base = f"http://127.0.0.1:{args.port}"
+    server = start_server(args.port, db_async, args.threads)
+    try:
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+            await wait_ready(client, base)
+            ids = [v["id"] for v in (await client.get(f"{base}/videos/?limit=50")).json()["items"]]
+            paths = ["/videos/?limit=20", "/healthz"] + [f"/videos/{i}" for i in ids]
+            urls = itertools.cycle(f"{base}{p}" for p in paths)
+
+            latencies, errors = [], []
+            started = time.perf_counter()
+            deadline = started + args.duration
+            await asyncio.gather(*[
+                worker(client, urls, deadline, latencies, errors) for _ in range(args.concurrency)])
+            elapsed = time.perf_counter() - started
+    finally:
+        server.terminate()
+        server.wait()
+
+    latencies.sort()
+    return {
+        "db_async": db_async,
+        "requests": len(latencies),
+        "errors": len(errors),
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+    }
+
+async def main(args):
+    results = [await run_mode(args, db_async) for db_async in (False, True)]
+    print(json.dumps({
+        "concurrency": args.concurrency,
+        "threadpool_size": args.threads,
+        "duration_s": args.duration,
+        "results": results,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="RPS do catalog_service com camada síncrona vs assíncrona")
+    parser.add_argument("--concurrency", type=int, default=1000)
+    parser.add_argument("--threads", type=int, default=40, help="THREADPOOL_SIZE fixa em ambos os modos")
+    parser.add_argument("--duration", type=float, default=30.0, help="Duração de cada modo em segundos")
+    parser.add_argument("--port", type=int, default=5050)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    asyncio.run(main(parser.parse_args()))
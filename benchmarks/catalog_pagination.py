@@ -0,0 +1,100 @@
+# Benchmark da paginação da listagem do catálogo: OFFSET vs keyset (cursor).
+# Povoa a tabela 'videos' com N linhas sintéticas e mede o tempo de obter uma página a várias profundidades.
+# Usa a base de dados configurada pelas mesmas variáveis de ambiente do catalog_service (DB_HOST, DB_USER, ...).
+#
+# Exemplo (1M de linhas numa base de dados de teste):
+#   DB_HOST=localhost python benchmarks/catalog_pagination.py --rows 1000000
+
+# Imports Gerais
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "shared"))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "catalog_service"))
+
+# Imports Extra
+from sqlalchemy import text, tuple_
+
+# Imports dos Ficheiros
+from model import Video, SessionLocal, engine, init_db
+
+
+# Insere linhas sintéticas até a tabela ter pelo menos 'rows' vídeos
+def seed(rows: int):
+    with engine.begin() as conn:
+        existing = conn.execute(text("SELECT count(*) FROM videos")).scalar()
+        missing = rows - existing
+        if missing <= 0:
+            return existing
+        if engine.dialect.name == "postgresql":
+            conn.execute(text("""
+                INSERT INTO videos (title, description, duration, file_path, upload_time, updated_time)
+                SELECT 'Video ' || g, 'Descrição sintética ' || g, (g % 600), '/bench/' || g || '-' || :base || '.mp4',
+                       now() - (g || ' seconds')::interval, now()
+                FROM generate_series(1, :n) AS g"""), {"n": missing, "base": existing})
+        else:
+            now = datetime.utcnow()
+            batch = []
+            for g in range(missing):
+                batch.append({
+                    "title": f"Video {g}", "description": f"Descrição sintética {g}", "duration": g % 600,
+                    "file_path": f"/bench/{g}-{existing}.mp4",
+                    "upload_time": now - timedelta(seconds=g), "updated_time": now})
+                if len(batch) == 10000:
+                    conn.execute(Video.__table__.insert(), batch)
+                    batch = []
+            if batch:
+                conn.execute(Video.__table__.insert(), batch)
+    return rows
+
+# Mede a mediana (ms) de 'repeat' execuções de uma função
+def timed(fn, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return round(statistics.median(samples), 2)
+
+def main(args):
+    init_db()
+    total = seed(args.rows)
+    db = SessionLocal()
+    order = (Video.upload_time.desc(), Video.id.desc())
+    results = []
+    for depth in args.depths:
+        if depth >= total:
+            continue
+
+        def offset_page():
+            return db.query(Video).order_by(*order).offset(depth).limit(args.page_size).all()
+
+        # O cursor é o último elemento da página anterior (obtido uma vez, fora da medição)
+        anchor = db.query(Video.upload_time, Video.id).order_by(*order).offset(max(depth - 1, 0)).limit(1).one()
+
+        def keyset_page():
+            return (db.query(Video)
+                    .filter(tuple_(Video.upload_time, Video.id) < tuple(anchor))
+                    .order_by(*order).limit(args.page_size).all())
+
+        results.append({
+            "depth": depth,
+            "offset_ms": timed(offset_page, args.repeat),
+            "keyset_ms": timed(keyset_page, args.repeat),
+        })
+    db.close()
+    print(json.dumps({"rows": total, "page_size": args.page_size, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Paginação OFFSET vs keyset na tabela de vídeos")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--depths", type=int, nargs="+", default=[0, 1_000, 10_000, 100_000, 500_000, 990_000])
+    main(parser.parse_args())
@@ -0,0 +1,92 @@
+# Benchmark da pesquisa de texto integral do catálogo (PostgreSQL, índice GIN sobre search_vector).
+# Povoa a tabela 'videos' com N vídeos sintéticos com títulos e descrições gerados a partir de um
+# vocabulário e mede as latências p50/p99 de pesquisas por prefixo e aproximadas, sem a cache Redis.
+#
+# Exemplo (catálogo sintético de 1M de vídeos):
+#   DB_HOST=localhost python benchmarks/catalog_search.py --rows 1000000 --queries 2000
+
+# Imports Gerais
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "shared"))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "catalog_service"))
+
+# Imports Extra
+from sqlalchemy import text
+
+# Imports dos Ficheiros
+from controller import query_search
+from model import SessionLocal, engine, init_db
+
+VOCABULARY = [
+    "aventura", "comedia", "drama", "viagem", "cozinha", "futebol", "musica", "ciencia", "historia",
+    "natureza", "oceano", "montanha", "cidade", "noite", "verao", "inverno", "tutorial", "receita",
+    "concerto", "documentario", "animacao", "corrida", "tecnologia", "espaco", "robot", "floresta",
+    "praia", "lisboa", "porto", "festival", "entrevista", "treino", "jogo", "arte", "danca", "teatro",
+]
+
+# Insere vídeos sintéticos até a tabela ter pelo menos 'rows' linhas (gerados no próprio PostgreSQL)
+def seed(rows: int) -> int:
+    with engine.begin() as conn:
+        existing = conn.execute(text("SELECT count(*) FROM videos")).scalar()
+        missing = rows - existing
+        if missing > 0:
+            conn.execute(text("""
+                INSERT INTO videos (title, description, duration, file_path, upload_time, updated_time)
+                SELECT initcap(v[1 + g % n] || ' ' || v[1 + (g / n) % n] || ' ' || v[1 + (g / (n * n)) % n]),
+                       'Um video sobre ' || v[1 + (g * 7) % n] || ' e ' || v[1 + (g * 13) % n],
+                       g % 600, '/bench/search-' || g || '-' || :base || '.mp4', now(), now()
+                FROM generate_series(1, :missing) AS g,
+                     (SELECT :vocab ::text[] AS v, cardinality(:vocab ::text[]) AS n) AS vocab
+                """), {"missing": missing, "base": existing, "vocab": VOCABULARY})
+            conn.execute(text("ANALYZE videos"))
+    return max(rows, existing)
+
+# Gera uma pesquisa aleatória: prefixos de 1 a 3 palavras ou uma palavra com um erro (pesquisa aproximada)
+def random_query() -> str:
+    if random.random() < 0.1:
+        word = random.choice(VOCABULARY)
+        i = random.randrange(len(word))
+        return word[:i] + word[i + 1:] + "x"
+    words = random.sample(VOCABULARY, random.randint(1, 3))
+    return " ".join(w[:random.randint(3, len(w))] for w in words)
+
+def percentile(sorted_values, p):
+    return sorted_values[max(0, min(len(sorted_values) - 1, round(p / 100 * (len(sorted_values) - 1))))]
+
+def main(args):
+    if engine.dialect.name != "postgresql":
+        sys.exit("Este benchmark requer PostgreSQL (pesquisa com tsvector e pg_trgm)")
+    init_db()
+    total = seed(args.rows)
+    db = SessionLocal()
+    latencies, fuzzy = [], 0
+    for _ in range(args.queries):
+        q = random_query()
+        start = time.perf_counter()
+        _, was_fuzzy = query_search(db, q, args.limit)
+        latencies.append((time.perf_counter() - start) * 1000)
+        fuzzy += was_fuzzy
+    db.close()
+    latencies.sort()
+    print(json.dumps({
+        "rows": total,
+        "queries": args.queries,
+        "fuzzy_queries": fuzzy,
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+        "max_ms": round(latencies[-1], 2),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Latência da pesquisa de texto integral do catálogo")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--limit", type=int, default=20)
+    main(parser.parse_args())
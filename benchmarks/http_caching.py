@@ -0,0 +1,98 @@
+# Bytes servidos numa carga de visitas repetidas, com e sem cache HTTP no cliente.
+# Cada visita pede a listagem do catálogo, o detalhe de N vídeos e o início de cada vídeo através do
+# ui_service (/stream/{id}?v=<versão>, com Range), como a página de um vídeo.
+# - no_cache: o cliente descarta tudo entre visitas (o comportamento forçado antes pelos cabeçalhos no-store
+#   e pela falta de validadores no stream)
+# - browser: o cliente guarda as respostas como um browser ou uma cache intermédia: as imutáveis são
+#   reutilizadas sem pedido e as restantes são revalidadas com If-None-Match/If-Modified-Since (304 sem corpo)
+# Reporta, por modo, os pedidos enviados, as respostas 304, as respostas reutilizadas sem pedido e os bytes
+# do corpo recebidos, e a redução de bytes a partir da segunda visita.
+#
+# Exemplo (requer os serviços em execução):
+#   python benchmarks/http_caching.py --catalog-url http://localhost:5000 --ui-url http://localhost:8000 \
+#       --videos 20 --visits 5
+
+# Imports Gerais
+import argparse
+import asyncio
+import json
+from datetime import datetime
+
+# Imports Extra
+import httpx
+
+
+# Cache HTTP mínima de um cliente: guarda o corpo e os validadores de cada pedido (URL + Range)
+class ClientCache:
+    def __init__(self, enabled: bool):
+        self.enabled = enabled
+        self.entries = {}
+        self.stats = {"requests": 0, "not_modified": 0, "reused": 0, "body_bytes": 0}
+
+    async def get(self, client: httpx.AsyncClient, url: str, headers: dict = None) -> bytes:
+        headers = dict(headers or {})
+        key = (url, headers.get("Range"))
+        entry = self.entries.get(key) if self.enabled else None
+        if entry is not None:
+            if "immutable" in entry["cache_control"]:
+                self.stats["reused"] += 1
+                return entry["body"]
+            if entry["etag"]:
+                headers["If-None-Match"] = entry["etag"]
+            elif entry["last_modified"]:
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        resp = await client.get(url, headers=headers)
+        self.stats["requests"] += 1
+        if resp.status_code == 304 and entry is not None:
+            self.stats["not_modified"] += 1
+            return entry["body"]
+        resp.raise_for_status()
+        self.stats["body_bytes"] += len(resp.content)
+        if self.enabled and "no-store" not in resp.headers.get("cache-control", ""):
+            self.entries[key] = {"body": resp.content, "etag": resp.headers.get("etag"),
+                                 "last_modified": resp.headers.get("last-modified"),
+                                 "cache_control": resp.headers.get("cache-control", "")}
+        return resp.content
+
+# Uma visita: listagem, detalhe de cada vídeo e o início do vídeo através do ui_service
+async def visit(client: httpx.AsyncClient, cache: ClientCache, args) -> None:
+    page = json.loads(await cache.get(client, f"{args.catalog_url}/videos/?limit={args.videos}"))
+    for item in page["items"][:args.videos]:
+        video = json.loads(await cache.get(client, f"{args.catalog_url}/videos/{item['id']}"))
+        version = int(datetime.fromisoformat(video["updated_time"]).timestamp())
+        await cache.get(client, f"{args.ui_url}/stream/{video['id']}?v={version}",
+                        {"Range": f"bytes=0-{args.range_bytes - 1}"})
+
+# Corre as visitas com um modo de cache e devolve as estatísticas da primeira visita e das seguintes
+async def run_mode(enabled: bool, args) -> dict:
+    cache = ClientCache(enabled)
+    async with httpx.AsyncClient(timeout=60) as client:
+        await visit(client, cache, args)
+        first = dict(cache.stats)
+        for _ in range(args.visits - 1):
+            await visit(client, cache, args)
+    repeat = {k: cache.stats[k] - first[k] for k in cache.stats}
+    return {"first_visit": first, "repeat_visits": repeat}
+
+async def main(args):
+    results = {"no_cache": await run_mode(False, args), "browser": await run_mode(True, args)}
+    before = results["no_cache"]["repeat_visits"]["body_bytes"]
+    after = results["browser"]["repeat_visits"]["body_bytes"]
+    print(json.dumps({
+        "videos": args.videos,
+        "visits": args.visits,
+        "range_bytes": args.range_bytes,
+        **results,
+        "repeat_bytes_reduction_pct": round((1 - after / before) * 100, 1) if before else None,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bytes servidos em visitas repetidas, com e sem cache HTTP")
+    parser.add_argument("--catalog-url", default="http://localhost:5000")
+    parser.add_argument("--ui-url", default="http://localhost:8000")
+    parser.add_argument("--videos", type=int, default=20, help="Vídeos abertos em cada visita")
+    parser.add_argument("--visits", type=int, default=5)
+    parser.add_argument("--range-bytes", type=int, default=1024 * 1024, help="Bytes pedidos do início de cada vídeo")
+    asyncio.run(main(parser.parse_args()))
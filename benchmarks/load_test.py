@@ -0,0 +1,79 @@
+# Teste de carga simples para as rotas HTTP dos serviços.
+# Mantém N clientes concorrentes a fazer pedidos durante um tempo fixo e reporta RPS e latências p50/p99.
+#
+# Exemplo (correr no commit antigo e no novo e comparar):
+#   python benchmarks/load_test.py --url http://localhost:8000/ --url http://localhost:8000/watch/1 \
+#       --concurrency 50 --duration 30 --pool-url http://localhost:8000/metrics/http-pool
+
+# Imports Gerais
+import argparse
+import asyncio
+import itertools
+import json
+import time
+
+# Imports Extra
+import httpx
+
+
+# Calcula o percentil p (0-100) de uma lista de valores já ordenada
+def percentile(sorted_values: list, p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    k = max(0, min(len(sorted_values) - 1, round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[k]
+
+# Um cliente que faz pedidos em ciclo até ao fim do teste
+async def worker(client: httpx.AsyncClient, urls, deadline: float, latencies: list, errors: list):
+    while time.perf_counter() < deadline:
+        url = next(urls)
+        start = time.perf_counter()
+        try:
+            resp = await client.get(url)
+            await resp.aread()
+            if resp.status_code >= 400:
+                errors.append(resp.status_code)
+                continue
+        except httpx.HTTPError as e:
+            errors.append(type(e).__name__)
+            continue
+        latencies.append(time.perf_counter() - start)
+
+async def main(args):
+    urls = itertools.cycle(args.url)
+    latencies, errors = [], []
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        started = time.perf_counter()
+        deadline = started + args.duration
+        await asyncio.gather(*[
+            worker(client, urls, deadline, latencies, errors) for _ in range(args.concurrency)])
+        elapsed = time.perf_counter() - started
+
+        pool = None
+        if args.pool_url:
+            pool = (await client.get(args.pool_url)).json()
+
+    latencies.sort()
+    report = {
+        "urls": args.url,
+        "concurrency": args.concurrency,
+        "duration_s": round(elapsed, 2),
+        "requests": len(latencies),
+        "errors": len(errors),
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "pool": pool,
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Teste de carga: RPS e latências p50/p99")
+    parser.add_argument("--url", action="append", required=True, help="URL a testar (pode repetir)")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=30.0, help="Duração do teste em segundos")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--pool-url", help="Endpoint de métricas do pool a ler no fim do teste")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,134 @@
+# Latência dos viewers normais do streaming_service com e sem um cliente abusivo.
+# Os viewers (cada um com o seu IP, enviado em X-Forwarded-For) pedem ranges de --read-bytes de vídeos ao
+# acaso, com uma pausa entre pedidos, como um player; o abusador abre --abusers ligações do mesmo IP que
+# descarregam vídeos inteiros sem parar e sem respeitar o Retry-After.
+# Corre duas fases (só viewers e viewers + abusador) e reporta, por fase, as latências p50/p95/p99 e os
+# estados das respostas dos viewers e, na segunda, os estados e os bytes recebidos pelo abusador.
+# Para comparar, corre-se com os limites do streaming_service desativados (RATE_LIMIT_IP_RATE=0,
+# STREAM_MAX_ACTIVE=0) e ativos: com os limites, a latência dos viewers deve manter-se perto da da 1.ª fase.
+#
+# O streaming_service tem de aceitar o X-Forwarded-For do benchmark (RATE_LIMIT_FORWARDED_HOPS=1 e o endereço
+# de onde o benchmark corre em RATE_LIMIT_TRUSTED_PROXIES); caso contrário todos os pedidos contam para o
+# mesmo IP.
+#
+# Exemplo (requer os serviços em execução, com o streaming_service acessível diretamente):
+#   python benchmarks/stream_abuse.py --url http://localhost:5001 --video-ids 1,2,3 --clients 20 --abusers 100
+
+# Imports Gerais
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import Counter
+
+# Imports Extra
+import httpx
+
+
+# Percentis (ms) de uma lista de durações (s)
+def summarize(samples: list) -> dict:
+    samples = sorted(samples)
+    if not samples:
+        return {"n": 0}
+
+    def pct(p):
+        return round(samples[min(len(samples) - 1, int(p / 100 * len(samples)))] * 1000, 1)
+    return {"n": len(samples), "p50_ms": pct(50), "p95_ms": pct(95), "p99_ms": pct(99), "max_ms": pct(100)}
+
+# Tamanho de cada vídeo, a partir do Content-Range de um pedido do primeiro byte
+async def video_sizes(client: httpx.AsyncClient, url: str, video_ids: list) -> dict:
+    sizes = {}
+    for video_id in video_ids:
+        resp = await client.get(f"{url}/stream/{video_id}", headers={"Range": "bytes=0-0"})
+        resp.raise_for_status()
+        sizes[video_id] = int(resp.headers["content-range"].rsplit("/", 1)[1])
+    return sizes
+
+# Viewer: ranges de vídeos ao acaso até ao fim da fase, com uma pausa entre pedidos
+async def viewer(client: httpx.AsyncClient, args, sizes: dict, ip: str, deadline: float, rng: random.Random,
+                 samples: list, statuses: Counter):
+    while time.perf_counter() < deadline:
+        video_id = rng.choice(list(sizes))
+        start = rng.randrange(0, max(1, sizes[video_id] - args.read_bytes))
+        headers = {"Range": f"bytes={start}-{start + args.read_bytes - 1}", "X-Forwarded-For": ip}
+        began = time.perf_counter()
+        try:
+            async with client.stream("GET", f"{args.url}/stream/{video_id}", headers=headers) as resp:
+                async for _ in resp.aiter_raw():
+                    pass
+            statuses[resp.status_code] += 1
+            if resp.status_code == 206:
+                samples.append(time.perf_counter() - began)
+        except httpx.HTTPError as e:
+            statuses[type(e).__name__] += 1
+        await asyncio.sleep(args.think)
+
+# Abusador: downloads completos sem pausa, do mesmo IP
+async def abuser(client: httpx.AsyncClient, args, sizes: dict, deadline: float, rng: random.Random,
+                 statuses: Counter, received: list):
+    while time.perf_counter() < deadline:
+        video_id = rng.choice(list(sizes))
+        try:
+            async with client.stream("GET", f"{args.url}/stream/{video_id}",
+                                     headers={"X-Forwarded-For": args.abuser_ip}) as resp:
+                async for chunk in resp.aiter_raw():
+                    received[0] += len(chunk)
+            statuses[resp.status_code] += 1
+        except httpx.HTTPError as e:
+            statuses[type(e).__name__] += 1
+        await asyncio.sleep(0)
+
+# Uma fase: os viewers e, opcionalmente, o abusador durante 'duration' segundos
+async def run_phase(args, sizes: dict, with_abuser: bool, duration: float) -> dict:
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    samples, viewer_statuses, abuser_statuses, received = [], Counter(), Counter(), [0]
+    deadline = time.perf_counter() + duration
+    async with httpx.AsyncClient(timeout=60, limits=limits) as viewers, \
+            httpx.AsyncClient(timeout=60, limits=limits) as abusers:
+        tasks = [viewer(viewers, args, sizes, f"198.51.100.{i % 250 + 1}", deadline, random.Random(args.seed + i),
+                        samples, viewer_statuses) for i in range(args.clients)]
+        if with_abuser:
+            tasks += [abuser(abusers, args, sizes, deadline, random.Random(-args.seed - i), abuser_statuses, received)
+                      for i in range(args.abusers)]
+        await asyncio.gather(*tasks)
+    result = {"viewers": {**summarize(samples), "statuses": dict(viewer_statuses)}}
+    if with_abuser:
+        result["abuser"] = {"statuses": dict(abuser_statuses), "mb_received": round(received[0] / 1e6, 1)}
+    return result
+
+async def main(args):
+    video_ids = [int(v) for v in args.video_ids.split(",")]
+    async with httpx.AsyncClient(timeout=30) as client:
+        sizes = await video_sizes(client, args.url, video_ids)
+    # Aquecimento (caches de metadados e de blocos, ligações), fora das medições
+    if args.warmup > 0:
+        await run_phase(args, sizes, with_abuser=False, duration=args.warmup)
+    baseline = await run_phase(args, sizes, with_abuser=False, duration=args.duration)
+    # Deixa os token buckets dos viewers recuperarem entre as fases
+    await asyncio.sleep(args.pause)
+    abuse = await run_phase(args, sizes, with_abuser=True, duration=args.duration)
+    print(json.dumps({
+        "url": args.url,
+        "clients": args.clients,
+        "abusers": args.abusers,
+        "read_bytes": args.read_bytes,
+        "baseline": baseline,
+        "abuse": abuse,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Latência dos viewers do streaming com e sem um cliente abusivo")
+    parser.add_argument("--url", default="http://localhost:5001", help="URL base do streaming_service")
+    parser.add_argument("--video-ids", default="1", help="Ids dos vídeos, separados por vírgulas")
+    parser.add_argument("--clients", type=int, default=20, help="Viewers normais (um IP cada)")
+    parser.add_argument("--abusers", type=int, default=100, help="Ligações concorrentes do cliente abusivo")
+    parser.add_argument("--abuser-ip", default="203.0.113.66")
+    parser.add_argument("--duration", type=float, default=20.0, help="Duração de cada fase (s)")
+    parser.add_argument("--warmup", type=float, default=5.0, help="Aquecimento antes da 1.ª fase (s)")
+    parser.add_argument("--read-bytes", type=int, default=256 * 1024, help="Bytes de cada range dos viewers")
+    parser.add_argument("--think", type=float, default=0.25, help="Pausa entre pedidos de um viewer (s)")
+    parser.add_argument("--pause", type=float, default=2.0, help="Pausa entre as fases (s)")
+    parser.add_argument("--seed", type=int, default=1234)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,88 @@
+# Benchmark do proxy de streaming do ui_service.
+# Mede o tempo até ao primeiro byte (TTFB), o débito e o pico de memória (RSS) do processo do ui_service
+# enquanto se descarrega um vídeo grande através de /stream/{video_id}.
+#
+# Exemplo (ficheiro de 2 GB registado no catálogo com o id 1, ui_service com o PID 1234):
+#   truncate -s 2G /app/videos/bench.mp4
+#   python benchmarks/stream_proxy.py --url http://localhost:8000/stream/1 --pid 1234 --runs 3
+#   python benchmarks/stream_proxy.py --url http://localhost:8000/stream/1 --pid 1234 --range "bytes=0-"
+#
+# Para comparar antes/depois basta correr o mesmo comando com o ui_service em cada commit.
+
+# Imports Gerais
+import argparse
+import asyncio
+import json
+import time
+
+# Imports Extra
+import httpx
+
+
+# Lê a memória residente atual (em bytes) de um processo a partir do /proc
+def read_rss(pid: int) -> int:
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+# Amostra o RSS do processo periodicamente e guarda o valor máximo observado
+async def sample_rss(pid: int, peak: dict, interval: float = 0.05):
+    while True:
+        try:
+            peak["rss"] = max(peak["rss"], read_rss(pid))
+        except FileNotFoundError:
+            return
+        await asyncio.sleep(interval)
+
+# Faz um download completo e mede TTFB, duração total e bytes recebidos
+async def run_once(client: httpx.AsyncClient, url: str, range_header: str = None) -> dict:
+    headers = {"Range": range_header} if range_header else {}
+    start = time.perf_counter()
+    ttfb = None
+    received = 0
+    async with client.stream("GET", url, headers=headers) as resp:
+        async for chunk in resp.aiter_raw():
+            if ttfb is None:
+                ttfb = time.perf_counter() - start
+            received += len(chunk)
+        status = resp.status_code
+    total = time.perf_counter() - start
+    return {
+        "status": status,
+        "ttfb_s": round(ttfb or total, 4),
+        "total_s": round(total, 3),
+        "bytes": received,
+        "mb_per_s": round(received / total / 1e6, 1) if total else 0.0,
+    }
+
+async def main(args):
+    peak = {"rss": 0}
+    sampler = asyncio.create_task(sample_rss(args.pid, peak)) if args.pid else None
+    baseline_rss = read_rss(args.pid) if args.pid else 0
+
+    results = []
+    async with httpx.AsyncClient(timeout=httpx.Timeout(30.0, read=None)) as client:
+        for _ in range(args.runs):
+            results.append(await run_once(client, args.url, args.range))
+
+    if sampler:
+        sampler.cancel()
+    report = {
+        "url": args.url,
+        "range": args.range,
+        "runs": results,
+        "baseline_rss_mb": round(baseline_rss / 2**20, 1),
+        "peak_rss_mb": round(peak["rss"] / 2**20, 1),
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark do proxy /stream do ui_service")
+    parser.add_argument("--url", required=True, help="URL do stream, p.ex. http://localhost:8000/stream/1")
+    parser.add_argument("--pid", type=int, help="PID do processo do ui_service para medir o RSS")
+    parser.add_argument("--range", help="Cabeçalho Range a enviar, p.ex. 'bytes=0-'")
+    parser.add_argument("--runs", type=int, default=1)
+    asyncio.run(main(parser.parse_args()))
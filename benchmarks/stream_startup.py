@@ -0,0 +1,128 @@
+# Benchmark do arranque da reprodução de um vídeo (streaming_service ou ui_service).
+# Simula o que o browser faz antes de conseguir mostrar a primeira imagem de um MP4: lê o ficheiro desde o
+# início até ao 'moov'; se ele estiver no fim (ficheiro sem faststart) tem de saltar o 'mdat' e voltar,
+# com um pedido novo em cada salto.
+# Mede o número de pedidos e o tempo até ter o 'moov' e o primeiro bloco de dados, e o tempo de um seek
+# por tempo: a consulta do índice de keyframes do streaming_service seguida do Range a partir desse offset.
+#
+# Exemplo (vídeo 1, seek aos 60 s):
+#   python benchmarks/stream_startup.py --url http://localhost:5001/stream/1 --seek 60 --runs 20
+
+# Imports Gerais
+import argparse
+import json
+import statistics
+import struct
+import time
+
+# Imports Extra
+import httpx
+
+
+# Leitura sequencial de um pedido 'Range: bytes=<offset>-' aberto, como a que o browser faz
+class RangeReader:
+    def __init__(self, client: httpx.Client, url: str, offset: int):
+        self.cm = client.stream("GET", url, headers={"Range": f"bytes={offset}-"})
+        resp = self.cm.__enter__()
+        resp.raise_for_status()
+        self.total = int(resp.headers["content-range"].rsplit("/", 1)[1])
+        self.chunks = resp.iter_bytes()
+        self.buffer = b""
+
+    def read(self, n: int) -> bytes:
+        while len(self.buffer) < n:
+            chunk = next(self.chunks, b"")
+            if not chunk:
+                break
+            self.buffer += chunk
+        data, self.buffer = self.buffer[:n], self.buffer[n:]
+        return data
+
+    def close(self):
+        self.cm.__exit__(None, None, None)
+
+# Arranque de um player: lê as caixas de topo em sequência até ter o 'moov' completo e o início do
+# 'mdat'. Cada salto (p.ex. por cima do 'mdat' até ao 'moov' no fim do ficheiro, e de volta) é um pedido novo.
+def startup(client: httpx.Client, url: str, probe_bytes: int) -> dict:
+    started = time.perf_counter()
+    reader, requests, offset = RangeReader(client, url, 0), 1, 0
+    moov_found, mdat_start = False, None
+    try:
+        while offset + 8 <= reader.total:
+            header = reader.read(8)
+            box_size, box_type = struct.unpack(">I4s", header)
+            header_size = 8
+            if box_size == 1:
+                box_size = struct.unpack(">Q", reader.read(8))[0]
+                header_size = 16
+            elif box_size == 0:
+                box_size = reader.total - offset
+            if box_type == b"mdat":
+                mdat_start = offset
+                if moov_found:
+                    reader.read(probe_bytes)
+                    break
+                # Sem 'moov' ainda: salta os dados do vídeo
+                reader.close()
+                offset += box_size
+                reader, requests = RangeReader(client, url, offset), requests + 1
+                continue
+            reader.read(box_size - header_size)
+            offset += box_size
+            if box_type == b"moov":
+                moov_found = True
+        else:
+            # O 'moov' estava depois dos dados: volta ao início do 'mdat'
+            if moov_found and mdat_start is not None:
+                reader.close()
+                reader, requests = RangeReader(client, url, mdat_start), requests + 1
+                reader.read(probe_bytes)
+    finally:
+        reader.close()
+    return {"requests": requests, "seconds": time.perf_counter() - started, "moov_found": moov_found}
+
+# Seek por tempo: o offset do keyframe anterior ao instante pedido vem do índice de keyframes
+# (GET /stream/{id}/keyframe?t=) e é pedido com um Range a partir desse offset
+def seek(client: httpx.Client, url: str, t: float, probe_bytes: int) -> dict:
+    started = time.perf_counter()
+    lookup = client.get(f"{url}/keyframe", params={"t": t})
+    lookup.raise_for_status()
+    keyframe = lookup.json()
+    with client.stream("GET", url, headers={"Range": f"bytes={keyframe['offset']}-"}) as resp:
+        for _ in resp.iter_bytes(probe_bytes):
+            break
+        return {"status": resp.status_code, "seconds": time.perf_counter() - started,
+                "keyframe_time": keyframe["time"], "offset": keyframe["offset"]}
+
+def main(args):
+    startups, seeks = [], []
+    with httpx.Client(timeout=30.0) as client:
+        for _ in range(args.runs):
+            startups.append(startup(client, args.url, args.probe_bytes))
+            if args.seek is not None:
+                seeks.append(seek(client, args.url, args.seek, args.probe_bytes))
+
+    report = {
+        "url": args.url,
+        "runs": args.runs,
+        "startup_requests": startups[0]["requests"],
+        "moov_found": startups[0]["moov_found"],
+        "startup_ms_p50": round(statistics.median(s["seconds"] for s in startups) * 1000, 2),
+    }
+    if seeks:
+        report.update({
+            "seek_status": seeks[0]["status"],
+            "seek_keyframe_time": seeks[0]["keyframe_time"],
+            "seek_offset": seeks[0]["offset"],
+            "seek_ttfb_ms_p50": round(statistics.median(s["seconds"] for s in seeks) * 1000, 2),
+        })
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pedidos e latência até à primeira imagem de um vídeo")
+    parser.add_argument("--url", required=True, help="p.ex. http://localhost:5001/stream/1")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--seek", type=float, help="Instante (s) para medir o seek por tempo (índice de keyframes + Range)")
+    parser.add_argument("--probe-bytes", type=int, default=64 * 1024, help="Bytes lidos em cada pedido do player")
+    main(parser.parse_args())
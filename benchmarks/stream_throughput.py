@@ -0,0 +1,125 @@
+# Benchmark de débito do streaming_service.
+# Vários clientes pedem ranges aleatórios de um vídeo durante um tempo fixo; mede bytes/s e o tempo
+# de CPU gasto pelo processo do servidor, reportando bytes servidos por segundo de CPU.
+#
+# Os ranges do streaming_service são copiados em Python (blocos lidos do ficheiro ou da cache e enviados pelo
+# uvicorn), porque o ASGI não dá acesso ao socket para um os.sendfile. Com --sendfile-server, este script
+# serve o mesmo ficheiro com um servidor HTTP mínimo que envia cada range com sendfile (zero-copy), como
+# referência do custo dessa cópia.
+#
+# Exemplo (envio direto do ficheiro, cache de blocos e sendfile):
+#   STREAM_CACHE_ENABLED=false uvicorn app:app --port 5001   # num terminal
+#   python benchmarks/stream_throughput.py --url http://localhost:5001/stream/1 --pid <PID> --size 3000000000
+#   STREAM_CACHE_ENABLED=true  uvicorn app:app --port 5001
+#   python benchmarks/stream_throughput.py --url http://localhost:5001/stream/1 --pid <PID> --size 3000000000
+#   python benchmarks/stream_throughput.py --sendfile-server /app/videos/<ficheiro> --port 5002
+#   python benchmarks/stream_throughput.py --url http://localhost:5002/ --pid <PID> --size 3000000000
+
+# Imports Gerais
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import time
+
+# Imports Extra
+import httpx
+
+
+# Tempo de CPU (utilizador + sistema) consumido até agora por um processo, em segundos
+def cpu_seconds(pid: int) -> float:
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    ticks = os.sysconf("SC_CLK_TCK")
+    return (int(fields[11]) + int(fields[12])) / ticks
+
+# Um cliente que pede ranges aleatórios em ciclo até ao fim do teste
+async def worker(client, url: str, size: int, range_size: int, multi: bool, deadline: float, totals: dict):
+    while time.perf_counter() < deadline:
+        start = random.randrange(0, max(1, size - range_size))
+        rng = f"bytes={start}-{start + range_size - 1}"
+        if multi:
+            second = random.randrange(0, max(1, size - range_size))
+            rng += f",{second}-{second + range_size - 1}"
+        async with client.stream("GET", url, headers={"Range": rng}) as resp:
+            async for chunk in resp.aiter_raw():
+                totals["bytes"] += len(chunk)
+        totals["requests"] += 1
+
+# Servidor HTTP/1.1 mínimo (keep-alive, só ranges simples) que envia cada range de 'path' com sendfile
+async def sendfile_server(path: str, port: int):
+    size = os.path.getsize(path)
+
+    async def handle(reader, writer):
+        loop = asyncio.get_running_loop()
+        with open(path, "rb") as f:
+            try:
+                while True:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                    m = re.search(rb"(?i)\r\nrange: *bytes=(\d+)-(\d*)", head)
+                    start = int(m.group(1)) if m else 0
+                    end = min(int(m.group(2)), size - 1) if m and m.group(2) else size - 1
+                    status = "206 Partial Content" if m else "200 OK"
+                    writer.write((f"HTTP/1.1 {status}\r\nContent-Type: video/mp4\r\n"
+                                  f"Content-Range: bytes {start}-{end}/{size}\r\n"
+                                  f"Content-Length: {end - start + 1}\r\n\r\n").encode())
+                    await writer.drain()
+                    await loop.sendfile(writer.transport, f, start, end - start + 1)
+            except (asyncio.IncompleteReadError, ConnectionError):
+                pass
+            finally:
+                writer.close()
+
+    server = await asyncio.start_server(handle, "0.0.0.0", port)
+    print(json.dumps({"sendfile_server": path, "port": port, "pid": os.getpid()}))
+    async with server:
+        await server.serve_forever()
+
+async def main(args):
+    totals = {"bytes": 0, "requests": 0}
+    cpu_before = cpu_seconds(args.pid) if args.pid else None
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(timeout=httpx.Timeout(30.0, read=None), limits=limits) as client:
+        started = time.perf_counter()
+        deadline = started + args.duration
+        await asyncio.gather(*[
+            worker(client, args.url, args.size, args.range_size, args.multi, deadline, totals)
+            for _ in range(args.concurrency)])
+        elapsed = time.perf_counter() - started
+
+    report = {
+        "url": args.url,
+        "concurrency": args.concurrency,
+        "range_size": args.range_size,
+        "multi_range": args.multi,
+        "requests": totals["requests"],
+        "mb_per_s": round(totals["bytes"] / elapsed / 1e6, 1),
+    }
+    if cpu_before is not None:
+        cpu = cpu_seconds(args.pid) - cpu_before
+        report["server_cpu_s"] = round(cpu, 2)
+        report["mb_per_cpu_s"] = round(totals["bytes"] / cpu / 1e6, 1) if cpu else None
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Débito do streaming_service em bytes por segundo de CPU")
+    parser.add_argument("--url", help="URL do stream, p.ex. http://localhost:5001/stream/1")
+    parser.add_argument("--size", type=int, help="Tamanho do ficheiro de vídeo em bytes")
+    parser.add_argument("--pid", type=int, help="PID do processo do streaming_service")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--range-size", type=int, default=4 * 1024 * 1024)
+    parser.add_argument("--multi", action="store_true", help="Pede dois ranges por pedido (multipart/byteranges)")
+    parser.add_argument("--sendfile-server", metavar="FICHEIRO",
+                        help="Em vez de medir, serve este ficheiro com sendfile (referência zero-copy)")
+    parser.add_argument("--port", type=int, default=5002, help="Porta do --sendfile-server")
+    args = parser.parse_args()
+    if args.sendfile_server:
+        asyncio.run(sendfile_server(args.sendfile_server, args.port))
+    elif not args.url or not args.size:
+        parser.error("--url e --size são obrigatórios para medir")
+    else:
+        asyncio.run(main(args))
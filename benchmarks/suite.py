@@ -0,0 +1,453 @@
+# Suite de benchmarks reprodutível dos três serviços, sem Docker nem infraestrutura externa.
+# Arranca o catalog_service, o streaming_service e o ui_service (uvicorn) sobre substitutos locais:
+# - Redis: um redis-server local numa porta livre, ou o fakeredis em modo TCP se não estiver instalado
+# - base de dados: SQLite num diretório temporário (ou DATABASE_URL/--database-url, p.ex. um Postgres local)
+# - vídeos: gerados com o ffmpeg (ou bytes pseudo-aleatórios sem ffmpeg), registados diretamente na base de dados
+# e corre três cargas com clientes concorrentes:
+# - browse: listagem paginada por cursor, detalhe, pesquisa e páginas do ui_service
+# - seek: reprodução com muitos seeks (pedidos Range em offsets aleatórios, lidos em parte e abandonados)
+# - upload: uploads multipart concorrentes para o catalog_service
+# Para cada carga regista RPS, latências p50/p95/p99, bytes/s e o pico de RSS de cada serviço. O resultado
+# é um JSON com o commit, os substitutos e os parâmetros usados, para comparar entre commits.
+#
+# Exemplo (correr em dois commits e comparar):
+#   python benchmarks/suite.py --output results-old.json
+#   python benchmarks/suite.py --output results-new.json
+#   python benchmarks/suite.py --compare results-old.json results-new.json
+
+# Imports Gerais
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+# Imports Extra
+import httpx
+
+# Imports dos Ficheiros
+from load_test import percentile
+from upload_memory import MultipartBody, rss_bytes
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+# Diretório e rota de saúde de cada serviço
+SERVICES = {
+    "catalog": ("catalog_service", "/healthz"),
+    "streaming": ("streaming_service", "/cache/stats"),
+    "ui": ("ui_service", "/healthz"),
+}
+# Métricas comparadas com --compare (True quando um valor maior é melhor)
+COMPARED_METRICS = {"rps": True, "p50_ms": False, "p95_ms": False, "p99_ms": False, "bytes_per_s": True,
+                    "rss_peak_mb": False}
+SEARCH_TERMS = ["bench", "video", "sintético", "clip", "12", "demo"]
+
+
+# Porta TCP livre em 127.0.0.1
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+# Redis local para os serviços: redis-server se existir, senão o fakeredis a servir o protocolo por TCP
+class RedisStandIn:
+    def __init__(self, mode: str):
+        self.mode = mode
+        self.port = free_port()
+        self.kind = None
+        self.process = None
+        self.server = None
+
+    def start(self):
+        binary = shutil.which("redis-server")
+        if self.mode == "server" or (self.mode == "auto" and binary):
+            if not binary:
+                raise RuntimeError("redis-server não encontrado")
+            self.process = subprocess.Popen(
+                [binary, "--port", str(self.port), "--bind", "127.0.0.1", "--save", "", "--appendonly", "no"],
+                stdout=subprocess.DEVNULL)
+            self.kind = "redis-server"
+        else:
+            from fakeredis import TcpFakeServer
+            self.server = TcpFakeServer(("127.0.0.1", self.port))
+            threading.Thread(target=self.server.serve_forever, daemon=True).start()
+            self.kind = "fakeredis"
+        wait_port(self.port)
+
+    def stop(self):
+        if self.process is not None:
+            self.process.terminate()
+            self.process.wait()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+# Espera até uma porta local aceitar ligações
+def wait_port(port: int, timeout: float = 10.0):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Nada a escutar na porta {port} após {timeout}s")
+
+# Gera 'count' vídeos de teste diferentes com o ffmpeg (ou ficheiros de bytes pseudo-aleatórios sem ffmpeg)
+def generate_videos(directory: str, count: int, seconds: int, fallback_bytes: int, seed: int) -> tuple:
+    os.makedirs(directory, exist_ok=True)
+    ffmpeg = shutil.which(os.getenv("FFMPEG_BIN", "ffmpeg"))
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, f"bench-{i}.mp4")
+        if ffmpeg:
+            subprocess.run(
+                [ffmpeg, "-y", "-hide_banner", "-loglevel", "error",
+                 "-f", "lavfi", "-i", f"testsrc2=size=1280x720:rate=30:duration={seconds}",
+                 "-f", "lavfi", "-i", f"sine=frequency={220 + 110 * i}:duration={seconds}",
+                 "-c:v", "libx264", "-preset", "ultrafast", "-g", "60", "-c:a", "aac",
+                 "-movflags", "+faststart", path],
+                check=True)
+        else:
+            rng = random.Random(seed + i)
+            with open(path, "wb") as f:
+                f.write(rng.randbytes(fallback_bytes))
+        paths.append(path)
+    return paths, "ffmpeg" if ffmpeg else "random"
+
+# Cria as tabelas e regista 'rows' vídeos que apontam para os ficheiros gerados.
+# O model do catalog_service é importado aqui porque lê DATABASE_URL no import.
+def seed_catalog(rows: int, files: list):
+    sys.path.insert(0, os.path.join(ROOT, "shared"))
+    sys.path.insert(0, os.path.join(ROOT, "catalog_service"))
+    from model import Video, engine, init_db
+
+    init_db()
+    hashes = {}
+    for path in files:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        hashes[path] = digest.hexdigest()
+    now = datetime.utcnow()
+    batch = [{
+        "title": f"Bench video {i}", "description": f"Vídeo sintético {i} para benchmark",
+        "duration": 10 + i % 600, "file_path": files[i % len(files)], "content_hash": hashes[files[i % len(files)]],
+        "upload_time": now - timedelta(seconds=i), "updated_time": now,
+    } for i in range(rows)]
+    with engine.begin() as conn:
+        conn.execute(Video.__table__.insert(), batch)
+    engine.dispose()
+
+# Arranca um serviço num processo uvicorn, com o log em 'log_dir'
+def start_service(name: str, port: int, env: dict, log_dir: str) -> subprocess.Popen:
+    directory, _ = SERVICES[name]
+    log = open(os.path.join(log_dir, f"{name}.log"), "wb")
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning", "--no-access-log"],
+        cwd=os.path.join(ROOT, directory), env=env, stdout=log, stderr=subprocess.STDOUT)
+
+# Espera até um serviço responder à sua rota de saúde
+async def wait_ready(client: httpx.AsyncClient, url: str, process: subprocess.Popen, timeout: float = 60.0):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"O processo terminou ({process.returncode}) antes de {url} responder")
+        try:
+            if (await client.get(url)).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.25)
+    raise RuntimeError(f"{url} não respondeu em {timeout}s")
+
+# Amostra o RSS dos processos até 'done' e devolve o pico (MB) de cada um
+async def sample_rss(pids: dict, done: asyncio.Event, interval: float = 0.1) -> dict:
+    peaks = {name: 0 for name in pids}
+    while True:
+        for name, pid in pids.items():
+            try:
+                peaks[name] = max(peaks[name], rss_bytes(pid))
+            except OSError:
+                pass
+        if done.is_set():
+            return {name: round(peak / 1e6, 1) for name, peak in peaks.items()}
+        await asyncio.sleep(interval)
+
+# Corre uma carga: 'clients' clientes concorrentes repetem 'request(client, rng)' (que devolve os bytes
+# transferidos) durante 'duration' segundos
+async def run_workload(name: str, request, clients: int, duration: float, pids: dict, seed: int,
+                       timeout: httpx.Timeout) -> dict:
+    latencies, errors, transferred = [], [], [0]
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+
+    async def client_loop(client: httpx.AsyncClient, rng: random.Random, deadline: float):
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                received = await request(client, rng)
+            except (httpx.HTTPError, RuntimeError) as e:
+                errors.append(type(e).__name__)
+                continue
+            latencies.append(time.perf_counter() - start)
+            transferred[0] += received
+
+    done = asyncio.Event()
+    sampler = asyncio.create_task(sample_rss(pids, done))
+    async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+        started = time.perf_counter()
+        deadline = started + duration
+        await asyncio.gather(*[
+            client_loop(client, random.Random(f"{seed}:{name}:{i}"), deadline) for i in range(clients)])
+        elapsed = time.perf_counter() - started
+    done.set()
+    rss = await sampler
+
+    latencies.sort()
+    return {
+        "clients": clients,
+        "duration_s": round(elapsed, 2),
+        "requests": len(latencies),
+        "errors": len(errors),
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "bytes": transferred[0],
+        "bytes_per_s": round(transferred[0] / elapsed),
+        "rss_peak_mb": rss,
+    }
+
+# Lança um erro para respostas de erro (contadas como erros da carga)
+def check(resp: httpx.Response):
+    if resp.status_code >= 400:
+        raise RuntimeError(f"HTTP {resp.status_code}")
+
+# Carga 'browse': navegação no catálogo (páginas seguidas por cursor, detalhe, pesquisa e páginas do UI)
+def browse_request(urls: dict, rows: int):
+    cursors = {}
+
+    async def request(client: httpx.AsyncClient, rng: random.Random) -> int:
+        roll = rng.random()
+        if roll < 0.4:
+            key = id(rng)
+            params = {"limit": 20}
+            if cursors.get(key):
+                params["cursor"] = cursors[key]
+            resp = await client.get(f"{urls['catalog']}/videos/", params=params)
+            check(resp)
+            cursors[key] = resp.json().get("next_cursor")
+        elif roll < 0.7:
+            resp = await client.get(f"{urls['catalog']}/videos/{rng.randint(1, rows)}")
+        elif roll < 0.8:
+            resp = await client.get(f"{urls['catalog']}/videos/search", params={"q": rng.choice(SEARCH_TERMS)})
+        elif roll < 0.9:
+            resp = await client.get(f"{urls['ui']}/")
+        else:
+            resp = await client.get(f"{urls['ui']}/watch/{rng.randint(1, rows)}")
+        check(resp)
+        return len(resp.content)
+
+    return request
+
+# Carga 'seek': cada pedido é um salto para um offset aleatório de um vídeo (Range aberto), do qual o
+# cliente só lê 'read_bytes' antes de saltar outra vez, como um player a fazer scrubbing
+def seek_request(urls: dict, rows: int, sizes: dict, read_bytes: int):
+    async def request(client: httpx.AsyncClient, rng: random.Random) -> int:
+        video_id = rng.randint(1, rows)
+        size = sizes[(video_id - 1) % len(sizes)]
+        offset = rng.randrange(0, max(size - read_bytes, 1))
+        received = 0
+        async with client.stream("GET", f"{urls['streaming']}/stream/{video_id}",
+                                 headers={"Range": f"bytes={offset}-"}) as resp:
+            check(resp)
+            async for chunk in resp.aiter_raw():
+                received += len(chunk)
+                if received >= read_bytes:
+                    break
+        return received
+
+    return request
+
+# Carga 'upload': uploads multipart de 'size' bytes com conteúdo diferente em cada pedido
+def upload_request(urls: dict, size: int):
+    async def request(client: httpx.AsyncClient, rng: random.Random) -> int:
+        body = MultipartBody(size, 256 * 1024)
+        resp = await client.post(f"{urls['catalog']}/videos/", content=body,
+                                 headers={"Content-Type": f"multipart/form-data; boundary={body.boundary}",
+                                          "Content-Length": str(body.content_length)})
+        check(resp)
+        return body.content_length
+
+    return request
+
+# Commit atual do repositório (e se há alterações por fazer commit)
+def git_revision() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True,
+                                check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT,
+                                    capture_output=True, text=True).stdout.strip())
+        return {"commit": commit, "dirty": dirty}
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": None, "dirty": None}
+
+async def run_suite(args) -> dict:
+    workdir = tempfile.mkdtemp(prefix="ualflix-bench-")
+    redis_stand_in = RedisStandIn(args.redis)
+    processes = {}
+    try:
+        redis_stand_in.start()
+        if args.with_worker and redis_stand_in.kind == "fakeredis":
+            raise RuntimeError("--with-worker precisa do redis-server: o broker Celery usa scripts Lua (EVALSHA), "
+                               "que o fakeredis só suporta com o pacote lupa")
+        video_dir = os.path.join(workdir, "videos")
+        database_url = args.database_url or f"sqlite:///{os.path.join(workdir, 'catalog.db')}"
+        files, video_source = generate_videos(os.path.join(video_dir, "bench"), args.files, args.video_seconds,
+                                              args.video_bytes, args.seed)
+        sizes = {i: os.path.getsize(path) for i, path in enumerate(files)}
+
+        ports = {name: free_port() for name in SERVICES}
+        urls = {name: f"http://127.0.0.1:{port}" for name, port in ports.items()}
+        env = dict(
+            os.environ,
+            DATABASE_URL=database_url, REDIS_HOST="127.0.0.1", REDIS_PORT=str(redis_stand_in.port),
+            CELERY_BROKER_URL=f"redis://127.0.0.1:{redis_stand_in.port}/0",
+            UPLOAD_DIR=video_dir, VIDEO_DIR=video_dir,
+            CATALOG_URL=urls["catalog"], STREAMING_URL=urls["streaming"],
+            PYTHONPATH=os.pathsep.join(filter(None, [os.path.join(ROOT, "shared"), os.getenv("PYTHONPATH")])),
+            LOG_LEVEL="WARNING", PYTHONUNBUFFERED="1")
+        os.environ["DATABASE_URL"] = database_url
+        seed_catalog(args.rows, files)
+
+        for name, port in ports.items():
+            processes[name] = start_service(name, port, dict(env, SERVICE_NAME=f"bench-{name}"), workdir)
+        if args.with_worker:
+            processes["worker"] = subprocess.Popen(
+                [sys.executable, "-m", "celery", "-A", "tasks:app_celery", "worker", "-Q", "catalog_queue,media_queue",
+                 "--pool", "solo", "--loglevel", "WARNING"],
+                cwd=os.path.join(ROOT, "catalog_service"), env=dict(env, SERVICE_NAME="bench-worker"),
+                stdout=open(os.path.join(workdir, "worker.log"), "wb"), stderr=subprocess.STDOUT)
+        async with httpx.AsyncClient(timeout=5.0) as client:
+            for name, (_, health) in SERVICES.items():
+                await wait_ready(client, f"{urls[name]}{health}", processes[name])
+
+        pids = {name: p.pid for name, p in processes.items()}
+        workloads = {
+            "browse": (browse_request(urls, args.rows), httpx.Timeout(30.0)),
+            "seek": (seek_request(urls, args.rows, sizes, args.seek_read_bytes), httpx.Timeout(30.0)),
+            "upload": (upload_request(urls, args.upload_bytes), httpx.Timeout(30.0, read=None, write=None)),
+        }
+        results = {}
+        for name in args.workload:
+            request, timeout = workloads[name]
+            clients = args.upload_clients if name == "upload" else args.clients
+            # Aquecimento curto (ligações, caches e JIT do SQLite), fora das medições
+            if args.warmup > 0:
+                await run_workload(name, request, clients, args.warmup, pids, args.seed + 1, timeout)
+            results[name] = await run_workload(name, request, clients, args.duration, pids, args.seed, timeout)
+            print(f"{name}: {results[name]['rps']} req/s, p99 {results[name]['p99_ms']} ms", file=sys.stderr)
+
+        return {
+            **git_revision(),
+            "timestamp": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "stand_ins": {"redis": redis_stand_in.kind, "database": database_url.split(":", 1)[0],
+                          "videos": video_source},
+            "params": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+            "workloads": results,
+        }
+    finally:
+        for process in processes.values():
+            process.terminate()
+        for process in processes.values():
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        redis_stand_in.stop()
+        if args.keep:
+            print(f"Ficheiros e logs em {workdir}", file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+# Compara dois resultados: valor base, novo e variação (%) de cada métrica, por carga.
+# 'better' indica se a variação é uma melhoria (segundo COMPARED_METRICS).
+def compare(base: dict, new: dict) -> dict:
+    report = {"base": base.get("commit"), "new": new.get("commit"), "workloads": {}}
+    for name, new_result in new["workloads"].items():
+        base_result = base["workloads"].get(name)
+        if base_result is None:
+            continue
+        metrics = {}
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            old_value, new_value = base_result.get(metric), new_result.get(metric)
+            if isinstance(old_value, dict):
+                old_value, new_value = sum(old_value.values()), sum(new_value.values())
+            if old_value is None or new_value is None:
+                continue
+            change = round((new_value - old_value) / old_value * 100, 1) if old_value else None
+            metrics[metric] = {"base": old_value, "new": new_value, "change_pct": change,
+                               "better": None if change is None else (change > 0) == higher_is_better}
+        report["workloads"][name] = metrics
+    return report
+
+def main(args):
+    if args.compare:
+        with open(args.compare[0]) as f:
+            base = json.load(f)
+        with open(args.compare[1]) as f:
+            new = json.load(f)
+        print(json.dumps(compare(base, new), indent=2, ensure_ascii=False))
+        return
+
+    result = asyncio.run(run_suite(args))
+    output = json.dumps(result, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks dos três serviços sobre substitutos locais")
+    parser.add_argument("--workload", action="append", choices=["browse", "seek", "upload"],
+                        help="Carga a correr (pode repetir; por omissão todas)")
+    parser.add_argument("--duration", type=float, default=20.0, help="Duração de cada carga em segundos")
+    parser.add_argument("--warmup", type=float, default=3.0, help="Aquecimento antes de cada carga (s)")
+    parser.add_argument("--clients", type=int, default=32, help="Clientes concorrentes (browse e seek)")
+    parser.add_argument("--upload-clients", type=int, default=4)
+    parser.add_argument("--rows", type=int, default=2000, help="Vídeos registados no catálogo")
+    parser.add_argument("--files", type=int, default=4, help="Ficheiros de vídeo distintos gerados")
+    parser.add_argument("--video-seconds", type=int, default=30, help="Duração dos vídeos gerados com o ffmpeg")
+    parser.add_argument("--video-bytes", type=int, default=32 * 1024 * 1024,
+                        help="Tamanho dos ficheiros gerados sem ffmpeg")
+    parser.add_argument("--seek-read-bytes", type=int, default=256 * 1024, help="Bytes lidos em cada seek")
+    parser.add_argument("--upload-bytes", type=int, default=16 * 1024 * 1024, help="Tamanho de cada upload")
+    parser.add_argument("--redis", choices=["auto", "server", "fake"], default="auto",
+                        help="Substituto do Redis (auto: redis-server se existir, senão fakeredis)")
+    parser.add_argument("--database-url", default=os.getenv("BENCH_DATABASE_URL"),
+                        help="Base de dados a usar (por omissão SQLite num diretório temporário)")
+    parser.add_argument("--with-worker", action="store_true",
+                        help="Arranca um worker Celery (catalog_queue e media_queue) para registar os uploads")
+    parser.add_argument("--seed", type=int, default=1234, help="Semente dos padrões de acesso")
+    parser.add_argument("--keep", action="store_true", help="Mantém o diretório temporário (vídeos e logs)")
+    parser.add_argument("--output", help="Ficheiro onde gravar o resultado (JSON)")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"), help="Compara dois resultados e termina")
+    arguments = parser.parse_args()
+    arguments.workload = arguments.workload or ["browse", "seek", "upload"]
+    main(arguments)
@@ -0,0 +1,112 @@
+# Benchmark de uploads grandes para o catalog_service (ou através do ui_service).
+# Gera em streaming um formulário multipart com um ficheiro de N bytes (sem o ter em memória nem em disco),
+# envia-o e amostra o RSS do processo do servidor durante o upload. Verifica também o SHA-256 devolvido.
+# O pico de memória do servidor deve manter-se constante qualquer que seja o tamanho do ficheiro.
+#
+# Exemplo (uploads de 1 GB e 4 GB; o PID é o do uvicorn do catalog_service):
+#   python benchmarks/upload_memory.py --url http://localhost:5000/videos/ --pid <PID> --size 1000000000
+#   python benchmarks/upload_memory.py --url http://localhost:5000/videos/ --pid <PID> --size 4000000000
+
+# Imports Gerais
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import time
+import uuid
+
+# Imports Extra
+import httpx
+
+
+# RSS atual de um processo, em bytes
+def rss_bytes(pid: int) -> int:
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+# Corpo multipart gerado bloco a bloco; o conteúdo do ficheiro é pseudo-aleatório e o SHA-256 é
+# calculado à medida que é enviado
+class MultipartBody:
+    def __init__(self, size: int, chunk_size: int):
+        self.size = size
+        self.chunk_size = chunk_size
+        self.boundary = uuid.uuid4().hex
+        self.digest = hashlib.sha256()
+        fields = {"title": "Benchmark upload", "duration": "60", "description": "Upload sintético"}
+        head = "".join(
+            f'--{self.boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'
+            for name, value in fields.items())
+        head += (f'--{self.boundary}\r\nContent-Disposition: form-data; name="file"; filename="bench.mp4"\r\n'
+                 f'Content-Type: video/mp4\r\n\r\n')
+        self.head = head.encode()
+        self.tail = f"\r\n--{self.boundary}--\r\n".encode()
+        self.block = os.urandom(chunk_size)
+
+    @property
+    def content_length(self) -> int:
+        return len(self.head) + self.size + len(self.tail)
+
+    async def __aiter__(self):
+        yield self.head
+        sent = 0
+        while sent < self.size:
+            data = self.block[:min(self.chunk_size, self.size - sent)]
+            self.digest.update(data)
+            sent += len(data)
+            yield data
+        yield self.tail
+
+# Amostra o RSS do servidor até o upload terminar e devolve o pico observado
+async def sample_rss(pid: int, done: asyncio.Event, interval: float) -> tuple:
+    baseline = peak = rss_bytes(pid)
+    while not done.is_set():
+        peak = max(peak, rss_bytes(pid))
+        await asyncio.sleep(interval)
+    return baseline, max(peak, rss_bytes(pid))
+
+async def main(args):
+    body = MultipartBody(args.size, args.chunk_size)
+    headers = {"Content-Type": f"multipart/form-data; boundary={body.boundary}"}
+    if not args.chunked:
+        headers["Content-Length"] = str(body.content_length)
+
+    done = asyncio.Event()
+    sampler = asyncio.create_task(sample_rss(args.pid, done, args.interval)) if args.pid else None
+    async with httpx.AsyncClient(timeout=httpx.Timeout(30.0, read=None, write=None)) as client:
+        started = time.perf_counter()
+        resp = await client.post(args.url, content=body, headers=headers)
+        elapsed = time.perf_counter() - started
+    done.set()
+
+    report = {
+        "url": args.url,
+        "size_bytes": args.size,
+        "status": resp.status_code,
+        "seconds": round(elapsed, 2),
+        "mb_per_s": round(args.size / elapsed / 1e6, 1),
+    }
+    if resp.headers.get("content-type", "").startswith("application/json"):
+        result = resp.json()
+        if "sha256" in result:
+            report["sha256_ok"] = result["sha256"] == body.digest.hexdigest()
+    if sampler is not None:
+        baseline, peak = await sampler
+        report["server_rss_baseline_mb"] = round(baseline / 1e6, 1)
+        report["server_rss_peak_mb"] = round(peak / 1e6, 1)
+        report["server_rss_growth_mb"] = round((peak - baseline) / 1e6, 1)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Memória e débito do servidor durante uploads de vários GB")
+    parser.add_argument("--url", required=True, help="p.ex. http://localhost:5000/videos/")
+    parser.add_argument("--size", type=int, default=2 * 1024 ** 3, help="Tamanho do ficheiro em bytes")
+    parser.add_argument("--pid", type=int, help="PID do processo do servidor (para medir o RSS)")
+    parser.add_argument("--chunk-size", type=int, default=1024 * 1024)
+    parser.add_argument("--interval", type=float, default=0.05, help="Intervalo de amostragem do RSS")
+    parser.add_argument("--chunked", action="store_true", help="Envia sem Content-Length (Transfer-Encoding: chunked)")
+    asyncio.run(main(parser.parse_args()))
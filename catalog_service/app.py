@@ -1,165 +1,419 @@
 # Imports Gerais
 import os
-import shutil
-import time
-import uuid
-import json
+import asyncio
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
 from contextlib import asynccontextmanager
 
 # Imports Extra
+import anyio
 import redis
+import redis.asyncio as aioredis
 from celery.result import AsyncResult
-from fastapi import (FastAPI, HTTPException, UploadFile, File, Form, Depends, Request)
-from fastapi.responses import FileResponse, JSONResponse
-from sqlalchemy import text
+from fastapi import (FastAPI, HTTPException, Depends, Request, Query)
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 from starlette.responses import Response
 
 # Imports dos Ficheiros
-from controller import (list_videos, get_video, update_video, delete_video, get_db)
-from model import init_db
-from tasks import process_video_upload, TEMP_UPLOAD_DIR, BASE_UPLOAD_DIR, app_celery
+import async_controller
+from cache import dumps
+from controller import (list_videos, search_videos, get_video, update_video, delete_video, get_db, get_read_db,
+                        get_videos_batch, update_videos, delete_videos, batch_ids, video_to_dict, video_local_cache,
+                        page_etag, write_marker, READ_YOUR_WRITES_HEADER)
+from metrics import instrument_redis, register_gauges, setup_metrics
+from model import init_db, read_router, DB_ASYNC
+from task_events import task_event_stream
+from tasks import (process_video_upload, media_stages, broker_queue_keys, TEMP_UPLOAD_DIR, BASE_UPLOAD_DIR,
+                   CATALOG_QUEUE, MEDIA_QUEUE, TRANSCODE_QUEUE, PRIORITY_INTERACTIVE, BROKER_URL, REDIS_PORT,
+                   app_celery)
+from resumable import create_session, load_session, upload_state, receive_chunk, finalize_session, abort_session
+from uploads import receive_upload, video_form_fields
+
+# Número de threads da threadpool usada pelas rotas síncronas (vazio mantém o valor do anyio, 40)
+THREADPOOL_SIZE = os.getenv("THREADPOOL_SIZE")
 
 # Gere o ciclo de vida da aplicação, ininciando a BD e Redis.
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global redis_client
-    redis_client = redis.Redis(host=os.getenv("REDIS_HOST", "redis"), port=6379, db=0, decode_responses=True)
+    global redis_client, aredis_client, broker_client
+    if THREADPOOL_SIZE:
+        anyio.to_thread.current_default_thread_limiter().total_tokens = int(THREADPOOL_SIZE)
+    redis_client = instrument_redis(
+        redis.Redis(host=os.getenv("REDIS_HOST", "redis"), port=REDIS_PORT, db=0, decode_responses=True))
+    aredis_client = instrument_redis(
+        aioredis.Redis(host=os.getenv("REDIS_HOST", "redis"), port=REDIS_PORT, db=0, decode_responses=True))
+    if BROKER_URL.startswith("redis"):
+        broker_client = redis.Redis.from_url(BROKER_URL, socket_timeout=2)
     init_db()
+    read_router.start()
+    events_task = asyncio.create_task(async_controller.listen_video_events(aredis_client))
     yield
+    events_task.cancel()
+    read_router.stop()
     redis_client.close()
+    if broker_client is not None:
+        broker_client.close()
+    await aredis_client.aclose()
 
 # Garante que os diretórios de upload existem ao iniciar, entre outras definições
 app = FastAPI(title="Catalog Service", lifespan=lifespan)
 os.makedirs(BASE_UPLOAD_DIR, exist_ok=True)
 os.makedirs(TEMP_UPLOAD_DIR, exist_ok=True)
 redis_client = None
+aredis_client = None
+broker_client = None
+setup_metrics(app)
+
+
+# Número de tarefas à espera em cada fila Celery (listas do broker Redis, uma por prioridade), lido em
+# cada scrape de /metrics
+def celery_queue_lengths() -> dict:
+    if broker_client is None:
+        return {}
+    queues = [CATALOG_QUEUE, MEDIA_QUEUE, TRANSCODE_QUEUE]
+    pipe = broker_client.pipeline(transaction=False)
+    for queue in queues:
+        for key in broker_queue_keys(queue):
+            pipe.llen(key)
+    lengths = iter(pipe.execute())
+    return {queue: sum(next(lengths) for _ in broker_queue_keys(queue)) for queue in queues}
+
+# Ligações de cada pool da base de dados por estado (checkedout, checkedin, overflow, size)
+def db_pool_connections() -> dict:
+    stats = read_router.stats()
+    pools = [("primary", stats["primary"])] + [(r["name"], r) for r in stats["replicas"]]
+    return {(name, state): pool[state] for name, pool in pools
+            for state in ("size", "checkedin", "checkedout", "overflow") if state in pool}
+
+register_gauges("celery_queue_length", "Tarefas à espera em cada fila Celery", ["queue"], celery_queue_lengths)
+register_gauges("local_cache_entries", "Entradas nas caches locais (em memória) de cada processo", ["cache"],
+                lambda: {video_local_cache.name: len(video_local_cache)})
+register_gauges("db_pool_connections", "Ligações dos pools da base de dados por estado", ["pool", "state"],
+                db_pool_connections)
 
 
 # Fornece a instância do cliente Redis às rotas.
 def get_redis():
     return redis_client
 
-# Verifica a ligação à base de dados.
+# Fornece a instância do cliente Redis assíncrono às rotas.
+def get_aredis():
+    return aredis_client
+
+# Dependências das rotas principais (listagem, detalhe, edição e remoção): com DB_ASYNC=true usam
+# sessões assíncronas e o redis.asyncio; caso contrário usam sessões síncronas, executadas na threadpool
+if DB_ASYNC:
+    main_db, main_read_db, main_redis = async_controller.get_async_db, async_controller.get_async_read_db, get_aredis
+else:
+    main_db, main_read_db, main_redis = get_db, get_read_db, get_redis
+
+# Executa uma operação do controller na variante ativa: a assíncrona diretamente no event loop,
+# a síncrona numa thread da threadpool
+async def run_db(sync_fn, async_fn, *args, **kwargs):
+    if DB_ASYNC:
+        return await async_fn(*args, **kwargs)
+    return await run_in_threadpool(sync_fn, *args, **kwargs)
+
+# Verifica se o cliente já tem a versão atual: If-None-Match (um ou vários ETags, comparação fraca, ou '*')
+# ou, só quando não há If-None-Match, If-Modified-Since (com resolução de segundos)
+def not_modified(request: Request, etag: str, last_modified: datetime = None) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if last_modified is None or not if_modified_since:
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    return last_modified.replace(microsecond=0, tzinfo=timezone.utc) <= since
+
+# Resposta JSON já serializada com ETag (e Last-Modified, em UTC, se indicado), ou 304 se o cliente já tem
+# esta versão. 'no-cache' deixa o browser e as caches intermédias guardarem a resposta, mas obriga-os a
+# revalidá-la antes de cada utilização, por isso uma alteração é vista de imediato.
+def etag_response(request: Request, content: str, etag: str, last_modified: datetime = None) -> Response:
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if last_modified is not None:
+        headers["Last-Modified"] = format_datetime(last_modified.replace(tzinfo=timezone.utc), usegmt=True)
+    if not_modified(request, etag, last_modified):
+        return Response(status_code=304, headers=headers)
+    return Response(content=content, media_type="application/json", headers=headers)
+
+# Lê o corpo JSON (um objeto) de um pedido
+async def read_json(request: Request) -> dict:
+    try:
+        body = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=422, detail="O corpo do pedido não é JSON válido")
+    if not isinstance(body, dict):
+        raise HTTPException(status_code=422, detail="O corpo do pedido tem de ser um objeto JSON")
+    return body
+
+# Valida os vídeos de uma edição em lote ({"items": [{"id", "title", "description", "duration"}, ...]}),
+# com as mesmas regras do formulário de edição. Devolve {id: (título, descrição, duração)}.
+def batch_updates(items) -> dict:
+    if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+        raise HTTPException(status_code=422, detail="É esperada uma lista 'items' de vídeos")
+    video_ids = batch_ids([item.get("id") for item in items])
+    if len(video_ids) != len(items):
+        raise HTTPException(status_code=422, detail="Os ids não podem estar repetidos")
+    return {video_id: video_form_fields({k: "" if v is None else str(v) for k, v in item.items()})
+            for video_id, item in zip(video_ids, items)}
+
+# Id da primeira tarefa de um pipeline (o resultado de uma chain é o da última tarefa)
+def root_task_id(result) -> str:
+    while result.parent is not None:
+        result = result.parent
+    return result.id
+
+# Enfileira o pipeline de um upload, com a prioridade dos pedidos interativos: registo do vídeo
+# (CATALOG_QUEUE), remux faststart + índice de keyframes e pré-visualizações (MEDIA_QUEUE), seguidos
+# da transcodificação para HLS/DASH (TRANSCODE_QUEUE). Sem content_hash, o SHA-256 é calculado pelo worker,
+# tal como a duração, se não tiver sido indicada.
+def enqueue_upload_pipeline(title: str, description: str, duration: int, path: str, filename: str,
+                            content_hash: str = None):
+    register = process_video_upload.si(title, description, duration, path, filename, content_hash=content_hash)
+    return (register.set(queue=CATALOG_QUEUE, priority=PRIORITY_INTERACTIVE)
+            | media_stages(PRIORITY_INTERACTIVE)).apply_async()
+
+# Cabeçalhos com o estado de um upload retomável
+def upload_headers(state: dict) -> dict:
+    return {"Upload-Offset": str(state["offset"]), "Upload-Length": str(state["length"]),
+            "Upload-Chunk-Size": str(state["chunk_size"]), "Cache-Control": "no-store"}
+
+# Métricas dos pools de ligações à base de dados (primário e réplicas de leitura)
+@app.get("/metrics/db-pool")
+def db_pool_metrics():
+    return read_router.stats()
+
+# Verifica a ligação à base de dados (as esperas entre tentativas não bloqueiam o event loop).
 @app.get("/healthz", status_code=200)
-def health_check(db: Session = Depends(get_db)):
+async def health_check():
     max_retries = 3
     for attempt in range(max_retries):
         try:
-            db.execute(text("SELECT 1"))
+            await async_controller.ping_db()
             return {"status": "ok"}
         except Exception as e:
             if attempt < max_retries - 1:
-                time.sleep(2)
+                await asyncio.sleep(2)
                 continue
             raise HTTPException(status_code=503, detail=f"A ligação à base de dados falhou após {max_retries} tentativas: {e}")
 
-# Devolve a lista de todos os vídeos
+# Devolve uma página da lista de vídeos, com paginação por cursor, ordenação e filtros.
+# O ETag permite ao cliente revalidar a página com If-None-Match e receber um 304 sem corpo.
 @app.get("/videos/")
-def videos_list(response: Response, db: Session = Depends(get_db), redis_client: redis.Redis = Depends(get_redis)):
-    response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-    response.headers["Pragma"] = "no-cache"
-    response.headers["Expires"] = "0"
-    return list_videos(db, redis_client)
+async def videos_list(
+    request: Request,
+    limit: int = Query(100, ge=1, le=200),
+    cursor: str = Query(None),
+    sort: str = Query("-upload_time"),
+    title: str = Query(None),
+    min_duration: int = Query(None, ge=0),
+    max_duration: int = Query(None, ge=0),
+    db = Depends(main_read_db),
+    redis_client = Depends(main_redis)):
+    page, etag = await run_db(
+        list_videos, async_controller.list_videos, db, redis_client, limit=limit, cursor=cursor, sort=sort,
+        title=title, min_duration=min_duration, max_duration=max_duration)
+    return etag_response(request, page, etag)
+
+# Pesquisa de texto integral nos títulos e descrições, com correspondência por prefixo,
+# ordenação por relevância e pesquisa aproximada quando não há resultados exatos.
+# Tem de estar declarada antes de /videos/{video_id}.
+@app.get("/videos/search")
+def videos_search(
+    request: Request,
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=100),
+    db: Session = Depends(get_read_db),
+    redis_client: redis.Redis = Depends(get_redis)):
+    result, etag = search_videos(db, redis_client, q, limit=limit)
+    return etag_response(request, result, etag)
+
+# Devolve os detalhes de vários vídeos num só pedido (ids separados por vírgulas, p.ex. ?ids=3,1,7), pela
+# ordem pedida. Os que não existem são indicados em 'missing'. Tem de estar declarada antes de /videos/{video_id}.
+@app.get("/videos/batch")
+async def videos_batch(
+    ids: str = Query(..., min_length=1),
+    db = Depends(main_read_db),
+    redis_client = Depends(main_redis)):
+    return await run_db(get_videos_batch, async_controller.get_videos_batch, db, batch_ids(ids.split(",")),
+                        redis_client)
 
-# Devolve os detalhes de um vídeo específico
+# Atualiza o título, a descrição e a duração de vários vídeos numa só transação: se algum não existir
+# ou for inválido, nenhum é alterado
+@app.patch("/videos/batch")
+async def edit_videos(request: Request, response: Response, db = Depends(main_db),
+                      redis_client = Depends(main_redis)):
+    updates = batch_updates((await read_json(request)).get("items"))
+    items = await run_db(update_videos, async_controller.update_videos, db, updates, redis_client)
+    response.headers[READ_YOUR_WRITES_HEADER] = write_marker()
+    return {"items": items}
+
+# Apaga vários vídeos numa só transação ({"ids": [...]}); se algum não existir, nenhum é apagado.
+# É um POST porque muitos proxies e clientes não suportam corpo num DELETE.
+@app.post("/videos/batch/delete")
+async def remove_videos(request: Request, response: Response, db = Depends(main_db),
+                        redis_client = Depends(main_redis)):
+    video_ids = batch_ids((await read_json(request)).get("ids") or [])
+    result = await run_db(delete_videos, async_controller.delete_videos, db, video_ids, redis_client)
+    response.headers[READ_YOUR_WRITES_HEADER] = write_marker()
+    return result
+
+# Devolve os detalhes de um vídeo específico, com ETag e Last-Modified (updated_time) para revalidação:
+# um cliente que já tem a versão atual recebe um 304 sem corpo
 @app.get("/videos/{video_id}")
-def video_detail(video_id: int, response: Response, db: Session = Depends(get_db), redis_client: redis.Redis = Depends(get_redis)):
-    response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-    response.headers["Pragma"] = "no-cache"
-    response.headers["Expires"] = "0"
-    return get_video(db, video_id, redis_client)
+async def video_detail(video_id: int, request: Request, db = Depends(main_read_db), redis_client = Depends(main_redis)):
+    video = await run_db(get_video, async_controller.get_video, db, video_id, redis_client)
+    content = dumps(video)
+    return etag_response(request, content, page_etag(content), datetime.fromisoformat(video["updated_time"]))
 
 # Devolve o ficheiro de vídeo para streaming.
 @app.get("/videos/{video_id}/file")
-def video_file(video_id: int, db: Session = Depends(get_db)):
-    video = get_video(db, video_id)
-    return FileResponse(video.file_path, media_type="video/mp4")
+def video_file(video_id: int, db: Session = Depends(get_read_db), redis_client: redis.Redis = Depends(get_redis)):
+    video = get_video(db, video_id, redis_client)
+    return FileResponse(video["file_path"], media_type="video/mp4")
 
 # Recebe um upload e cria uma tarefa em background para o processar.
+# O ficheiro é escrito em TEMP_UPLOAD_DIR à medida que chega (sem passar por memória nem por um
+# ficheiro temporário do sistema), com o SHA-256 e o tamanho calculados durante a cópia.
 @app.post("/videos/")
-async def enqueue_upload_video(
-    title: str = Form(...),
-    description: str = Form(None),
-    duration: int = Form(..., ge=0, le=9999),
-    file: UploadFile = File(...),
-    redis_client: redis.Redis = Depends(get_redis)):
-    _, ext = os.path.splitext(file.filename)
-    temp_filename = f"{uuid.uuid4()}{ext}"
-    temp_file_path = os.path.join(TEMP_UPLOAD_DIR, temp_filename)
-
+async def enqueue_upload_video(request: Request):
+    fields, upload = await receive_upload(request, TEMP_UPLOAD_DIR)
+    if upload is None:
+        raise HTTPException(status_code=422, detail="O ficheiro de vídeo é obrigatório")
     try:
-        with open(temp_file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-    except Exception as e:
-        if os.path.exists(temp_file_path):
-            os.remove(temp_file_path)
-        raise HTTPException(status_code=500, detail=f"Falha ao guardar o ficheiro temporário: {e}")
-    finally:
-        await file.close()
-
-    task = process_video_upload.apply_async(
-        args=[title, description, duration, temp_file_path, file.filename],
-        kwargs={},
-        queue='catalog_queue')
-    redis_client.delete("videos_list")
+        title, description, duration = video_form_fields(fields, duration_optional=True)
+        pipeline = enqueue_upload_pipeline(title, description, duration, upload.path, upload.filename,
+                                           content_hash=upload.sha256)
+    except Exception:
+        upload.discard()
+        raise
     return JSONResponse(
         status_code=202, 
-        content={"message": "Upload recebido, a processar no background.", "task_id": task.id})
+        content={"message": "Upload recebido, a processar no background.", "task_id": root_task_id(pipeline),
+                 "transcode_task_id": pipeline.id, "size": upload.size, "sha256": upload.sha256})
+
+# Uploads retomáveis em blocos (ver resumable.py), para ficheiros grandes: uma ligação que cai só obriga
+# a reenviar os blocos em curso, e cada pedido ocupa um worker apenas durante um bloco.
+# Cria uma sessão: {"filename", "size", "title", "description", "duration"} (validados como no formulário;
+# sem duração, é calculada no registo do vídeo).
+@app.post("/uploads/", status_code=201)
+async def create_upload(request: Request, response: Response):
+    body = await read_json(request)
+    title, description, duration = video_form_fields(
+        {k: "" if v is None else str(v) for k, v in body.items() if k in ("title", "description", "duration")},
+        duration_optional=True)
+    session = await create_session(aredis_client, TEMP_UPLOAD_DIR, body.get("filename"), body.get("size"),
+                                   title, description, duration)
+    state = await upload_state(aredis_client, session)
+    response.headers.update(upload_headers(state))
+    response.headers["Location"] = f"/uploads/{session.id}"
+    return state
+
+# Offset já recebido de uma sessão (sem corpo), para retomar o envio
+@app.head("/uploads/{upload_id}")
+async def upload_offset(upload_id: str):
+    state = await upload_state(aredis_client, await load_session(aredis_client, upload_id))
+    return Response(status_code=200, headers=upload_headers(state))
+
+# Estado de uma sessão, com a lista dos blocos em falta (para retomar um envio em paralelo)
+@app.get("/uploads/{upload_id}")
+async def upload_status(upload_id: str, response: Response):
+    state = await upload_state(aredis_client, await load_session(aredis_client, upload_id))
+    response.headers.update(upload_headers(state))
+    return state
+
+# Recebe um bloco: corpo application/offset+octet-stream e cabeçalho Upload-Offset (múltiplo do tamanho dos
+# blocos); opcionalmente Upload-Checksum: sha256 <base64>. Os blocos podem chegar em qualquer ordem.
+@app.patch("/uploads/{upload_id}")
+async def upload_chunk(upload_id: str, request: Request):
+    state = await receive_chunk(aredis_client, await load_session(aredis_client, upload_id), request)
+    return Response(status_code=204, headers=upload_headers(state))
 
-# Verifica o estado de uma tarefa Celery
+# Finaliza uma sessão com todos os blocos e enfileira o pipeline do upload (como POST /videos/)
+@app.post("/uploads/{upload_id}/finalize")
+async def finalize_upload(upload_id: str):
+    session = await finalize_session(aredis_client, await load_session(aredis_client, upload_id))
+    pipeline = enqueue_upload_pipeline(session.title, session.description or None, session.duration,
+                                       session.path, session.filename)
+    return JSONResponse(
+        status_code=202,
+        content={"message": "Upload recebido, a processar no background.", "task_id": root_task_id(pipeline),
+                 "transcode_task_id": pipeline.id, "size": session.length, "sha256": None})
+
+# Cancela uma sessão e apaga o ficheiro parcial
+@app.delete("/uploads/{upload_id}", status_code=204)
+async def cancel_upload(upload_id: str):
+    await abort_session(aredis_client, await load_session(aredis_client, upload_id))
+    return Response(status_code=204)
+
+# Verifica o estado de uma tarefa Celery (as transcodificações reportam o progresso em PROGRESS).
+# Uma tarefa concluída (p.ex. o registo de um upload) leva READ_YOUR_WRITES_HEADER, como as outras escritas.
 @app.get("/videos/task/{task_id}")
-async def get_task_status(task_id: str):
+async def get_task_status(task_id: str, response: Response):
     task_result = AsyncResult(task_id, app=app_celery)
     if task_result.ready():
         if task_result.successful():
+            response.headers[READ_YOUR_WRITES_HEADER] = write_marker()
             return {"status": "SUCCESS", "result": task_result.get()}
         else:
             raise HTTPException(status_code=500, detail=str(task_result.info))
+    elif task_result.state == "PROGRESS":
+        return {"status": "PROGRESS", **task_result.info}
     else:
         return {"status": "PENDING"}
 
-# Atualiza os dados de um vídeo
+# Eventos de um pipeline de upload em Server-Sent Events (task_id é o id devolvido no upload): o estado
+# atual e depois cada mudança de estado e progresso de cada etapa, empurrados pelos workers através do
+# Redis pub/sub. A ligação termina no evento final, sem o cliente ter de fazer polling.
+@app.get("/videos/task/{task_id}/events")
+async def task_events(task_id: str):
+    return StreamingResponse(
+        task_event_stream(aredis_client, task_id), media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# Atualiza os dados de um vídeo.
+# Um novo ficheiro é recebido em streaming para TEMP_UPLOAD_DIR e entra no armazenamento por conteúdo
+# com um hard link (ou reutiliza o blob se o conteúdo já existir); o temporário e o ficheiro antigo só são apagados
+# depois de a base de dados estar atualizada e se mais nenhum vídeo o referenciar. O novo conteúdo
+# passa pelo remux faststart e pela geração das pré-visualizações e é enviado para transcodificação.
 @app.put("/videos/{video_id}")
 async def edit_video(
     video_id: int,
-    title: str = Form(...),
-    description: str = Form(None),
-    duration: int = Form(..., ge=0, le=9999),
-    file: UploadFile = File(None),
-    db: Session = Depends(get_db),
-    redis_client: redis.Redis = Depends(get_redis)):
-    file_path_to_update = None
-    video_data = get_video(db, video_id, redis_client)
-    
-    if file:
-        _, ext = os.path.splitext(file.filename)
-        unique_filename = f"{video_id}_{uuid.uuid4()}{ext}"
-        file_path_to_update = os.path.join(BASE_UPLOAD_DIR, unique_filename)
+    request: Request,
+    response: Response,
+    db = Depends(main_db),
+    redis_client = Depends(main_redis)):
+    fields, upload = await receive_upload(request, TEMP_UPLOAD_DIR)
+    try:
+        title, description, duration = video_form_fields(fields)
+        result = await run_db(
+            update_video, async_controller.update_video,
+            db, video_id, title, description, duration, redis_client,
+            upload_path=upload.path if upload else None, content_hash=upload.sha256 if upload else None)
+    finally:
+        if upload is not None:
+            upload.discard()
 
-        try:
-            with open(file_path_to_update, "wb") as buffer:
-                content = await file.read()
-                buffer.write(content)
-            
-            if video_data and video_data.get('file_path'):
-                old_path = video_data['file_path']
-                if os.path.exists(old_path):
-                    try:
-                        os.remove(old_path)
-                    except Exception as e:
-                        print(f"Aviso: não foi possível remover o ficheiro antigo: {old_path}, erro: {e}")
-                        
-        except Exception as e:
-            if os.path.exists(file_path_to_update):
-                os.remove(file_path_to_update)
-            raise HTTPException(status_code=500, detail=f"Falha ao guardar o ficheiro: {str(e)}")
-        finally:
-            await file.close()
-    result = update_video(db, video_id, title, description, duration, redis_client, new_file_path=file_path_to_update)
-    return result
+    video = video_to_dict(result)
+    if upload is not None:
+        pipeline = media_stages(PRIORITY_INTERACTIVE, video).apply_async()
+        video["task_id"] = root_task_id(pipeline)
+        video["transcode_task_id"] = pipeline.id
+    response.headers[READ_YOUR_WRITES_HEADER] = write_marker()
+    return video
 
 # Apaga um vídeo
 @app.delete("/videos/{video_id}")
-def remove_video(video_id: int, db: Session = Depends(get_db), redis_client: redis.Redis = Depends(get_redis)):
-    return delete_video(db, video_id, redis_client)
\ No newline at end of file
+async def remove_video(video_id: int, response: Response, db = Depends(main_db), redis_client = Depends(main_redis)):
+    result = await run_db(delete_video, async_controller.delete_video, db, video_id, redis_client)
+    response.headers[READ_YOUR_WRITES_HEADER] = write_marker()
+    return result
\ No newline at end of file
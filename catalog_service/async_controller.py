@@ -0,0 +1,249 @@
+# Imports Gerais
+import os
+import json
+import asyncio
+import logging
+import time
+
+# Imports Extra
+import redis
+import redis.asyncio as aioredis
+from fastapi import HTTPException, Request
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+# Imports dos Ficheiros
+from cache import aget_or_load, aget_or_load_local, dumps
+from controller import (video_to_dict, list_cache_key, list_statement, build_page, page_etag, batch_from_local,
+                        batch_from_redis, batch_result, require_videos, queue_batch_invalidation,
+                        LIST_VERSION_KEY, LIST_CACHE_TTL, VIDEO_CACHE_TTL, VIDEO_EVENTS_CHANNEL, video_local_cache,
+                        read_from_primary)
+from blobs import store_blob, release_blob, remove_released_blobs, blob_key
+from metrics import log_event
+from model import Video, AsyncSessionLocal, engine, read_router
+
+# Versões assíncronas das operações do controller (ativas com DB_ASYNC=true).
+# Usam sessões assíncronas (asyncpg) e o cliente redis.asyncio, por isso um pedido à espera da base de
+# dados ou do Redis não ocupa uma thread da threadpool. A query da listagem, os cursores e a
+# serialização das páginas são partilhados com controller.py.
+
+
+# Gere uma sessão assíncrona no primário para cada pedido
+async def get_async_db():
+    async with AsyncSessionLocal(bind=read_router.async_engines[engine]) as db:
+        yield db
+
+# Gere uma sessão assíncrona só de leitura, ligada a uma réplica quando possível (ou ao primário, ver
+# controller.read_from_primary)
+async def get_async_read_db(request: Request):
+    async with AsyncSessionLocal(bind=read_router.choose_async(read_from_primary(request))) as db:
+        yield db
+
+# Invalida todas as páginas da listagem em cache, incrementando a versão da lista
+async def invalidate_list_cache(redis_client: aioredis.Redis):
+    await redis_client.incr(LIST_VERSION_KEY)
+
+# Publica um evento de alteração de um vídeo ('create', 'update' ou 'delete')
+async def publish_video_event(redis_client: aioredis.Redis, op: str, video_id: int):
+    try:
+        await redis_client.publish(VIDEO_EVENTS_CHANNEL, json.dumps({"op": op, "id": video_id}))
+    except redis.exceptions.RedisError as e:
+        log_event("video_event_publish_failed", logging.WARNING, op=op, video_id=video_id, error=str(e))
+
+# Escuta o canal de eventos de vídeos e invalida a cache local do detalhe (alterações feitas por outras
+# réplicas da API e pelos workers), registando cada escrita no read_router. Se a ligação ao Redis cair, a
+# cache local é limpa ao voltar a subscrever, porque podem ter sido perdidos eventos.
+async def listen_video_events(redis_client: aioredis.Redis):
+    while True:
+        pubsub = redis_client.pubsub()
+        try:
+            await pubsub.subscribe(VIDEO_EVENTS_CHANNEL)
+            video_local_cache.invalidate()
+            read_router.note_write()
+            async for message in pubsub.listen():
+                if message["type"] != "message":
+                    continue
+                try:
+                    video_id = int(json.loads(message["data"])["id"])
+                except (ValueError, KeyError, TypeError):
+                    video_local_cache.invalidate()
+                    read_router.note_write()
+                    continue
+                video_local_cache.invalidate(f"video:{video_id}")
+                read_router.note_write(video_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log_event("video_events_disconnected", logging.WARNING, channel=VIDEO_EVENTS_CHANNEL, error=str(e))
+            await asyncio.sleep(5)
+        finally:
+            await pubsub.aclose()
+
+# Procura um vídeo, primeiro na cache local, depois no Redis e por fim na base de dados
+async def get_video(db: AsyncSession, video_id: int, redis_client: aioredis.Redis):
+    async def load() -> str:
+        video = await db.get(Video, video_id)
+        if not video:
+            raise HTTPException(status_code=404, detail="Vídeo não encontrado")
+        return dumps(video_to_dict(video))
+
+    return await aget_or_load_local(video_local_cache, redis_client, f"video:{video_id}", VIDEO_CACHE_TTL, load)
+
+# Remove o detalhe de um vídeo das caches (local e Redis)
+async def invalidate_video_cache(redis_client: aioredis.Redis, video_id: int):
+    video_local_cache.invalidate(f"video:{video_id}")
+    await redis_client.delete(f"video:{video_id}")
+
+# Remove o detalhe de vários vídeos das caches, invalida a listagem e publica os eventos num único pipeline
+async def invalidate_videos(redis_client: aioredis.Redis, video_ids: list, op: str):
+    pipe = redis_client.pipeline(transaction=False)
+    queue_batch_invalidation(pipe, video_ids, op)
+    await pipe.execute()
+
+# Procura vários vídeos de uma vez (cache local, MGET no Redis e uma query IN; ver controller.get_videos_batch)
+async def get_videos_batch(db: AsyncSession, video_ids: list, redis_client: aioredis.Redis) -> dict:
+    found, remaining, generation = batch_from_local(video_ids)
+    missing = []
+    if remaining:
+        raws = await redis_client.mget([f"video:{i}" for i in remaining])
+        missing = batch_from_redis(remaining, raws, found, generation)
+    videos, delta = [], 0.0
+    if missing:
+        start = time.perf_counter()
+        videos = (await db.execute(select(Video).where(Video.id.in_(missing)))).scalars().all()
+        delta = time.perf_counter() - start
+    pipe = redis_client.pipeline(transaction=False)
+    result = batch_result(pipe, video_ids, videos, found, generation, delta, db.bind)
+    if videos:
+        await pipe.execute()
+    return result
+
+# Procura uma página da lista de vídeos, primeiro na cache e depois na base de dados.
+# Devolve o JSON da página já serializado e o respetivo ETag.
+async def list_videos(
+    db: AsyncSession,
+    redis_client: aioredis.Redis,
+    limit: int = 100,
+    cursor: str = None,
+    sort: str = "-upload_time",
+    title: str = None,
+    min_duration: int = None,
+    max_duration: int = None,
+) -> tuple:
+    stmt = list_statement(limit, cursor, sort, title, min_duration, max_duration)
+    version = await redis_client.get(LIST_VERSION_KEY)
+    cache_key = list_cache_key(version, limit, cursor, sort, title, min_duration, max_duration)
+
+    async def load() -> str:
+        videos = (await db.execute(stmt)).scalars().all()
+        return build_page(videos, limit, sort)
+
+    page = await aget_or_load(redis_client, cache_key, read_router.cache_ttl(db.bind, LIST_CACHE_TTL), load, "list")
+    return page, page_etag(page)
+
+# Atualiza os dados de um vídeo existente e limpa os caches (ver controller.update_video).
+# As operações do armazenamento por conteúdo são síncronas e correm na sessão via run_sync.
+async def update_video(
+    db: AsyncSession,
+    video_id: int,
+    title: str,
+    description: str,
+    duration: int,
+    redis_client: aioredis.Redis,
+    upload_path: str = None,
+    content_hash: str = None
+):
+    video = await db.get(Video, video_id)
+    if not video:
+        raise HTTPException(status_code=404, detail="Vídeo não encontrado")
+    video.title = title
+    video.description = description
+    video.duration = duration
+
+    released, stored = [], []
+    try:
+        if upload_path:
+            old_path, old_key = video.file_path, blob_key(video)
+            _, ext = os.path.splitext(upload_path.removesuffix(".part"))
+            video.file_path = await db.run_sync(store_blob, upload_path, content_hash, ext)
+            stored = [(video.file_path, content_hash)]
+            video.content_hash = content_hash
+            if video.file_path != old_path:
+                video.abr_status = video.preview_status = "pending"
+                released = await db.run_sync(release_blob, old_path, old_key)
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        await db.run_sync(remove_released_blobs, stored)
+        raise
+    await db.run_sync(remove_released_blobs, released)
+    await invalidate_video_cache(redis_client, video_id)
+    await invalidate_list_cache(redis_client)
+    await publish_video_event(redis_client, "update", video_id)
+
+    await db.refresh(video)
+    return video
+
+# Apaga um vídeo da base de dados e o seu ficheiro, se mais nenhum vídeo o referenciar
+async def delete_video(db: AsyncSession, video_id: int, redis_client: aioredis.Redis):
+    video = await db.get(Video, video_id)
+    if not video:
+        raise HTTPException(status_code=404, detail="Vídeo não encontrado")
+
+    await db.delete(video)
+    released = await db.run_sync(release_blob, video.file_path, blob_key(video))
+    await db.commit()
+    await db.run_sync(remove_released_blobs, released)
+    await invalidate_video_cache(redis_client, video_id)
+    await invalidate_list_cache(redis_client)
+    await publish_video_event(redis_client, "delete", video_id)
+    return {"detail": "Vídeo Apagado"}
+
+# Atualiza os dados de vários vídeos numa só transação (ver controller.update_videos)
+async def update_videos(db: AsyncSession, updates: dict, redis_client: aioredis.Redis) -> list:
+    video_ids = list(updates)
+    stmt = select(Video).where(Video.id.in_(video_ids))
+    videos = require_videos((await db.execute(stmt)).scalars().all(), video_ids)
+    for video in videos:
+        video.title, video.description, video.duration = updates[video.id]
+    try:
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        raise
+    await invalidate_videos(redis_client, video_ids, "update")
+    videos = {video.id: video for video in videos}
+    return [video_to_dict(videos[video_id]) for video_id in video_ids]
+
+# Apaga vários vídeos numa só transação (ver controller.delete_videos)
+async def delete_videos(db: AsyncSession, video_ids: list, redis_client: aioredis.Redis) -> dict:
+    stmt = select(Video).where(Video.id.in_(video_ids))
+    videos = require_videos((await db.execute(stmt)).scalars().all(), video_ids)
+    blobs = {video.file_path: blob_key(video) for video in videos}
+    for video in videos:
+        await db.delete(video)
+    released = []
+    try:
+        for file_path, key in sorted(blobs.items(), key=lambda blob: blob[1]):
+            released += await db.run_sync(release_blob, file_path, key)
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        raise
+    await db.run_sync(remove_released_blobs, released)
+    await invalidate_videos(redis_client, video_ids, "delete")
+    return {"detail": f"{len(video_ids)} vídeos apagados", "ids": video_ids}
+
+# Verifica a ligação ao primário sem bloquear o event loop
+async def ping_db():
+    async_engine = read_router.async_engines.get(engine)
+    if async_engine is not None:
+        async with async_engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+        return
+
+    def ping():
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+    await run_in_threadpool(ping)
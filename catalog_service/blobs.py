@@ -0,0 +1,166 @@
+# Imports Gerais
+import os
+import uuid
+import errno
+import shutil
+import hashlib
+import logging
+
+# Imports Extra
+from sqlalchemy import func, text
+from sqlalchemy.orm import Session
+
+# Imports dos Ficheiros
+from metrics import log_event
+from model import Video
+
+# Diretórios de armazenamento dos vídeos:
+# - TEMP_UPLOAD_DIR: uploads em curso (no mesmo sistema de ficheiros, para criar o blob com um hard link)
+# - BLOB_DIR: ficheiros endereçados pelo conteúdo, em blobs/<2 primeiros carateres do hash>/<hash><ext>
+# - ABR_DIR: qualidades transcodificadas (HLS/DASH) de cada conteúdo, em abr/<hash>/
+# - PREVIEW_DIR: miniatura (poster.jpg) e sprite de pré-visualização (sprite.jpg) de cada conteúdo, em previews/<hash>/
+BASE_UPLOAD_DIR = os.getenv("UPLOAD_DIR", "/app/videos")
+TEMP_UPLOAD_DIR = os.path.join(BASE_UPLOAD_DIR, "temp")
+BLOB_DIR = os.path.join(BASE_UPLOAD_DIR, "blobs")
+ABR_DIR = os.path.join(BASE_UPLOAD_DIR, "abr")
+PREVIEW_DIR = os.path.join(BASE_UPLOAD_DIR, "previews")
+# Sufixo do índice de keyframes guardado ao lado de cada ficheiro de vídeo (lido pelo streaming_service)
+KEYFRAME_INDEX_SUFFIX = ".keyframes.json"
+
+
+# Caminho do blob de um conteúdo
+def blob_path(content_hash: str, ext: str = "") -> str:
+    return os.path.join(BLOB_DIR, content_hash[:2], f"{content_hash}{ext.lower()}")
+
+# Diretório das qualidades transcodificadas de um conteúdo
+def abr_dir(content_hash: str) -> str:
+    return os.path.join(ABR_DIR, content_hash)
+
+# Diretório das pré-visualizações de um conteúdo
+def preview_dir(content_hash: str) -> str:
+    return os.path.join(PREVIEW_DIR, content_hash)
+
+# Índice de keyframes (tempo -> offset em bytes) de um ficheiro de vídeo
+def keyframe_index_path(file_path: str) -> str:
+    return f"{file_path}{KEYFRAME_INDEX_SUFFIX}"
+
+# Chave de bloqueio de um ficheiro: o hash do conteúdo, ou o caminho para vídeos antigos sem hash
+def blob_key(video: Video) -> str:
+    return video.content_hash or video.file_path
+
+# Bloqueia um blob até ao fim da transação atual (PostgreSQL), para que a criação de uma referência
+# nova e a remoção da última referência do mesmo ficheiro nunca se cruzem
+def lock_blob(db: Session, key: str):
+    if db.get_bind().dialect.name == "postgresql":
+        db.execute(text("SELECT pg_advisory_xact_lock(hashtext(:key))"), {"key": key})
+
+# Cria o blob final a partir de um ficheiro sem o alterar: um hard link (O(1), nenhum byte é copiado) ou,
+# noutro sistema de ficheiros ou sem suporte para hard links, uma cópia com um rename atómico.
+# Um blob que já existe no caminho final é reutilizado (tem o mesmo conteúdo).
+def link_blob(path: str, final_path: str, copy: bool = False):
+    os.makedirs(os.path.dirname(final_path), exist_ok=True)
+    if not copy:
+        try:
+            os.link(path, final_path)
+            return
+        except FileExistsError:
+            return
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+                raise
+    if os.path.exists(final_path):
+        return
+    tmp_path = f"{final_path}.{uuid.uuid4()}.tmp"
+    try:
+        shutil.copyfile(path, tmp_path)
+        os.replace(tmp_path, final_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+# Coloca um upload no armazenamento por conteúdo e devolve o caminho a guardar no vídeo.
+# Se já existe um vídeo com o mesmo conteúdo, reutiliza o ficheiro dele; caso contrário cria o blob com
+# um hard link para o temporário. O temporário nunca é alterado aqui: só pode ser apagado (com
+# remove_temp_files) depois do commit que grava o vídeo. Se a transação falhar, o blob criado é desfeito
+# com remove_released_blobs([(caminho, hash)]) depois do rollback (só é apagado se nenhum vídeo o referenciar).
+# Tem de ser chamada na mesma transação que grava o vídeo (o bloqueio dura até ao commit).
+def store_blob(db: Session, temp_path: str, content_hash: str, ext: str = "") -> str:
+    lock_blob(db, content_hash)
+    existing = db.query(Video.file_path).filter(Video.content_hash == content_hash).first()
+    if existing and os.path.exists(existing.file_path):
+        return existing.file_path
+
+    final_path = blob_path(content_hash, ext)
+    link_blob(temp_path, final_path)
+    return final_path
+
+# Número de vídeos que referenciam um ficheiro
+def blob_refcount(db: Session, file_path: str) -> int:
+    return db.query(func.count(Video.id)).filter(Video.file_path == file_path).scalar()
+
+# Verifica, sob o bloqueio do blob, se um ficheiro deixou de ser referenciado.
+# Deve ser chamada depois de remover/alterar a referência na sessão e antes do commit, para que o
+# bloqueio cubra a contagem. Devolve os blobs ([(caminho, chave)]) a passar a remove_released_blobs
+# depois do commit: nada é apagado antes, para que um commit falhado não deixe um vídeo sem ficheiro.
+def release_blob(db: Session, file_path: str, key: str) -> list:
+    lock_blob(db, key)
+    db.flush()
+    if blob_refcount(db, file_path) > 0 or not os.path.exists(file_path):
+        return []
+    return [(file_path, key)]
+
+# Apaga um ficheiro juntamente com o seu índice de keyframes, as suas qualidades transcodificadas e as
+# suas pré-visualizações
+def remove_blob_files(file_path: str):
+    try:
+        os.remove(file_path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        log_event("blob_remove_failed", logging.ERROR, path=file_path, error=str(e))
+        return
+    try:
+        os.remove(keyframe_index_path(file_path))
+    except FileNotFoundError:
+        pass
+    if file_path.startswith(BLOB_DIR + os.sep):
+        content_hash = os.path.basename(file_path).split(".")[0]
+        shutil.rmtree(abr_dir(content_hash), ignore_errors=True)
+        shutil.rmtree(preview_dir(content_hash), ignore_errors=True)
+
+# Apaga os blobs devolvidos por release_blob, depois do commit que removeu as referências. A contagem é
+# repetida sob o bloqueio, numa transação nova, porque um upload do mesmo conteúdo pode ter voltado a
+# referenciar o ficheiro depois do commit. Uma falha aqui só deixa ficheiros órfãos (removidos pelo
+# dedup.py), por isso é registada e não interrompe o pedido.
+def remove_released_blobs(db: Session, released: list):
+    if not released:
+        return
+    try:
+        # Ordem fixa dos locks dos ficheiros, como em delete_videos
+        for file_path, key in sorted(released, key=lambda blob: blob[1]):
+            lock_blob(db, key)
+            if blob_refcount(db, file_path) == 0:
+                remove_blob_files(file_path)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        log_event("blob_release_failed", logging.ERROR, paths=[path for path, _ in released], error=str(e))
+
+# Apaga os temporários de uploads já colocados no armazenamento por conteúdo, depois do commit que os
+# registou. Uma falha só deixa um temporário órfão, por isso é registada e não interrompe o pedido.
+def remove_temp_files(paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            log_event("temp_file_remove_failed", logging.WARNING, path=path, error=str(e))
+
+# SHA-256 de um ficheiro no disco, lido em blocos
+def file_sha256(path: str, block_size: int = 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
@@ -0,0 +1,200 @@
+# Comando de importação de uma biblioteca de vídeos já existente no disco, sem passar pelo upload HTTP.
+# 1. percorre a árvore de diretórios e envia cada ficheiro para um pool de processos, que calcula o tamanho,
+#    o SHA-256 e a duração (ffprobe); os resultados são consumidos à medida que ficam prontos
+# 2. coloca cada ficheiro no armazenamento por conteúdo com um hard link (O(1), sem copiar bytes; cópia se
+#    a origem estiver noutro sistema de ficheiros) e regista os vídeos em lotes: um INSERT de várias linhas e
+#    um commit por lote, com uma única invalidação das caches
+# 3. enfileira as etapas seguintes (faststart, pré-visualizações, transcodificação) com a prioridade das
+#    importações em massa, para não atrasar os uploads interativos
+# O ficheiro de checkpoint guarda os ficheiros já registados (acrescentados depois de cada commit): voltar a
+# correr o comando com a mesma pasta retoma a importação. Um ficheiro cujo conteúdo já está no catálogo não é
+# registado outra vez, por isso uma execução interrompida entre o commit e o checkpoint não duplica vídeos.
+# Com --mode move as origens só são apagadas depois do commit; com --mode link a origem e o blob partilham o
+# ficheiro, que não deve ser alterado no lugar.
+#
+# Exemplo (dentro do container do catalog_service):
+#   python bulk_import.py /mnt/biblioteca --workers 8 --batch-size 500
+#   python bulk_import.py /mnt/biblioteca --mode move --no-stages
+
+# Imports Gerais
+import os
+import sys
+import json
+import time
+import hashlib
+import logging
+import argparse
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+# Imports dos Ficheiros
+from blobs import BASE_UPLOAD_DIR, BLOB_DIR, blob_path, file_sha256, link_blob, lock_blob
+from controller import create_videos, video_to_dict
+from metrics import log_event
+from model import Video, SessionLocal, init_db
+from tasks import PRIORITY_BULK, media_stages, task_redis
+from transcode import probe_duration
+
+# Extensões de vídeo importadas por omissão
+VIDEO_EXTENSIONS = ".mp4,.m4v,.mov,.mkv,.webm,.avi"
+# Diretório dos checkpoints (fora de temp/, que é limpo pelo dedup.py)
+CHECKPOINT_DIR = os.path.join(BASE_UPLOAD_DIR, "imports")
+
+
+# Ficheiros de vídeo de uma árvore de diretórios, por ordem, sem os que já estão no checkpoint
+def scan(root: str, extensions: set, done: set, report: dict):
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            path = os.path.join(dirpath, name)
+            if os.path.splitext(name)[1].lower() not in extensions or not os.path.isfile(path):
+                continue
+            report["scanned"] += 1
+            if path in done:
+                report["skipped"] += 1
+                continue
+            yield path
+
+# Metadados de um ficheiro (corre num processo do pool). Um ficheiro ilegível ou sem faixa de vídeo é
+# devolvido com 'error' e não é registado.
+def inspect_file(path: str) -> dict:
+    try:
+        return {"path": path, "size": os.path.getsize(path), "content_hash": file_sha256(path),
+                "duration": probe_duration(path)}
+    except Exception as e:
+        return {"path": path, "error": str(e) or type(e).__name__}
+
+# Metadados dos ficheiros, calculados no pool de processos com no máximo 'window' ficheiros em curso
+# (a árvore é percorrida à medida que os resultados são consumidos, sem a carregar toda em memória)
+def inspect_files(paths, workers: int, window: int):
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = set()
+        for path in paths:
+            pending.add(pool.submit(inspect_file, path))
+            if len(pending) >= window:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        for future in wait(pending).done:
+            yield future.result()
+
+# Vídeo já registado com o conteúdo indicado (o primeiro), com o lock do conteúdo até ao fim da transação
+def registered_video(db, content_hash: str):
+    lock_blob(db, content_hash)
+    return db.query(Video).filter(Video.content_hash == content_hash).order_by(Video.id).first()
+
+# Coloca um ficheiro no armazenamento por conteúdo sem alterar a origem e devolve o caminho do blob.
+# Um blob já colocado por uma execução interrompida (antes do commit) é reutilizado.
+def place_blob(path: str, content_hash: str, mode: str) -> str:
+    final_path = blob_path(content_hash, os.path.splitext(path)[1])
+    link_blob(path, final_path, copy=mode == "copy")
+    return final_path
+
+# Título de um vídeo importado, a partir do nome do ficheiro
+def title_for(path: str) -> str:
+    return os.path.splitext(os.path.basename(path))[0].replace("_", " ").strip() or os.path.basename(path)
+
+# Regista um lote de ficheiros numa só transação e, depois do commit, acrescenta-os ao checkpoint,
+# apaga as origens (--mode move) e enfileira as etapas seguintes de cada vídeo.
+# Os ficheiros com conteúdo já registado (p.ex. por uma execução interrompida antes de escrever o checkpoint)
+# não são inseridos outra vez; as etapas são enfileiradas para os que ainda não as correram.
+def register_batch(items: list, args, checkpoint, redis_client, report: dict):
+    db = SessionLocal()
+    try:
+        rows, registered = [], []
+        # Ordem fixa dos locks do armazenamento por conteúdo (ver register_videos_batch)
+        for item in sorted(items, key=lambda item: item["content_hash"]):
+            existing = registered_video(db, item["content_hash"])
+            if existing is not None:
+                registered.append(video_to_dict(existing))
+                continue
+            rows.append({"title": title_for(item["path"]), "description": args.description,
+                         "duration": item["duration"], "content_hash": item["content_hash"],
+                         "file_path": place_blob(item["path"], item["content_hash"], args.mode)})
+        videos = [video_to_dict(video) for video in create_videos(db, rows, redis_client)]
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+    checkpoint.write("".join(f"{item['path']}\n" for item in items))
+    checkpoint.flush()
+    os.fsync(checkpoint.fileno())
+    report["imported"] += len(videos)
+    report["already_registered"] += len(registered)
+    report["bytes"] += sum(item["size"] for item in items)
+    if args.mode == "move":
+        for item in items:
+            try:
+                os.remove(item["path"])
+            except OSError as e:
+                log_event("import_source_remove_failed", logging.WARNING, path=item["path"], error=str(e))
+
+    if not args.no_stages:
+        pending = [video for video in registered
+                   if "pending" in (video["preview_status"], video["abr_status"])]
+        for video in videos + pending:
+            try:
+                media_stages(PRIORITY_BULK, video).apply_async()
+            except Exception as e:
+                report["stages_failed"] += 1
+                log_event("import_stages_failed", logging.ERROR, video_id=video["id"], error=str(e))
+
+# Débito da importação até agora
+def throughput(report: dict, started: float) -> dict:
+    elapsed = max(time.perf_counter() - started, 1e-9)
+    return {"seconds": round(elapsed, 1), "files_per_s": round(report["imported"] / elapsed, 1),
+            "mb_per_s": round(report["bytes"] / elapsed / 1e6, 1)}
+
+def main(args):
+    root = os.path.abspath(args.root)
+    if not os.path.isdir(root):
+        sys.exit(f"Diretório não encontrado: {root}")
+    checkpoint_path = args.checkpoint or os.path.join(
+        CHECKPOINT_DIR, f"{hashlib.sha1(root.encode()).hexdigest()[:16]}.checkpoint")
+    os.makedirs(os.path.dirname(os.path.abspath(checkpoint_path)), exist_ok=True)
+    os.makedirs(BLOB_DIR, exist_ok=True)
+    init_db()
+
+    done = set()
+    if os.path.exists(checkpoint_path):
+        with open(checkpoint_path) as f:
+            done = {line.rstrip("\n") for line in f if line.strip()}
+    extensions = {ext.strip().lower() for ext in args.extensions.split(",") if ext.strip()}
+    report = {"root": root, "checkpoint": checkpoint_path, "mode": args.mode, "scanned": 0, "skipped": 0,
+              "imported": 0, "already_registered": 0, "bytes": 0, "stages_failed": 0, "failed": []}
+    redis_client = task_redis()
+    started = time.perf_counter()
+
+    with open(checkpoint_path, "a") as checkpoint:
+        batch = []
+        for item in inspect_files(scan(root, extensions, done, report), args.workers, args.workers * 4):
+            if "error" in item:
+                report["failed"].append(item)
+                continue
+            batch.append(item)
+            if len(batch) >= args.batch_size:
+                register_batch(batch, args, checkpoint, redis_client, report)
+                batch = []
+                print(json.dumps({"imported": report["imported"], **throughput(report, started)}), file=sys.stderr)
+        if batch:
+            register_batch(batch, args, checkpoint, redis_client, report)
+
+    report.update(throughput(report, started))
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Importação de uma biblioteca de vídeos existente")
+    parser.add_argument("root", help="Diretório com os vídeos a importar (percorrido recursivamente)")
+    parser.add_argument("--mode", choices=("link", "copy", "move"), default="link",
+                        help="Como colocar os ficheiros no armazenamento: hard link, cópia ou mover")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Processos a calcular os hashes e as durações")
+    parser.add_argument("--batch-size", type=int, default=500, help="Vídeos registados por transação")
+    parser.add_argument("--checkpoint", help="Ficheiro de checkpoint (por omissão, um por diretório em imports/)")
+    parser.add_argument("--extensions", default=VIDEO_EXTENSIONS, help="Extensões importadas, separadas por vírgulas")
+    parser.add_argument("--description", help="Descrição dos vídeos importados")
+    parser.add_argument("--no-stages", action="store_true",
+                        help="Não enfileira o faststart, as pré-visualizações nem a transcodificação")
+    main(parser.parse_args())
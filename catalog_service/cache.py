@@ -0,0 +1,362 @@
+# Imports Gerais
+import os
+import math
+import time
+import uuid
+import random
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+
+# Imports Extra
+import orjson
+import redis
+import redis.asyncio as aioredis
+
+# Imports dos Ficheiros
+from metrics import CACHE_EVENTS, CACHE_LOOKUP_DURATION, log_event
+
+# Leitura das caches do catálogo no Redis com proteção contra stampedes:
+# - single-flight: num miss, só um pedido (por processo, e entre processos através de um lock no Redis por
+#   chave) vai à base de dados; os restantes esperam e recebem o valor que ele guardar
+# - refresh antecipado probabilístico (XFetch): antes de a entrada expirar, cada leitura tem uma probabilidade
+#   crescente de a recalcular, proporcional ao tempo que o cálculo demorou, para que as chaves populares
+#   sejam renovadas por um único pedido antes de expirarem
+# - stale-while-revalidate: uma entrada expirada continua no Redis durante CACHE_STALE_TTL; enquanto um
+#   pedido a recalcula, os outros recebem o valor antigo em vez de irem à base de dados
+# Cada entrada guarda "v<versão>|<expira em (epoch)>|<duração do cálculo (s)>|<valor>", com o valor em JSON
+# (orjson). Entradas de outra versão do formato são tratadas como um miss e reescritas, por isso mudar o
+# formato das entradas ou dos valores (p.ex. video_to_dict) só exige incrementar CACHE_FORMAT_VERSION,
+# sem limpar o Redis.
+CACHE_FORMAT_VERSION = 2
+CACHE_STALE_TTL = int(os.getenv("CACHE_STALE_TTL", "300"))
+CACHE_LOCK_TTL_MS = int(os.getenv("CACHE_LOCK_TTL_MS", "5000"))
+CACHE_XFETCH_BETA = float(os.getenv("CACHE_XFETCH_BETA", "1.0"))
+# Intervalos (s) entre leituras de quem espera pelo valor calculado por outro processo
+CACHE_WAIT_MIN = 0.005
+CACHE_WAIT_MAX = 0.05
+
+
+_ENTRY_PREFIX = f"v{CACHE_FORMAT_VERSION}|"
+
+
+# Serializa um valor em JSON (orjson, mais rápido do que o módulo json e sem espaços)
+def dumps(value) -> str:
+    return orjson.dumps(value).decode()
+
+def loads(raw):
+    return orjson.loads(raw)
+
+# Serializa um valor com a versão do formato, a hora de expiração lógica e a duração do cálculo
+def encode_entry(value: str, ttl: int, delta: float) -> str:
+    return f"{_ENTRY_PREFIX}{time.time() + ttl:.3f}|{delta:.4f}|{value}"
+
+# Lê uma entrada (expira em, duração do cálculo, valor), ou None se não existir ou tiver outra versão do formato
+def decode_entry(raw):
+    if not raw or not raw.startswith(_ENTRY_PREFIX):
+        return None
+    try:
+        expiry, delta, value = raw[len(_ENTRY_PREFIX):].split("|", 2)
+        return float(expiry), float(delta), value
+    except ValueError:
+        return None
+
+# Decide se a entrada deve ser recalculada agora: sempre depois de expirar e, antes disso, com probabilidade
+# maior quanto mais perto estiver do fim e quanto mais caro for o cálculo (XFetch)
+def should_refresh(expiry: float, delta: float, now: float) -> bool:
+    return now - delta * CACHE_XFETCH_BETA * math.log(1.0 - random.random()) >= expiry
+
+def lock_key(key: str) -> str:
+    return f"lock:{key}"
+
+# Remove o lock de uma chave só se ainda guardar o token de quem o obteve, numa única operação: um lock que
+# expirou e foi obtido por outro pedido entre a leitura e a remoção nunca é apagado
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+def release_lock(redis_client: redis.Redis, key: str, token: str) -> bool:
+    return bool(redis_client.register_script(RELEASE_LOCK_SCRIPT)(keys=[lock_key(key)], args=[token]))
+
+async def arelease_lock(redis_client: aioredis.Redis, key: str, token: str) -> bool:
+    return bool(await redis_client.register_script(RELEASE_LOCK_SCRIPT)(keys=[lock_key(key)], args=[token]))
+
+
+# Agrupa chamadas concorrentes com a mesma chave numa só (threads da threadpool)
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key: str, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {"done": threading.Event(), "result": None, "error": None}
+        if not leader:
+            call["done"].wait()
+            if call["error"] is not None:
+                raise call["error"]
+            return call["result"], True
+        try:
+            call["result"] = fn()
+            return call["result"], False
+        except BaseException as e:
+            call["error"] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call["done"].set()
+
+# Agrupa chamadas concorrentes com a mesma chave numa só (corrotinas do event loop)
+class AsyncSingleFlight:
+    def __init__(self):
+        self._calls = {}
+
+    async def do(self, key: str, fn):
+        task = self._calls.get(key)
+        if task is not None:
+            return await asyncio.shield(task), True
+        task = asyncio.ensure_future(fn())
+        self._calls[key] = task
+        try:
+            return await asyncio.shield(task), False
+        finally:
+            if self._calls.get(key) is task:
+                del self._calls[key]
+
+_flights = SingleFlight()
+_async_flights = AsyncSingleFlight()
+
+
+# Calcula um valor com o lock da chave já obtido, guarda-o e liberta o lock. Se entretanto outro pedido
+# já guardou uma versão diferente da que foi lida (seen_expiry, None num miss), devolve essa sem recalcular.
+def _load_and_store(redis_client: redis.Redis, key: str, ttl: int, loader, token: str, seen_expiry=None) -> str:
+    try:
+        entry = decode_entry(redis_client.get(key))
+        if entry is not None and entry[0] != seen_expiry:
+            return entry[2]
+        start = time.perf_counter()
+        value = loader()
+        redis_client.set(key, encode_entry(value, ttl, time.perf_counter() - start), ex=ttl + CACHE_STALE_TTL)
+        return value
+    finally:
+        release_lock(redis_client, key, token)
+
+# Miss: tenta obter o lock da chave; sem ele, espera que o dono guarde o valor (ou liberte o lock sem valor,
+# caso em que tenta de novo). Ao fim de CACHE_LOCK_TTL_MS sem valor calcula-o diretamente.
+def _load_exclusive(redis_client: redis.Redis, key: str, ttl: int, loader, cache: str) -> str:
+    deadline = time.monotonic() + CACHE_LOCK_TTL_MS / 1000
+    wait = CACHE_WAIT_MIN
+    while time.monotonic() < deadline:
+        token = uuid.uuid4().hex
+        if redis_client.set(lock_key(key), token, nx=True, px=CACHE_LOCK_TTL_MS):
+            CACHE_EVENTS.labels(cache, "redis", "miss").inc()
+            return _load_and_store(redis_client, key, ttl, loader, token)
+        while time.monotonic() < deadline:
+            time.sleep(wait)
+            wait = min(wait * 2, CACHE_WAIT_MAX)
+            entry = decode_entry(redis_client.get(key))
+            if entry is not None:
+                CACHE_EVENTS.labels(cache, "redis", "coalesced").inc()
+                return entry[2]
+            if not redis_client.exists(lock_key(key)):
+                break
+    CACHE_EVENTS.labels(cache, "redis", "miss").inc()
+    log_event("cache_lock_timeout", logging.WARNING, key=key)
+    start = time.perf_counter()
+    value = loader()
+    redis_client.set(key, encode_entry(value, ttl, time.perf_counter() - start), ex=ttl + CACHE_STALE_TTL)
+    return value
+
+# Devolve o valor (str) de uma chave da cache, calculando-o com loader() quando falta ou deve ser renovado.
+# A latência é registada pelo nível que respondeu: 'redis' (incluindo valores expirados servidos enquanto
+# outro pedido os renova) ou 'database' (misses e renovações, mesmo que o cálculo seja de outro pedido).
+def get_or_load(redis_client: redis.Redis, key: str, ttl: int, loader, cache: str) -> str:
+    start = time.perf_counter()
+    entry = decode_entry(redis_client.get(key))
+    if entry is None:
+        value, shared = _flights.do(key, lambda: _load_exclusive(redis_client, key, ttl, loader, cache))
+        if shared:
+            CACHE_EVENTS.labels(cache, "memory", "coalesced").inc()
+        CACHE_LOOKUP_DURATION.labels(cache, "database").observe(time.perf_counter() - start)
+        return value
+
+    expiry, delta, value = entry
+    now = time.time()
+    if not should_refresh(expiry, delta, now):
+        CACHE_EVENTS.labels(cache, "redis", "hit").inc()
+        CACHE_LOOKUP_DURATION.labels(cache, "redis").observe(time.perf_counter() - start)
+        return value
+    # Expirada (ou escolhida para renovação antecipada): só quem obtiver o lock recalcula; os restantes
+    # recebem o valor atual. Se o cálculo falhar, o valor antigo continua a ser servido.
+    token = uuid.uuid4().hex
+    if not redis_client.set(lock_key(key), token, nx=True, px=CACHE_LOCK_TTL_MS):
+        CACHE_EVENTS.labels(cache, "redis", "stale" if now >= expiry else "hit").inc()
+        CACHE_LOOKUP_DURATION.labels(cache, "redis").observe(time.perf_counter() - start)
+        return value
+    CACHE_EVENTS.labels(cache, "redis", "refresh" if now >= expiry else "early_refresh").inc()
+    try:
+        value = _load_and_store(redis_client, key, ttl, loader, token, expiry)
+    except Exception as e:
+        log_event("cache_refresh_failed", logging.WARNING, key=key, error=str(e))
+    CACHE_LOOKUP_DURATION.labels(cache, "database").observe(time.perf_counter() - start)
+    return value
+
+
+# Versões assíncronas (redis.asyncio), com o mesmo comportamento
+async def _aload_and_store(redis_client: aioredis.Redis, key: str, ttl: int, loader, token: str,
+                           seen_expiry=None) -> str:
+    try:
+        entry = decode_entry(await redis_client.get(key))
+        if entry is not None and entry[0] != seen_expiry:
+            return entry[2]
+        start = time.perf_counter()
+        value = await loader()
+        await redis_client.set(key, encode_entry(value, ttl, time.perf_counter() - start),
+                               ex=ttl + CACHE_STALE_TTL)
+        return value
+    finally:
+        await arelease_lock(redis_client, key, token)
+
+async def _aload_exclusive(redis_client: aioredis.Redis, key: str, ttl: int, loader, cache: str) -> str:
+    deadline = time.monotonic() + CACHE_LOCK_TTL_MS / 1000
+    wait = CACHE_WAIT_MIN
+    while time.monotonic() < deadline:
+        token = uuid.uuid4().hex
+        if await redis_client.set(lock_key(key), token, nx=True, px=CACHE_LOCK_TTL_MS):
+            CACHE_EVENTS.labels(cache, "redis", "miss").inc()
+            return await _aload_and_store(redis_client, key, ttl, loader, token)
+        while time.monotonic() < deadline:
+            await asyncio.sleep(wait)
+            wait = min(wait * 2, CACHE_WAIT_MAX)
+            entry = decode_entry(await redis_client.get(key))
+            if entry is not None:
+                CACHE_EVENTS.labels(cache, "redis", "coalesced").inc()
+                return entry[2]
+            if not await redis_client.exists(lock_key(key)):
+                break
+    CACHE_EVENTS.labels(cache, "redis", "miss").inc()
+    log_event("cache_lock_timeout", logging.WARNING, key=key)
+    start = time.perf_counter()
+    value = await loader()
+    await redis_client.set(key, encode_entry(value, ttl, time.perf_counter() - start), ex=ttl + CACHE_STALE_TTL)
+    return value
+
+async def aget_or_load(redis_client: aioredis.Redis, key: str, ttl: int, loader, cache: str) -> str:
+    start = time.perf_counter()
+    entry = decode_entry(await redis_client.get(key))
+    if entry is None:
+        value, shared = await _async_flights.do(key, lambda: _aload_exclusive(redis_client, key, ttl, loader, cache))
+        if shared:
+            CACHE_EVENTS.labels(cache, "memory", "coalesced").inc()
+        CACHE_LOOKUP_DURATION.labels(cache, "database").observe(time.perf_counter() - start)
+        return value
+
+    expiry, delta, value = entry
+    now = time.time()
+    if not should_refresh(expiry, delta, now):
+        CACHE_EVENTS.labels(cache, "redis", "hit").inc()
+        CACHE_LOOKUP_DURATION.labels(cache, "redis").observe(time.perf_counter() - start)
+        return value
+    token = uuid.uuid4().hex
+    if not await redis_client.set(lock_key(key), token, nx=True, px=CACHE_LOCK_TTL_MS):
+        CACHE_EVENTS.labels(cache, "redis", "stale" if now >= expiry else "hit").inc()
+        CACHE_LOOKUP_DURATION.labels(cache, "redis").observe(time.perf_counter() - start)
+        return value
+    CACHE_EVENTS.labels(cache, "redis", "refresh" if now >= expiry else "early_refresh").inc()
+    try:
+        value = await _aload_and_store(redis_client, key, ttl, loader, token, expiry)
+    except Exception as e:
+        log_event("cache_refresh_failed", logging.WARNING, key=key, error=str(e))
+    CACHE_LOOKUP_DURATION.labels(cache, "database").observe(time.perf_counter() - start)
+    return value
+
+
+# Nível em memória (por processo) à frente do Redis: uma LRU limitada em tamanho e em tempo que guarda os
+# valores já desserializados, por isso um hit não faz ida ao Redis nem parse do JSON. Os valores são
+# partilhados entre pedidos e não devem ser alterados. A coerência entre réplicas vem dos eventos de
+# alteração publicados no Redis (ver async_controller.listen_video_events); o TTL curto limita o tempo
+# em que um valor pode ficar desatualizado se um evento se perder.
+class LocalCache:
+    def __init__(self, name: str, max_size: int, ttl: float):
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._generation = 0
+
+    # Devolve o valor em cache (ou None se faltar ou tiver expirado)
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    # Geração atual, lida antes de carregar um valor e passada a put()
+    def generation(self) -> int:
+        return self._generation
+
+    # Guarda um valor, exceto se houve uma invalidação desde que foi lida a geração (o valor pode ser antigo)
+    def put(self, key: str, value, generation: int):
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                CACHE_EVENTS.labels(self.name, "memory", "evict").inc()
+
+    # Remove uma chave da cache (ou toda a cache, sem chave)
+    def invalidate(self, key: str = None):
+        with self._lock:
+            self._generation += 1
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+        CACHE_EVENTS.labels(self.name, "memory", "invalidation").inc()
+
+    def __len__(self):
+        return len(self._entries)
+
+# Procura um valor primeiro na cache local e depois no Redis/base de dados (get_or_load), guardando na
+# cache local o valor desserializado
+def get_or_load_local(local: LocalCache, redis_client: redis.Redis, key: str, ttl: int, loader):
+    start = time.perf_counter()
+    value = local.get(key)
+    if value is not None:
+        CACHE_EVENTS.labels(local.name, "memory", "hit").inc()
+        CACHE_LOOKUP_DURATION.labels(local.name, "memory").observe(time.perf_counter() - start)
+        return value
+    CACHE_EVENTS.labels(local.name, "memory", "miss").inc()
+    generation = local.generation()
+    value = loads(get_or_load(redis_client, key, ttl, loader, local.name))
+    local.put(key, value, generation)
+    return value
+
+async def aget_or_load_local(local: LocalCache, redis_client: aioredis.Redis, key: str, ttl: int, loader):
+    start = time.perf_counter()
+    value = local.get(key)
+    if value is not None:
+        CACHE_EVENTS.labels(local.name, "memory", "hit").inc()
+        CACHE_LOOKUP_DURATION.labels(local.name, "memory").observe(time.perf_counter() - start)
+        return value
+    CACHE_EVENTS.labels(local.name, "memory", "miss").inc()
+    generation = local.generation()
+    value = loads(await aget_or_load(redis_client, key, ttl, loader, local.name))
+    local.put(key, value, generation)
+    return value
@@ -1,14 +1,68 @@
 # Imports Gerais
 import os
+import re
 import json
+import base64
+import hashlib
+import logging
+import time
+from datetime import datetime
+from typing import Optional
 
 # Imports Extra
 import redis
-from fastapi import HTTPException
+from fastapi import HTTPException, Request
+from sqlalchemy import func, literal_column, or_, select, tuple_
 from sqlalchemy.orm import Session
 
 # Imports dos Ficheiros
-from model import Video, SessionLocal
+from blobs import store_blob, release_blob, remove_released_blobs, blob_key, lock_blob
+from cache import (LocalCache, CACHE_STALE_TTL, decode_entry, dumps, encode_entry, get_or_load, get_or_load_local,
+                   loads)
+from metrics import CACHE_EVENTS, log_event
+from model import Video, SessionLocal, ReadSessionLocal, read_router, DB_READ_YOUR_WRITES_WINDOW
+
+# Canal Redis onde são publicadas as alterações a vídeos (usado para invalidar caches locais noutros serviços)
+VIDEO_EVENTS_CHANNEL = os.getenv("VIDEO_EVENTS_CHANNEL", "video_events")
+
+# Cache das páginas da listagem: cada página tem a sua chave, prefixada pela versão atual da lista.
+# Uma escrita apenas incrementa a versão, tornando todas as páginas antigas inacessíveis (expiram pelo TTL).
+LIST_VERSION_KEY = "videos_list:version"
+LIST_CACHE_TTL = 3600
+# Tempo de vida do detalhe de cada vídeo em cache (video:<id>)
+VIDEO_CACHE_TTL = 3600
+# Cache local (em memória, por processo) do detalhe dos vídeos, à frente do Redis: lida em cada pedido de
+# stream e em cada página, evita a ida ao Redis e o parse do JSON. É invalidada pelos eventos de
+# VIDEO_EVENTS_CHANNEL, incluindo os publicados por outras réplicas e pelos workers.
+LOCAL_CACHE_SIZE = int(os.getenv("LOCAL_CACHE_SIZE", "2048"))
+LOCAL_CACHE_TTL = float(os.getenv("LOCAL_CACHE_TTL", "30"))
+video_local_cache = LocalCache("video", LOCAL_CACHE_SIZE, LOCAL_CACHE_TTL)
+
+# As três caches (detalhe, listagem e pesquisa) são lidas com cache.get_or_load: num miss só um pedido vai
+# à base de dados, as chaves populares são renovadas antes de expirar e as expiradas são servidas enquanto
+# um único pedido as recalcula. Os valores são serializados com cache.dumps (orjson).
+
+# Número máximo de vídeos por pedido em lote (/videos/batch)
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "200"))
+
+# Read-your-writes por cliente: as respostas das escritas levam este cabeçalho com a hora da escrita (ms);
+# um cliente que o reenvia nas leituras seguintes lê do primário durante DB_READ_YOUR_WRITES_WINDOW.
+# As escritas de outros clientes e dos workers não afastam as restantes leituras das réplicas.
+READ_YOUR_WRITES_HEADER = "X-Read-Your-Writes"
+
+# Campos pelos quais a listagem pode ser ordenada (prefixo '-' para ordem descendente)
+SORT_FIELDS = {
+    "upload_time": Video.upload_time,
+    "updated_time": Video.updated_time,
+    "title": Video.title,
+    "duration": Video.duration,
+}
+DATETIME_SORT_FIELDS = ("upload_time", "updated_time")
+
+# Cache das pesquisas: partilha a versão da lista, por isso qualquer escrita invalida os resultados
+SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL", "300"))
+# Semelhança mínima de trigramas para a pesquisa aproximada (quando não há resultados exatos)
+SEARCH_FUZZY_THRESHOLD = float(os.getenv("SEARCH_FUZZY_THRESHOLD", "0.3"))
 
 # Gere uma sessão de base de dados para cada pedido
 def get_db():
@@ -18,63 +72,348 @@ def get_db():
     finally:
         db.close()
 
+# Valor de READ_YOUR_WRITES_HEADER para a resposta de uma escrita
+def write_marker() -> str:
+    return str(int(time.time() * 1000))
+
+# Verifica se o pedido vem de um cliente que escreveu há menos de DB_READ_YOUR_WRITES_WINDOW segundos
+def read_your_writes(request: Request) -> bool:
+    try:
+        written_at = int(request.headers.get(READ_YOUR_WRITES_HEADER, "")) / 1000
+    except ValueError:
+        return False
+    return abs(time.time() - written_at) < DB_READ_YOUR_WRITES_WINDOW
+
+# Verifica se a leitura de um pedido tem de ir ao primário: logo após uma escrita do mesmo cliente
+# (read-your-writes) ou, no detalhe de um vídeo, depois de uma escrita recente nesse vídeo. As listagens,
+# pesquisas e lotes continuam nas réplicas depois das escritas de outros clientes; o que lerem logo a
+# seguir fica em cache com um TTL curto (ReadRouter.cache_ttl), para não guardar um valor antigo até ao fim do TTL.
+def read_from_primary(request: Request) -> bool:
+    if read_your_writes(request):
+        return True
+    try:
+        video_id = int(request.path_params["video_id"])
+    except (KeyError, ValueError):
+        return False
+    return read_router.written_recently(video_id)
+
+# Gere uma sessão só de leitura, ligada a uma réplica quando possível (ou ao primário, ver read_from_primary)
+def get_read_db(request: Request):
+    db = ReadSessionLocal(bind=read_router.choose(read_from_primary(request)))
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+# Converte um vídeo no dicionário devolvido pela API e guardado em cache
+def video_to_dict(video: Video) -> dict:
+    return {
+        "id": video.id,
+        "title": video.title,
+        "description": video.description,
+        "duration": video.duration,
+        "file_path": video.file_path,
+        "content_hash": video.content_hash,
+        "abr_status": video.abr_status,
+        "preview_status": video.preview_status,
+        "upload_time": video.upload_time.isoformat(),
+        "updated_time": video.updated_time.isoformat(),
+    }
+
+# Invalida todas as páginas da listagem em cache, incrementando a versão da lista
+def invalidate_list_cache(redis_client: redis.Redis):
+    redis_client.incr(LIST_VERSION_KEY)
+
+# Codifica a posição do último elemento de uma página num cursor opaco
+def encode_cursor(sort: str, value, video_id: int) -> str:
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    raw = json.dumps({"s": sort, "v": value, "id": video_id}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+# Descodifica um cursor, validando que foi gerado para a mesma ordenação
+def decode_cursor(cursor: str, sort: str) -> tuple:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        data = json.loads(raw)
+        value, video_id = data["v"], int(data["id"])
+        if data["s"] != sort:
+            raise ValueError("ordenação diferente")
+        if sort.lstrip("-") in DATETIME_SORT_FIELDS:
+            value = datetime.fromisoformat(value)
+    except (ValueError, KeyError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=f"Cursor inválido: {e}")
+    return value, video_id
+
+# Publica um evento de alteração de um vídeo ('create', 'update' ou 'delete')
+def publish_video_event(redis_client: redis.Redis, op: str, video_id: int):
+    try:
+        redis_client.publish(VIDEO_EVENTS_CHANNEL, json.dumps({"op": op, "id": video_id}))
+    except redis.exceptions.RedisError as e:
+        log_event("video_event_publish_failed", logging.WARNING, op=op, video_id=video_id, error=str(e))
 
 # Adiciona um novo vídeo à base de dados e limpa a cache da lista
-def create_video(db: Session, title: str, description: str, duration: int, file_path: str, redis_client: redis.Redis):
+def create_video(db: Session, title: str, description: str, duration: int, file_path: str, redis_client: redis.Redis,
+                 content_hash: str = None):
     video = Video(
         title=title, description=description, duration=duration, 
-        file_path=file_path
+        file_path=file_path, content_hash=content_hash, abr_status="pending", preview_status="pending"
     )
     db.add(video)
     db.commit()
     db.refresh(video)
-    redis_client.delete("videos_list")
+    invalidate_list_cache(redis_client)
+    publish_video_event(redis_client, "create", video.id)
     return video
 
-# Procura um vídeo, primeiro no cache e depois na base de dados
+# Adiciona vários vídeos numa só transação (rows: colunas de cada vídeo), com uma única invalidação das
+# caches; os INSERT são enviados em lote (insertmanyvalues do SQLAlchemy)
+def create_videos(db: Session, rows: list, redis_client: redis.Redis) -> list:
+    videos = [Video(**row, abr_status="pending", preview_status="pending") for row in rows]
+    if not videos:
+        return []
+    db.add_all(videos)
+    db.commit()
+    invalidate_videos(redis_client, [video.id for video in videos], "create")
+    return videos
+
+# Procura um vídeo, primeiro na cache local, depois no Redis e por fim na base de dados.
+# O dicionário devolvido é partilhado com a cache local e não deve ser alterado.
 def get_video(db: Session, video_id: int, redis_client: redis.Redis):
-    cached_video = redis_client.get(f"video:{video_id}")
-    if cached_video:
-        return json.loads(cached_video)
+    def load() -> str:
+        video = db.query(Video).filter(Video.id == video_id).first()
+        if not video:
+            raise HTTPException(status_code=404, detail="Vídeo não encontrado")
+        return dumps(video_to_dict(video))
 
-    video = db.query(Video).filter(Video.id == video_id).first()
-    if not video:
-        raise HTTPException(status_code=404, detail="Vídeo não encontrado")
+    return get_or_load_local(video_local_cache, redis_client, f"video:{video_id}", VIDEO_CACHE_TTL, load)
 
-    video_data = {
-        "id": video.id,
-        "title": video.title,
-        "description": video.description,
-        "duration": video.duration,
-        "file_path": video.file_path,
-        "upload_time": video.upload_time.isoformat(),
-        "updated_time": video.updated_time.isoformat(),
-    }
-    redis_client.set(f"video:{video_id}", json.dumps(video_data), ex=3600)
-    return video_data
-
-# Procura a lista de vídeos, primeiro na cache e depois na base de dados
-def list_videos(db: Session, redis_client: redis.Redis, skip: int = 0, limit: int = 100):
-    cached_videos = redis_client.get("videos_list")
-    if cached_videos:
-        return json.loads(cached_videos)
-
-    videos = db.query(Video).offset(skip).limit(limit).all()
-    videos_data = [
-        {
-            "id": v.id,
-            "title": v.title,
-            "description": v.description,
-            "duration": v.duration,
-            "file_path": v.file_path,
-            "upload_time": v.upload_time.isoformat(),
-            "updated_time": v.updated_time.isoformat(),
-        } for v in videos
-    ]
-    redis_client.set("videos_list", json.dumps(videos_data), ex=3600)
-    return videos_data
-
-# Atualiza os dados de um vídeo existente e limpa os caches
+# Remove o detalhe de vídeos das caches (local e Redis)
+def invalidate_video_cache(redis_client: redis.Redis, *video_ids: int):
+    keys = [f"video:{video_id}" for video_id in video_ids]
+    for key in keys:
+        video_local_cache.invalidate(key)
+    redis_client.delete(*keys)
+
+# Comandos de invalidação depois de uma escrita em lote, enviados num único pipeline: remove o detalhe dos
+# vídeos, invalida a listagem e publica um evento por vídeo
+def queue_batch_invalidation(pipe, video_ids: list, op: str):
+    for video_id in video_ids:
+        video_local_cache.invalidate(f"video:{video_id}")
+    pipe.delete(*[f"video:{video_id}" for video_id in video_ids])
+    pipe.incr(LIST_VERSION_KEY)
+    for video_id in video_ids:
+        pipe.publish(VIDEO_EVENTS_CHANNEL, json.dumps({"op": op, "id": video_id}))
+
+def invalidate_videos(redis_client: redis.Redis, video_ids: list, op: str):
+    pipe = redis_client.pipeline(transaction=False)
+    queue_batch_invalidation(pipe, video_ids, op)
+    pipe.execute()
+
+# Leitura em lote, primeira fase: os vídeos na cache local. Devolve os encontrados, os ids a pedir ao
+# Redis e a geração da cache local lida antes (ver LocalCache.put).
+def batch_from_local(video_ids: list) -> tuple:
+    generation = video_local_cache.generation()
+    found = {}
+    for video_id in video_ids:
+        value = video_local_cache.get(f"video:{video_id}")
+        if value is not None:
+            found[video_id] = value
+    remaining = [video_id for video_id in video_ids if video_id not in found]
+    CACHE_EVENTS.labels("video", "memory", "hit").inc(len(found))
+    CACHE_EVENTS.labels("video", "memory", "miss").inc(len(remaining))
+    return found, remaining, generation
+
+# Segunda fase: as entradas devolvidas pelo MGET que ainda não expiraram. Devolve os ids que faltam.
+def batch_from_redis(remaining: list, raws: list, found: dict, generation: int) -> list:
+    now = time.time()
+    missing = []
+    for video_id, raw in zip(remaining, raws):
+        entry = decode_entry(raw)
+        if entry is None or entry[0] <= now:
+            missing.append(video_id)
+            continue
+        found[video_id] = loads(entry[2])
+        video_local_cache.put(f"video:{video_id}", found[video_id], generation)
+    CACHE_EVENTS.labels("video", "redis", "hit").inc(len(remaining) - len(missing))
+    CACHE_EVENTS.labels("video", "redis", "miss").inc(len(missing))
+    return missing
+
+# Terceira fase: guarda nas caches os vídeos lidos da base de dados com 'engine' (num pipeline) e devolve o
+# resultado pela ordem dos ids pedidos
+def batch_result(pipe, video_ids: list, videos: list, found: dict, generation: int, delta: float, engine) -> dict:
+    for video in videos:
+        value = video_to_dict(video)
+        found[video.id] = value
+        ttl = read_router.cache_ttl(engine, VIDEO_CACHE_TTL, video.id)
+        pipe.set(f"video:{video.id}", encode_entry(dumps(value), ttl, delta), ex=ttl + CACHE_STALE_TTL)
+        video_local_cache.put(f"video:{video.id}", value, generation)
+    return {"items": [found[video_id] for video_id in video_ids if video_id in found],
+            "missing": [video_id for video_id in video_ids if video_id not in found]}
+
+# Procura vários vídeos de uma vez: primeiro na cache local, depois no Redis com um único MGET e por fim
+# na base de dados com uma única query IN. Os vídeos que não existem são devolvidos em 'missing'.
+def get_videos_batch(db: Session, video_ids: list, redis_client: redis.Redis) -> dict:
+    found, remaining, generation = batch_from_local(video_ids)
+    missing = []
+    if remaining:
+        missing = batch_from_redis(remaining, redis_client.mget([f"video:{i}" for i in remaining]), found, generation)
+    videos, delta = [], 0.0
+    if missing:
+        start = time.perf_counter()
+        videos = db.query(Video).filter(Video.id.in_(missing)).all()
+        delta = time.perf_counter() - start
+    pipe = redis_client.pipeline(transaction=False)
+    result = batch_result(pipe, video_ids, videos, found, generation, delta, db.get_bind())
+    if videos:
+        pipe.execute()
+    return result
+
+# Valida os ids de um pedido em lote (inteiros, sem repetidos, pela ordem recebida, no máximo BATCH_MAX_SIZE)
+def batch_ids(values) -> list:
+    try:
+        video_ids = list(dict.fromkeys(int(value) for value in values))
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=422, detail="Os ids têm de ser números inteiros")
+    if not video_ids:
+        raise HTTPException(status_code=422, detail="Nenhum id indicado")
+    if len(video_ids) > BATCH_MAX_SIZE:
+        raise HTTPException(status_code=422, detail=f"No máximo {BATCH_MAX_SIZE} vídeos por pedido")
+    return video_ids
+
+# Carrega os vídeos de uma operação em lote, falhando (sem alterar nada) se algum não existir
+def require_videos(videos: list, video_ids: list) -> list:
+    missing = sorted(set(video_ids) - {video.id for video in videos})
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Vídeos não encontrados: {', '.join(map(str, missing))}")
+    return videos
+
+# Escapa os carateres especiais do LIKE (%, _ e o próprio carácter de escape) num texto procurado literalmente
+def escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+# Chave de cache de uma página da listagem para a versão atual da lista e os parâmetros pedidos
+def list_cache_key(version, limit, cursor, sort, title, min_duration, max_duration) -> str:
+    params = json.dumps([limit, cursor, sort, title, min_duration, max_duration])
+    return f"videos_list:v{version or '0'}:{hashlib.sha1(params.encode()).hexdigest()}"
+
+# Constrói a query de uma página da listagem (partilhada pelas camadas síncrona e assíncrona).
+# A paginação é por keyset: o cursor guarda o valor de ordenação e o id do último vídeo da página
+# anterior, por isso o custo de cada página não cresce com a profundidade (ao contrário de OFFSET).
+# Pede um elemento a mais para saber se existe uma página seguinte.
+def list_statement(limit, cursor, sort, title, min_duration, max_duration):
+    field = sort.lstrip("-")
+    if field not in SORT_FIELDS:
+        raise HTTPException(status_code=400, detail=f"Ordenação inválida: {sort}")
+    descending = sort.startswith("-")
+
+    column = SORT_FIELDS[field]
+    stmt = select(Video)
+    if title:
+        stmt = stmt.where(Video.title.ilike(f"%{escape_like(title)}%", escape="\\"))
+    if min_duration is not None:
+        stmt = stmt.where(Video.duration >= min_duration)
+    if max_duration is not None:
+        stmt = stmt.where(Video.duration <= max_duration)
+    if cursor:
+        value, last_id = decode_cursor(cursor, sort)
+        position = tuple_(column, Video.id)
+        stmt = stmt.where(position < (value, last_id) if descending else position > (value, last_id))
+    if descending:
+        stmt = stmt.order_by(column.desc(), Video.id.desc())
+    else:
+        stmt = stmt.order_by(column.asc(), Video.id.asc())
+    return stmt.limit(limit + 1)
+
+# Serializa uma página da listagem, calculando o cursor da página seguinte
+def build_page(videos: list, limit: int, sort: str) -> str:
+    next_cursor = None
+    if len(videos) > limit:
+        videos = videos[:limit]
+        last = videos[-1]
+        next_cursor = encode_cursor(sort, getattr(last, sort.lstrip("-")), last.id)
+    return dumps({"items": [video_to_dict(v) for v in videos], "next_cursor": next_cursor})
+
+# Procura uma página da lista de vídeos, primeiro na cache e depois na base de dados.
+# Devolve o JSON da página já serializado e o respetivo ETag.
+def list_videos(
+    db: Session,
+    redis_client: redis.Redis,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    sort: str = "-upload_time",
+    title: Optional[str] = None,
+    min_duration: Optional[int] = None,
+    max_duration: Optional[int] = None,
+) -> tuple:
+    stmt = list_statement(limit, cursor, sort, title, min_duration, max_duration)
+    cache_key = list_cache_key(redis_client.get(LIST_VERSION_KEY), limit, cursor, sort, title, min_duration, max_duration)
+    page = get_or_load(redis_client, cache_key, read_router.cache_ttl(db.get_bind(), LIST_CACHE_TTL),
+                       lambda: build_page(db.execute(stmt).scalars().all(), limit, sort), "list")
+    return page, page_etag(page)
+
+# Executa uma pesquisa na base de dados e devolve a lista de (vídeo, relevância) e se foi aproximada.
+# No PostgreSQL usa a coluna search_vector (índice GIN) com correspondência por prefixo em todos os
+# termos, ordenada por ts_rank_cd; sem resultados, recorre à semelhança de trigramas no título.
+# Noutras bases de dados (p.ex. SQLite em testes) faz uma pesquisa simples com ILIKE.
+def query_search(db: Session, q: str, limit: int) -> tuple:
+    terms = re.findall(r"\w+", q.lower())
+    if not terms:
+        return [], False
+
+    if db.get_bind().dialect.name != "postgresql":
+        query = db.query(Video)
+        for term in terms:
+            pattern = f"%{escape_like(term)}%"
+            query = query.filter(or_(Video.title.ilike(pattern, escape="\\"),
+                                     Video.description.ilike(pattern, escape="\\")))
+        return [(v, 1.0) for v in query.order_by(Video.id.desc()).limit(limit).all()], False
+
+    ts_query = func.to_tsquery("simple", " & ".join(f"{term}:*" for term in terms))
+    vector = literal_column("videos.search_vector")
+    rank = func.ts_rank_cd(vector, ts_query)
+    rows = (db.query(Video, rank)
+            .filter(vector.op("@@")(ts_query))
+            .order_by(rank.desc(), Video.id.desc())
+            .limit(limit).all())
+    if rows:
+        return rows, False
+
+    # Limite do operador '%' só para esta transação (como SET LOCAL): não fica na ligação quando volta ao pool
+    db.execute(select(func.set_config("pg_trgm.similarity_threshold", str(SEARCH_FUZZY_THRESHOLD), True)))
+    similarity = func.similarity(Video.title, q)
+    rows = (db.query(Video, similarity)
+            .filter(Video.title.op("%")(q))
+            .order_by(similarity.desc(), Video.id.desc())
+            .limit(limit).all())
+    return rows, True
+
+# Pesquisa vídeos por título/descrição, primeiro na cache e depois na base de dados.
+# Devolve o JSON dos resultados já serializado e o respetivo ETag.
+def search_videos(db: Session, redis_client: redis.Redis, q: str, limit: int = 20) -> tuple:
+    normalized = " ".join(q.lower().split())
+    version = redis_client.get(LIST_VERSION_KEY) or "0"
+    digest = hashlib.sha1(f"{normalized}|{limit}".encode()).hexdigest()
+    cache_key = f"search:v{version}:{digest}"
+
+    def load() -> str:
+        rows, fuzzy = query_search(db, normalized, limit)
+        items = [{**video_to_dict(video), "rank": round(float(rank), 4)} for video, rank in rows]
+        return dumps({"query": q, "fuzzy": fuzzy, "items": items})
+
+    result = get_or_load(redis_client, cache_key, read_router.cache_ttl(db.get_bind(), SEARCH_CACHE_TTL), load,
+                         "search")
+    return result, page_etag(result)
+
+# ETag forte de uma página, calculado a partir do seu conteúdo serializado
+def page_etag(page: str) -> str:
+    return f'"{hashlib.sha1(page.encode()).hexdigest()}"'
+
+# Atualiza os dados de um vídeo existente e limpa os caches.
+# Um novo ficheiro (upload_path, ainda temporário) vai para o armazenamento por conteúdo e o ficheiro
+# anterior só é apagado depois do commit e se nenhum outro vídeo o referenciar. Se a transação falhar,
+# o blob criado para o novo ficheiro é desfeito; o temporário fica com quem o recebeu.
 def update_video(
     db: Session,
     video_id: int,
@@ -82,7 +421,8 @@ def update_video(
     description: str,
     duration: int,
     redis_client: redis.Redis,
-    new_file_path: str = None
+    upload_path: str = None,
+    content_hash: str = None
 ):
     video = db.query(Video).filter(Video.id == video_id).first()
     if not video:
@@ -91,35 +431,117 @@ def update_video(
     video.description = description
     video.duration = duration
 
-    if new_file_path:
-        video.file_path = new_file_path
-    
+    released, stored = [], []
     try:
+        if upload_path:
+            old_path, old_key = video.file_path, blob_key(video)
+            _, ext = os.path.splitext(upload_path.removesuffix(".part"))
+            video.file_path = store_blob(db, upload_path, content_hash, ext)
+            stored = [(video.file_path, content_hash)]
+            video.content_hash = content_hash
+            if video.file_path != old_path:
+                video.abr_status = video.preview_status = "pending"
+                released = release_blob(db, old_path, old_key)
         db.commit()
-        redis_client.delete(f"video:{video_id}")
-        redis_client.delete("videos_list")
+        remove_released_blobs(db, released)
+        invalidate_video_cache(redis_client, video_id)
+        invalidate_list_cache(redis_client)
+        publish_video_event(redis_client, "update", video_id)
     except Exception as e:
         db.rollback()
+        remove_released_blobs(db, stored)
         raise
 
     db.refresh(video)
     return video
 
-# Apaga um vídeo da base de dados e do sistema de ficheiros
+# Apaga um vídeo da base de dados e o seu ficheiro, se mais nenhum vídeo o referenciar
 def delete_video(db: Session, video_id: int, redis_client: redis.Redis):
     video = db.query(Video).filter(Video.id == video_id).first()
     if not video:
         raise HTTPException(status_code=404, detail="Vídeo não encontrado")
 
-    redis_client.delete(f"video:{video_id}")
-    redis_client.delete("videos_list")
-
-    if video.file_path and os.path.exists(video.file_path):
-        try:
-            os.remove(video.file_path)
-        except OSError as e:
-            print(f"Erro ao apagar ficheiro de vídeo {video.file_path}: {e}")
-
     db.delete(video)
+    released = release_blob(db, video.file_path, blob_key(video))
     db.commit()
+    remove_released_blobs(db, released)
+    invalidate_video_cache(redis_client, video_id)
+    invalidate_list_cache(redis_client)
+    publish_video_event(redis_client, "delete", video_id)
     return {"detail": "Vídeo Apagado"}
+
+# Atualiza os dados de vários vídeos numa só transação (updates: {id: (título, descrição, duração)}).
+# Se algum vídeo não existir nenhum é alterado. As caches são invalidadas num único pipeline.
+def update_videos(db: Session, updates: dict, redis_client: redis.Redis) -> list:
+    video_ids = list(updates)
+    videos = require_videos(db.query(Video).filter(Video.id.in_(video_ids)).all(), video_ids)
+    for video in videos:
+        video.title, video.description, video.duration = updates[video.id]
+    try:
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    invalidate_videos(redis_client, video_ids, "update")
+    videos = {video.id: video for video in videos}
+    return [video_to_dict(videos[video_id]) for video_id in video_ids]
+
+# Apaga vários vídeos numa só transação. Cada ficheiro é apagado uma única vez (vários vídeos podem ter o
+# mesmo conteúdo) e só se mais nenhum vídeo o referenciar. As caches são invalidadas num único pipeline.
+def delete_videos(db: Session, video_ids: list, redis_client: redis.Redis) -> dict:
+    videos = require_videos(db.query(Video).filter(Video.id.in_(video_ids)).all(), video_ids)
+    blobs = {video.file_path: blob_key(video) for video in videos}
+    for video in videos:
+        db.delete(video)
+    released = []
+    try:
+        # Ordem fixa dos locks dos ficheiros, para que dois lotes concorrentes não fiquem bloqueados um no outro
+        for file_path, key in sorted(blobs.items(), key=lambda blob: blob[1]):
+            released += release_blob(db, file_path, key)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    remove_released_blobs(db, released)
+    invalidate_videos(redis_client, video_ids, "delete")
+    return {"detail": f"{len(video_ids)} vídeos apagados", "ids": video_ids}
+
+# Atualiza o estado de um processamento (abr_status ou preview_status) de todos os vídeos com um dado
+# conteúdo e limpa os caches
+def set_content_status(db: Session, content_hash: str, column: str, status: str, redis_client: redis.Redis):
+    videos = db.query(Video).filter(Video.content_hash == content_hash).all()
+    for video in videos:
+        setattr(video, column, status)
+    db.commit()
+    if not videos:
+        return
+    invalidate_videos(redis_client, [video.id for video in videos], "update")
+
+# Substitui o ficheiro de todos os vídeos que referenciam 'file_path' por um conteúdo derivado (p.ex. o remux
+# faststart), guardado por conteúdo com o seu próprio hash: o blob original nunca é alterado no lugar e só é
+# apagado depois do commit, se mais nenhum vídeo o referenciar. O temporário fica com quem o criou.
+# Devolve o novo caminho, ou None se nenhum vídeo referenciar já o ficheiro.
+def replace_video_file(db: Session, file_path: str, key: str, temp_path: str, content_hash: str, ext: str,
+                       redis_client: redis.Redis) -> Optional[str]:
+    stored = []
+    try:
+        # Ordem fixa dos locks dos dois conteúdos, como em delete_videos
+        for blob in sorted({key, content_hash}):
+            lock_blob(db, blob)
+        videos = db.query(Video).filter(Video.file_path == file_path).all()
+        if not videos:
+            db.rollback()
+            return None
+        new_path = store_blob(db, temp_path, content_hash, ext)
+        stored = [(new_path, content_hash)]
+        for video in videos:
+            video.file_path, video.content_hash = new_path, content_hash
+        released = release_blob(db, file_path, key)
+        db.commit()
+    except Exception:
+        db.rollback()
+        remove_released_blobs(db, stored)
+        raise
+    remove_released_blobs(db, released)
+    invalidate_videos(redis_client, [video.id for video in videos], "update")
+    return new_path
@@ -0,0 +1,155 @@
+# Comando offline de deduplicação e limpeza da biblioteca de vídeos (armazenamento por conteúdo).
+# 1. hash: calcula o content_hash dos vídeos que ainda não o têm (vídeos anteriores à deduplicação)
+# 2. dedup: para cada conteúdo, aponta todos os vídeos para um único blob e apaga as cópias repetidas
+# 3. gc: apaga ficheiros, qualidades HLS/DASH e pré-visualizações que nenhum vídeo referencia e
+#    uploads/transcodificações abandonados
+#
+# Exemplo (dentro do container do catalog_service; --dry-run apenas reporta o que seria feito):
+#   python dedup.py --dry-run
+#   python dedup.py --min-age 3600 --temp-age 86400
+
+# Imports Gerais
+import os
+import json
+import time
+import shutil
+import argparse
+from collections import defaultdict
+
+# Imports dos Ficheiros
+from blobs import (BASE_UPLOAD_DIR, TEMP_UPLOAD_DIR, BLOB_DIR, ABR_DIR, PREVIEW_DIR, KEYFRAME_INDEX_SUFFIX, blob_path,
+                   blob_refcount, file_sha256, keyframe_index_path, lock_blob)
+from model import Video, SessionLocal, init_db
+
+
+# Calcula o hash dos vídeos sem content_hash. Devolve {id: hash} (gravado na BD fora do dry-run).
+def hash_missing(db, dry_run: bool, report: dict) -> dict:
+    hashes = {}
+    for video_id, file_path in db.query(Video.id, Video.file_path).filter(Video.content_hash.is_(None)).all():
+        if not os.path.exists(file_path):
+            report["missing_files"].append(file_path)
+            continue
+        hashes[video_id] = file_sha256(file_path)
+        if not dry_run:
+            db.query(Video).filter(Video.id == video_id).update({"content_hash": hashes[video_id]})
+            db.commit()
+    report["hashed"] = len(hashes)
+    return hashes
+
+# Junta os vídeos com o mesmo conteúdo num único blob. O blob é criado com um hard link (O(1), sem
+# copiar bytes); as cópias antigas só são apagadas depois de nenhum vídeo as referenciar.
+def dedup(db, hashes: dict, dry_run: bool, report: dict):
+    groups = defaultdict(set)
+    for video_id, file_path, content_hash in db.query(Video.id, Video.file_path, Video.content_hash).all():
+        content_hash = content_hash or hashes.get(video_id)
+        if content_hash and os.path.exists(file_path):
+            groups[content_hash].add(file_path)
+
+    for content_hash, paths in groups.items():
+        _, ext = os.path.splitext(sorted(paths)[0])
+        canonical = next((p for p in paths if p.startswith(BLOB_DIR + os.sep)), blob_path(content_hash, ext))
+        stale = paths - {canonical}
+        if not stale:
+            continue
+        # Sem blob, a primeira cópia passa a sê-lo (o espaço dela não é recuperado)
+        source = None if os.path.exists(canonical) else sorted(stale)[0]
+        report["merged"] += len(stale)
+        report["bytes_reclaimed"] += sum(os.path.getsize(p) for p in stale if p != source)
+        if dry_run:
+            continue
+
+        lock_blob(db, content_hash)
+        if source is not None:
+            os.makedirs(os.path.dirname(canonical), exist_ok=True)
+            os.link(source, canonical)
+            if os.path.exists(keyframe_index_path(source)):
+                os.link(keyframe_index_path(source), keyframe_index_path(canonical))
+        db.query(Video).filter(Video.file_path.in_(stale)).update(
+            {"file_path": canonical, "content_hash": content_hash}, synchronize_session=False)
+        db.commit()
+        for path in stale:
+            if blob_refcount(db, path) == 0:
+                os.remove(path)
+
+# Apaga os ficheiros de vídeo sem referências (com mais de min_age segundos, para não apanhar uploads
+# que ainda estão a ser registados ou remuxados), os índices de keyframes desses ficheiros e os uploads
+# temporários com mais de temp_age segundos
+def gc(db, dry_run: bool, min_age: float, temp_age: float, report: dict):
+    now = time.time()
+    candidates = [os.path.join(BASE_UPLOAD_DIR, name) for name in os.listdir(BASE_UPLOAD_DIR)]
+    for root, _, files in os.walk(BLOB_DIR):
+        candidates += [os.path.join(root, name) for name in files]
+    temp_files = [os.path.join(TEMP_UPLOAD_DIR, name) for name in os.listdir(TEMP_UPLOAD_DIR)]
+
+    for path in temp_files:
+        if os.path.isfile(path) and now - os.path.getmtime(path) > temp_age:
+            report["temp_removed"] += 1
+            report["bytes_reclaimed"] += os.path.getsize(path)
+            if not dry_run:
+                os.remove(path)
+
+    for path in candidates:
+        if not os.path.isfile(path) or now - os.path.getmtime(path) < min_age:
+            continue
+        # Índices de keyframes: só são apagados quando o ficheiro de vídeo já não existe
+        if path.endswith(KEYFRAME_INDEX_SUFFIX):
+            if not os.path.exists(path.removesuffix(KEYFRAME_INDEX_SUFFIX)):
+                report["orphans_removed"] += 1
+                if not dry_run:
+                    os.remove(path)
+            continue
+        if path.startswith(BLOB_DIR + os.sep):
+            lock_blob(db, os.path.basename(path).split(".")[0])
+        else:
+            lock_blob(db, path)
+        if blob_refcount(db, path) == 0:
+            report["orphans_removed"] += 1
+            report["bytes_reclaimed"] += os.path.getsize(path)
+            if not dry_run:
+                os.remove(path)
+        db.commit()
+
+    # Qualidades transcodificadas e pré-visualizações de conteúdos sem vídeos e diretórios de
+    # transcodificações/pré-visualizações interrompidas
+    for base_dir, counter in ((ABR_DIR, "renditions_removed"), (PREVIEW_DIR, "previews_removed")):
+        for name in os.listdir(base_dir):
+            path = os.path.join(base_dir, name)
+            content_hash, _, tmp = name.partition(".tmp-")
+            if now - os.path.getmtime(path) < (temp_age if tmp else min_age):
+                continue
+            if not tmp:
+                lock_blob(db, content_hash)
+                referenced = db.query(Video.id).filter(Video.content_hash == content_hash).first() is not None
+                db.commit()
+                if referenced:
+                    continue
+            report[counter] += 1
+            if not dry_run:
+                shutil.rmtree(path, ignore_errors=True)
+
+def main(args):
+    init_db()
+    os.makedirs(TEMP_UPLOAD_DIR, exist_ok=True)
+    os.makedirs(BLOB_DIR, exist_ok=True)
+    os.makedirs(ABR_DIR, exist_ok=True)
+    os.makedirs(PREVIEW_DIR, exist_ok=True)
+    report = {"dry_run": args.dry_run, "hashed": 0, "merged": 0, "orphans_removed": 0, "temp_removed": 0,
+              "renditions_removed": 0, "previews_removed": 0, "bytes_reclaimed": 0, "missing_files": []}
+    db = SessionLocal()
+    try:
+        hashes = hash_missing(db, args.dry_run, report)
+        dedup(db, hashes, args.dry_run, report)
+        if not args.skip_gc:
+            gc(db, args.dry_run, args.min_age, args.temp_age, report)
+    finally:
+        db.close()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Deduplicação e limpeza dos ficheiros de vídeo")
+    parser.add_argument("--dry-run", action="store_true", help="Apenas reporta, não altera nada")
+    parser.add_argument("--skip-gc", action="store_true", help="Não apaga ficheiros sem referências")
+    parser.add_argument("--min-age", type=float, default=3600, help="Idade mínima (s) de um ficheiro órfão a apagar")
+    parser.add_argument("--temp-age", type=float, default=86400, help="Idade mínima (s) de um upload temporário a apagar")
+    main(parser.parse_args())
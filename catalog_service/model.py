@@ -1,10 +1,21 @@
 # Imports Gerais
 import os
+import math
+import logging
+import threading
+import time
 from datetime import datetime
+from itertools import count
 
 # Imports Extras
-from sqlalchemy import Column, Integer, String, DateTime, create_engine
+from sqlalchemy import Column, Integer, String, DateTime, Index, create_engine, text
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from sqlalchemy.schema import CreateIndex
+
+# Imports dos Ficheiros
+from metrics import DB_POOL_WAIT, log_event
 
 # Configuração da Base de Dados
 Base = declarative_base()
@@ -14,26 +25,245 @@ DB_HOST = os.getenv("DB_HOST", "postgres")
 DB_PORT = os.getenv("DB_PORT", "5432")
 DB_NAME = os.getenv("DB_NAME", "catalogdb")
 
+# Réplicas de leitura (hot standby). Podem ser dadas por host (DB_REPLICA_HOSTS, mesmas credenciais
+# do primário) ou por URL completo (DB_REPLICA_URLS, p.ex. bases SQLite locais em testes).
+# - DB_REPLICA_MAX_LAG: atraso máximo de replicação (s) para uma réplica receber leituras
+# - DB_REPLICA_CHECK_INTERVAL: intervalo (s) entre verificações de saúde e atraso das réplicas
+# - DB_READ_YOUR_WRITES_WINDOW: durante este tempo (s) após uma escrita as leituras do cliente que a fez vão ao
+#   primário (ver controller.read_your_writes)
+DB_REPLICA_HOSTS = [h.strip() for h in os.getenv("DB_REPLICA_HOSTS", "").split(",") if h.strip()]
+DB_REPLICA_URLS = [u.strip() for u in os.getenv("DB_REPLICA_URLS", "").split(",") if u.strip()]
+DB_REPLICA_MAX_LAG = float(os.getenv("DB_REPLICA_MAX_LAG", "5"))
+DB_REPLICA_CHECK_INTERVAL = float(os.getenv("DB_REPLICA_CHECK_INTERVAL", "10"))
+DB_READ_YOUR_WRITES_WINDOW = float(os.getenv("DB_READ_YOUR_WRITES_WINDOW", "5"))
+
+# Camada assíncrona opcional (asyncpg): as rotas principais passam a usar sessões assíncronas e deixam
+# de ocupar uma thread da threadpool durante todo o pedido
+DB_ASYNC = os.getenv("DB_ASYNC", "false").lower() in ("1", "true", "yes")
+
+# Pools de ligações que medem o tempo de espera por uma ligação (checkout), por pool (host da base de dados)
+class TimedQueuePool(QueuePool):
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            DB_POOL_WAIT.labels(getattr(self, "metrics_label", "default")).observe(time.perf_counter() - start)
+
+class TimedAsyncQueuePool(AsyncAdaptedQueuePool):
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            DB_POOL_WAIT.labels(getattr(self, "metrics_label", "default")).observe(time.perf_counter() - start)
+
 # Configuração do Engine do SQLAlchemy com um pool de conexões robusto:
 # - pool_pre_ping: Verifica se a conexão está ativa antes de cada uso
 # - pool_recycle: Recicla ligações a cada 30 minutos para evitar timeouts
 # - connect_args: Argumentos de keepalive TCP para manter as conexões estáveis
-DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
-engine = create_engine(
-    DATABASE_URL,
-    pool_size=10,
-    max_overflow=20,
-    pool_pre_ping=True,
-    pool_recycle=1800,
-    connect_args={
-        "keepalives": 1,
-        "keepalives_idle": 30,
-        "keepalives_interval": 10,
-        "keepalives_count": 5,
-    }
-)
+def database_url(host: str) -> str:
+    return f"postgresql+psycopg2://{DB_USER}:{DB_PASSWORD}@{host}:{DB_PORT}/{DB_NAME}"
+
+DATABASE_URL = os.getenv("DATABASE_URL", database_url(DB_HOST))
+
+def make_engine(url: str):
+    if not url.startswith("postgresql"):
+        return create_engine(url, pool_pre_ping=True)
+    sync_engine = create_engine(
+        url,
+        poolclass=TimedQueuePool,
+        pool_size=10,
+        max_overflow=20,
+        pool_pre_ping=True,
+        pool_recycle=1800,
+        connect_args={
+            "connect_timeout": 5,
+            "keepalives": 1,
+            "keepalives_idle": 30,
+            "keepalives_interval": 10,
+            "keepalives_count": 5,
+        }
+    )
+    sync_engine.pool.metrics_label = sync_engine.url.host
+    return sync_engine
+
+# Engine assíncrono equivalente a um engine síncrono (asyncpg para PostgreSQL, aiosqlite para SQLite)
+def make_async_engine(sync_engine):
+    url = sync_engine.url
+    if url.get_backend_name() == "postgresql":
+        async_engine = create_async_engine(
+            url.set(drivername="postgresql+asyncpg"),
+            poolclass=TimedAsyncQueuePool,
+            pool_size=10,
+            max_overflow=20,
+            pool_pre_ping=True,
+            pool_recycle=1800,
+            connect_args={"timeout": 5},
+        )
+        async_engine.sync_engine.pool.metrics_label = f"{url.host}-async"
+        return async_engine
+    return create_async_engine(url.set(drivername=f"{url.get_backend_name()}+aiosqlite"), pool_pre_ping=True)
+
+engine = make_engine(DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine, expire_on_commit=False)
 
+
+# Pool de ligações de uma réplica de leitura e o seu último estado conhecido
+class ReplicaPool:
+    def __init__(self, name: str, engine):
+        self.name = name
+        self.engine = engine
+        self.healthy = False
+        self.lag = None
+        self.checked_at = 0.0
+        self.reads = 0
+
+    # Verifica se a réplica responde e mede o atraso de replicação (0 se já aplicou todo o WAL recebido)
+    def check(self):
+        try:
+            with self.engine.connect() as conn:
+                if self.engine.dialect.name == "postgresql":
+                    self.lag = float(conn.execute(text(
+                        "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+                        "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+                    )).scalar())
+                else:
+                    conn.execute(text("SELECT 1"))
+                    self.lag = 0.0
+            self.healthy = True
+        except Exception as e:
+            if self.healthy:
+                log_event("replica_unavailable", logging.WARNING, replica=self.name, error=str(e))
+            self.healthy = False
+            self.lag = None
+        self.checked_at = time.time()
+
+
+# Encaminha as leituras para as réplicas e as escritas para o primário.
+# Uma réplica só recebe leituras se estiver saudável e com atraso abaixo de DB_REPLICA_MAX_LAG;
+# caso contrário (ou sem réplicas configuradas) as leituras vão para o primário.
+# As leituras que têm de ver as últimas escritas (read-your-writes) são pedidas com primary=True.
+# As escritas recentes (ver note_write) são conhecidas localmente, sem consultar o Redis em cada leitura:
+# fazem ler do primário o detalhe do vídeo escrito e encurtam o TTL em cache dos valores lidos das réplicas
+# logo a seguir (ver cache_ttl), sem afastar das réplicas as restantes leituras.
+class ReadRouter:
+    def __init__(self, primary, replicas: list):
+        self.primary = primary
+        self.replicas = replicas
+        self.primary_reads = 0
+        self.last_write = 0.0
+        self.last_unknown_write = 0.0
+        self.video_writes = {}
+        self._next = count()
+        self._stop = threading.Event()
+        self._thread = None
+        self.async_engines = {}
+
+    # Cria os engines assíncronos do primário e das réplicas (camada DB_ASYNC)
+    def enable_async(self):
+        for sync_engine in [self.primary] + [r.engine for r in self.replicas]:
+            self.async_engines[sync_engine] = make_async_engine(sync_engine)
+
+    # Regista uma escrita num vídeo (ou num vídeo desconhecido, com video_id=None), recebida pelos eventos de
+    # alteração de vídeos publicados por todos os processos. Só são guardadas as dos últimos
+    # DB_REPLICA_MAX_LAG segundos, o atraso máximo das réplicas que recebem leituras.
+    def note_write(self, video_id: int = None):
+        now = time.time()
+        self.last_write = now
+        if video_id is None:
+            self.last_unknown_write = now
+        else:
+            self.video_writes.pop(video_id, None)
+            self.video_writes[video_id] = now
+        while self.video_writes:
+            oldest = next(iter(self.video_writes))
+            if now - self.video_writes[oldest] < DB_REPLICA_MAX_LAG:
+                break
+            del self.video_writes[oldest]
+
+    # Verifica se uma réplica pode ainda não ter uma escrita recente: no vídeo indicado ou, com video_id=None,
+    # em qualquer vídeo
+    def written_recently(self, video_id: int = None) -> bool:
+        if video_id is None:
+            written_at = self.last_write
+        else:
+            written_at = max(self.video_writes.get(video_id, 0.0), self.last_unknown_write)
+        return time.time() - written_at < DB_REPLICA_MAX_LAG
+
+    # TTL da cache para um valor lido com 'engine' (síncrono ou assíncrono). Um valor lido de uma réplica
+    # pouco depois de uma escrita (no vídeo indicado ou, com video_id=None, em qualquer vídeo), que ela pode
+    # ainda não ter aplicado, fica em cache só DB_REPLICA_MAX_LAG segundos em vez de 'ttl'.
+    def cache_ttl(self, engine, ttl: int, video_id: int = None) -> int:
+        if getattr(engine, "sync_engine", engine) is self.primary or not self.written_recently(video_id):
+            return ttl
+        return min(ttl, math.ceil(DB_REPLICA_MAX_LAG))
+
+    # Escolhe o engine para uma leitura (o primário com primary=True)
+    def choose(self, primary: bool = False):
+        if self.replicas and not primary:
+            candidates = [r for r in self.replicas
+                          if r.healthy and r.lag is not None and r.lag <= DB_REPLICA_MAX_LAG]
+            if candidates:
+                replica = candidates[next(self._next) % len(candidates)]
+                replica.reads += 1
+                return replica.engine
+        self.primary_reads += 1
+        return self.primary
+
+    # Escolhe o engine assíncrono para uma leitura, com as mesmas regras de choose()
+    def choose_async(self, primary: bool = False):
+        return self.async_engines[self.choose(primary)]
+
+    # Inicia a verificação periódica das réplicas numa thread em background
+    def start(self):
+        if not self.replicas or self._thread is not None:
+            return
+        for replica in self.replicas:
+            replica.check()
+
+        def loop():
+            while not self._stop.wait(DB_REPLICA_CHECK_INTERVAL):
+                for replica in self.replicas:
+                    replica.check()
+
+        self._thread = threading.Thread(target=loop, name="replica-health", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    # Métricas de ligações de cada pool (primário e réplicas)
+    def stats(self) -> dict:
+        def pool_stats(engine):
+            pool = engine.pool
+            stats = {"status": pool.status()}
+            for name in ("size", "checkedin", "checkedout", "overflow"):
+                if hasattr(pool, name):
+                    stats[name] = getattr(pool, name)()
+            return stats
+
+        return {
+            "primary": {**pool_stats(self.primary), "reads": self.primary_reads},
+            "replicas": [
+                {"name": r.name, "healthy": r.healthy, "lag": r.lag, "reads": r.reads,
+                 "checked_at": r.checked_at, **pool_stats(r.engine)}
+                for r in self.replicas
+            ],
+        }
+
+read_router = ReadRouter(engine, [
+    ReplicaPool(host, make_engine(database_url(host))) for host in DB_REPLICA_HOSTS
+] + [
+    ReplicaPool(url.rsplit("@", 1)[-1], make_engine(url)) for url in DB_REPLICA_URLS
+])
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False)
+
+# Sessões assíncronas, ligadas ao engine escolhido pelo read_router em cada pedido
+AsyncSessionLocal = async_sessionmaker(autoflush=False, expire_on_commit=False)
+if DB_ASYNC:
+    read_router.enable_async()
+
 # Definição  do modelo da tabela 'videos' para o SQLAlchemy
 class Video(Base):
     __tablename__ = "videos"
@@ -41,10 +271,53 @@ class Video(Base):
     title = Column(String, nullable=False)
     description = Column(String, nullable=True)
     duration = Column(Integer, nullable=False)
-    file_path = Column(String, nullable=False, unique=True)
+    # Vários vídeos podem partilhar o mesmo ficheiro (armazenamento por conteúdo, ver blobs.py)
+    file_path = Column(String, nullable=False, index=True)
+    content_hash = Column(String(64), nullable=True, index=True)
+    # Estado das qualidades HLS/DASH: pending, processing, ready ou failed (None em vídeos antigos)
+    abr_status = Column(String(16), nullable=True)
+    # Estado da miniatura e da sprite de pré-visualização (mesmos valores que abr_status)
+    preview_status = Column(String(16), nullable=True)
     upload_time = Column(DateTime, default=datetime.utcnow)
     updated_time = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
-# Inicialização das Tabelas na BD nos modelos definidos
+    # Índices compostos (campo de ordenação, id) usados pela paginação por keyset da listagem
+    __table_args__ = (
+        Index("ix_videos_upload_time_id", "upload_time", "id"),
+        Index("ix_videos_updated_time_id", "updated_time", "id"),
+        Index("ix_videos_title_id", "title", "id"),
+        Index("ix_videos_duration_id", "duration", "id"),
+    )
+
+# Alterações específicas do PostgreSQL, aplicadas de forma idempotente no arranque:
+# - search_vector: coluna tsvector gerada a partir do título (peso A) e da descrição (peso B),
+#   indexada com GIN para a pesquisa de texto integral
+# - índice de trigramas no título para a pesquisa aproximada (pg_trgm)
+# - content_hash e remoção da unicidade de file_path (deduplicação por conteúdo)
+# - abr_status (estado da transcodificação para HLS/DASH) e preview_status (miniaturas)
+POSTGRES_MIGRATIONS = [
+    "ALTER TABLE videos ADD COLUMN IF NOT EXISTS content_hash varchar(64)",
+    "ALTER TABLE videos DROP CONSTRAINT IF EXISTS videos_file_path_key",
+    "ALTER TABLE videos ADD COLUMN IF NOT EXISTS abr_status varchar(16)",
+    "ALTER TABLE videos ADD COLUMN IF NOT EXISTS preview_status varchar(16)",
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    """ALTER TABLE videos ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('simple', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(description, '')), 'B')) STORED""",
+    "CREATE INDEX IF NOT EXISTS ix_videos_search_vector ON videos USING GIN (search_vector)",
+    "CREATE INDEX IF NOT EXISTS ix_videos_title_trgm ON videos USING GIN (title gin_trgm_ops)",
+]
+
+# Inicialização das Tabelas na BD nos modelos definidos.
+# As alterações do PostgreSQL são aplicadas primeiro, porque alguns índices usam colunas novas.
+# Os índices são criados à parte para também serem adicionados a tabelas que já existiam.
+# O advisory lock evita que várias réplicas do serviço apliquem as alterações em simultâneo.
 def init_db():
-    Base.metadata.create_all(bind=engine)
\ No newline at end of file
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        if engine.dialect.name == "postgresql":
+            conn.execute(text("SELECT pg_advisory_xact_lock(7263001)"))
+            for statement in POSTGRES_MIGRATIONS:
+                conn.execute(text(statement))
+        for index in Video.__table__.indexes:
+            conn.execute(CreateIndex(index, if_not_exists=True))
\ No newline at end of file
@@ -0,0 +1,264 @@
+# Imports Gerais
+import os
+import time
+import uuid
+import base64
+import hashlib
+from typing import Optional
+from dataclasses import dataclass
+
+# Imports Extra
+import anyio
+import redis.asyncio as aioredis
+from fastapi import HTTPException, Request
+
+# Imports dos Ficheiros
+from uploads import MAX_UPLOAD_BYTES, UPLOAD_CHUNK_SIZE
+
+# Uploads retomáveis em blocos (ao estilo do tus): o cliente cria uma sessão com o tamanho do ficheiro,
+# envia blocos de RESUMABLE_CHUNK_SIZE com PATCH em qualquer ordem (vários em paralelo), consulta com HEAD
+# ou GET o que já foi recebido para retomar depois de uma falha e, no fim, finaliza a sessão.
+# - Todos os blocos são escritos (pwrite) no mesmo ficheiro .part em TEMP_UPLOAD_DIR, criado com o tamanho
+#   final, por isso a finalização não copia nem junta ficheiros.
+# - O estado da sessão (hash upload:<id>) e os blocos recebidos (set upload:<id>:chunks) ficam no Redis,
+#   partilhados por todas as réplicas da API; expiram ao fim de RESUMABLE_SESSION_TTL sem atividade
+#   (os ficheiros abandonados são apagados pelo dedup.py --temp-age).
+# - Um bloco só é marcado como recebido depois de estar completo e sincronizado com o disco; um bloco
+#   interrompido a meio é simplesmente enviado de novo.
+# - Cada PATCH regista-se na sessão (campo writer:<token> do hash, com o prazo do bloco) antes de abrir o
+#   ficheiro, e a finalização só acontece sem escritas em curso: as duas verificações correm em scripts Lua
+#   sobre a mesma chave, por isso nenhum bloco é escrito depois de o ficheiro ser entregue ao registo.
+#   Um PATCH que passe de RESUMABLE_CHUNK_TIMEOUT segundos é interrompido; o seu registo expira ao fim do
+#   dobro desse tempo (margem para relógios diferentes entre réplicas), para que um processo que caiu a
+#   meio de um bloco não impeça a finalização.
+RESUMABLE_CHUNK_SIZE = int(os.getenv("RESUMABLE_CHUNK_SIZE", str(8 * 1024 * 1024)))
+RESUMABLE_SESSION_TTL = int(os.getenv("RESUMABLE_SESSION_TTL", "86400"))
+RESUMABLE_CHUNK_TIMEOUT = int(os.getenv("RESUMABLE_CHUNK_TIMEOUT", "600"))
+SESSION_PREFIX = "upload:"
+# Tipo do corpo dos pedidos PATCH (o mesmo do tus)
+CHUNK_CONTENT_TYPE = "application/offset+octet-stream"
+WRITER_PREFIX = "writer:"
+
+# Regista uma escrita na sessão: 1, ou 0 se a sessão já não existir (finalizada, cancelada ou expirada)
+BEGIN_WRITE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then return 0 end
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+return 1
+"""
+# Termina uma escrita e, se o bloco ficou completo (ARGV[2] não vazio), marca-o como recebido. Devolve 0 se
+# o registo da escrita já não existir (sessão terminada ou prazo ultrapassado): o bloco não conta.
+END_WRITE_SCRIPT = """
+if redis.call('HDEL', KEYS[1], ARGV[1]) == 0 then return 0 end
+if ARGV[2] ~= '' then
+    redis.call('SADD', KEYS[2], ARGV[2])
+    redis.call('EXPIRE', KEYS[2], ARGV[3])
+end
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return 1
+"""
+# Finaliza a sessão (apaga o estado) se não houver escritas em curso e todos os blocos tiverem chegado.
+# Devolve 1, 0 sem sessão, -1 com escritas em curso ou -2 com blocos em falta. Os registos de escritas
+# com o prazo ultrapassado (ARGV[1]) são descartados.
+FINALIZE_SCRIPT = """
+local fields = redis.call('HGETALL', KEYS[1])
+if #fields == 0 then return 0 end
+local writing = 0
+for i = 1, #fields, 2 do
+    if string.sub(fields[i], 1, string.len(ARGV[3])) == ARGV[3] then
+        if tonumber(fields[i + 1]) > tonumber(ARGV[1]) then
+            writing = writing + 1
+        else
+            redis.call('HDEL', KEYS[1], fields[i])
+        end
+    end
+end
+if writing > 0 then return -1 end
+if redis.call('SCARD', KEYS[2]) < tonumber(ARGV[2]) then return -2 end
+redis.call('DEL', KEYS[1], KEYS[2])
+return 1
+"""
+
+
+# Sessão de um upload retomável, tal como guardada no Redis
+@dataclass
+class UploadSession:
+    id: str
+    path: str
+    filename: str
+    length: int
+    chunk_size: int
+    title: str
+    description: str
+    duration: Optional[int]
+
+    @property
+    def num_chunks(self) -> int:
+        return -(-self.length // self.chunk_size)
+
+    # Tamanho do bloco 'index' (o último pode ser mais pequeno)
+    def chunk_length(self, index: int) -> int:
+        return min(self.chunk_size, self.length - index * self.chunk_size)
+
+def session_key(upload_id: str) -> str:
+    return f"{SESSION_PREFIX}{upload_id}"
+
+def chunks_key(upload_id: str) -> str:
+    return f"{SESSION_PREFIX}{upload_id}:chunks"
+
+# Cria uma sessão e o ficheiro .part com o tamanho final (esparso: o espaço só é ocupado ao escrever os blocos)
+async def create_session(redis_client: aioredis.Redis, upload_dir: str, filename: str, length,
+                         title: str, description: str, duration: Optional[int]) -> UploadSession:
+    try:
+        length = int(length)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=422, detail="O tamanho do ficheiro tem de ser um número inteiro")
+    if length <= 0:
+        raise HTTPException(status_code=422, detail="O ficheiro está vazio")
+    if MAX_UPLOAD_BYTES and length > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"O ficheiro excede o tamanho máximo de {MAX_UPLOAD_BYTES} bytes")
+    filename = os.path.basename(filename or "")
+    if not filename:
+        raise HTTPException(status_code=422, detail="O nome do ficheiro é obrigatório")
+
+    upload_id = uuid.uuid4().hex
+    _, ext = os.path.splitext(filename)
+    session = UploadSession(
+        id=upload_id, path=os.path.join(upload_dir, f"{upload_id}{ext}.part"), filename=filename, length=length,
+        chunk_size=RESUMABLE_CHUNK_SIZE, title=title, description=description or "", duration=duration)
+
+    def allocate():
+        with open(session.path, "wb") as f:
+            f.truncate(length)
+    await anyio.to_thread.run_sync(allocate)
+
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.hset(session_key(upload_id), mapping={
+        "path": session.path, "filename": filename, "length": length, "chunk_size": session.chunk_size,
+        "title": title, "description": session.description, "duration": "" if duration is None else duration})
+    pipe.expire(session_key(upload_id), RESUMABLE_SESSION_TTL)
+    await pipe.execute()
+    return session
+
+# Lê uma sessão do Redis (404 se não existir, já tiver sido finalizada ou tiver expirado)
+async def load_session(redis_client: aioredis.Redis, upload_id: str) -> UploadSession:
+    data = await redis_client.hgetall(session_key(upload_id))
+    if not data:
+        raise HTTPException(status_code=404, detail="Sessão de upload não encontrada")
+    return UploadSession(
+        id=upload_id, path=data["path"], filename=data["filename"], length=int(data["length"]),
+        chunk_size=int(data["chunk_size"]), title=data["title"], description=data["description"],
+        duration=int(data["duration"]) if data["duration"] else None)
+
+# Blocos já recebidos, o offset contínuo (bytes recebidos desde o início, sem falhas) e os blocos em falta
+async def upload_state(redis_client: aioredis.Redis, session: UploadSession) -> dict:
+    received = {int(index) for index in await redis_client.smembers(chunks_key(session.id))}
+    missing = [index for index in range(session.num_chunks) if index not in received]
+    offset = session.length if not missing else missing[0] * session.chunk_size
+    return {"upload_id": session.id, "offset": offset, "length": session.length,
+            "chunk_size": session.chunk_size, "received": len(received), "missing": missing}
+
+# Verifica o cabeçalho opcional Upload-Checksum ("sha256 <base64>") de um bloco
+def verify_checksum(header: str, digest: bytes):
+    if not header:
+        return
+    algorithm, _, value = header.partition(" ")
+    if algorithm.lower() != "sha256":
+        raise HTTPException(status_code=400, detail=f"Algoritmo de checksum não suportado: {algorithm}")
+    try:
+        expected = base64.b64decode(value, validate=True)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Upload-Checksum inválido")
+    if expected != digest:
+        raise HTTPException(status_code=460, detail="O checksum do bloco não corresponde aos dados recebidos")
+
+# Recebe um bloco (PATCH com Upload-Offset) e escreve-o na sua posição do ficheiro, em partes de
+# UPLOAD_CHUNK_SIZE escritas numa thread, com a escrita registada na sessão enquanto dura (ver FINALIZE_SCRIPT).
+# Devolve o estado da sessão depois de o bloco ser registado.
+async def receive_chunk(redis_client: aioredis.Redis, session: UploadSession, request: Request) -> dict:
+    if request.headers.get("content-type", "").split(";")[0].strip() != CHUNK_CONTENT_TYPE:
+        raise HTTPException(status_code=415, detail=f"O corpo do bloco tem de ser {CHUNK_CONTENT_TYPE}")
+    try:
+        offset = int(request.headers["upload-offset"])
+    except (KeyError, ValueError):
+        raise HTTPException(status_code=400, detail="O cabeçalho Upload-Offset é obrigatório")
+    index, remainder = divmod(offset, session.chunk_size)
+    if offset < 0 or remainder or index >= session.num_chunks:
+        raise HTTPException(status_code=409, detail=f"Upload-Offset tem de ser múltiplo de {session.chunk_size} "
+                                                    f"e menor do que {session.length}")
+    expected = session.chunk_length(index)
+    declared = request.headers.get("content-length")
+    if declared is not None and declared.isdigit() and int(declared) != expected:
+        raise HTTPException(status_code=400, detail=f"O bloco {index} tem de ter {expected} bytes")
+
+    writer = f"{WRITER_PREFIX}{uuid.uuid4().hex}"
+    begin_write = redis_client.register_script(BEGIN_WRITE_SCRIPT)
+    lease = time.time() + 2 * RESUMABLE_CHUNK_TIMEOUT
+    if not await begin_write(keys=[session_key(session.id)], args=[writer, lease]):
+        raise HTTPException(status_code=404, detail="Sessão de upload não encontrada")
+    completed = None
+    try:
+        await write_chunk(session, request, offset, expected, index)
+        completed = index
+    finally:
+        end_write = redis_client.register_script(END_WRITE_SCRIPT)
+        recorded = await end_write(keys=[session_key(session.id), chunks_key(session.id)],
+                                   args=[writer, "" if completed is None else completed, RESUMABLE_SESSION_TTL])
+    if not recorded:
+        raise HTTPException(status_code=409, detail=f"A sessão terminou durante o envio do bloco {index}")
+    return await upload_state(redis_client, session)
+
+# Escreve o corpo de um bloco na sua posição do ficheiro e sincroniza-o com o disco; falha (sem marcar o
+# bloco) se estiver incompleto, não corresponder ao Upload-Checksum ou passar de RESUMABLE_CHUNK_TIMEOUT
+async def write_chunk(session: UploadSession, request: Request, offset: int, expected: int, index: int):
+    deadline = time.monotonic() + RESUMABLE_CHUNK_TIMEOUT
+    fd = await anyio.to_thread.run_sync(os.open, session.path, os.O_WRONLY)
+    digest = hashlib.sha256()
+    received, buffer = 0, bytearray()
+
+    def write(data: bytes, position: int):
+        if time.monotonic() > deadline:
+            raise HTTPException(status_code=408, detail=f"O bloco {index} não chegou em {RESUMABLE_CHUNK_TIMEOUT} s")
+        digest.update(data)
+        os.pwrite(fd, data, position)
+
+    try:
+        async for data in request.stream():
+            received += len(data)
+            if received > expected:
+                raise HTTPException(status_code=413, detail=f"O bloco {index} tem de ter {expected} bytes")
+            buffer += data
+            if len(buffer) >= UPLOAD_CHUNK_SIZE:
+                part, buffer = bytes(buffer), bytearray()
+                await anyio.to_thread.run_sync(write, part, offset + received - len(part))
+        if buffer:
+            await anyio.to_thread.run_sync(write, bytes(buffer), offset + received - len(buffer))
+        if received != expected:
+            raise HTTPException(status_code=400, detail=f"Bloco incompleto: {received} de {expected} bytes")
+        verify_checksum(request.headers.get("upload-checksum"), digest.digest())
+        await anyio.to_thread.run_sync(os.fdatasync, fd)
+    finally:
+        await anyio.to_thread.run_sync(os.close, fd)
+
+# Termina uma sessão com todos os blocos recebidos e sem blocos a ser escritos. Só um pedido a consegue
+# finalizar (o que remove a sessão do Redis, no mesmo script que verifica as escritas em curso); o ficheiro
+# fica pronto a ser registado por process_video_upload e nenhum PATCH volta a escrever nele.
+async def finalize_session(redis_client: aioredis.Redis, session: UploadSession) -> UploadSession:
+    finalize = redis_client.register_script(FINALIZE_SCRIPT)
+    result = await finalize(keys=[session_key(session.id), chunks_key(session.id)],
+                            args=[time.time(), session.num_chunks, WRITER_PREFIX])
+    if result == 0:
+        raise HTTPException(status_code=404, detail="Sessão de upload não encontrada")
+    if result == -1:
+        raise HTTPException(status_code=409, detail="Há blocos a ser enviados; finalize depois de terminarem")
+    if result == -2:
+        state = await upload_state(redis_client, session)
+        raise HTTPException(status_code=409, detail=f"Faltam {len(state['missing'])} de {session.num_chunks} blocos")
+    return session
+
+# Cancela uma sessão, apagando o estado e o ficheiro parcial
+async def abort_session(redis_client: aioredis.Redis, session: UploadSession):
+    await redis_client.delete(session_key(session.id), chunks_key(session.id))
+    try:
+        await anyio.to_thread.run_sync(os.remove, session.path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,63 @@
+# Imports Gerais
+import os
+import json
+import logging
+
+# Imports Extra
+import redis
+import redis.asyncio as aioredis
+
+# Imports dos Ficheiros
+from metrics import log_event
+
+# Eventos das tarefas do pipeline de upload, publicados pelos workers num canal Redis por pipeline
+# (task_events:<id da primeira tarefa>). O último evento fica também guardado numa chave com o mesmo
+# nome, para que um cliente que se liga depois de uma etapa terminar receba logo o estado atual.
+TASK_EVENTS_PREFIX = "task_events:"
+TASK_EVENTS_TTL = int(os.getenv("TASK_EVENTS_TTL", "86400"))
+# Intervalo (s) entre comentários keep-alive do SSE, para os proxies não fecharem ligações inativas
+SSE_KEEPALIVE_SECONDS = float(os.getenv("SSE_KEEPALIVE_SECONDS", "15"))
+
+
+# Publica um evento de uma tarefa do pipeline e guarda-o como o último estado conhecido
+def publish_task_event(redis_client: redis.Redis, pipeline_id: str, event: dict):
+    channel = f"{TASK_EVENTS_PREFIX}{pipeline_id}"
+    payload = json.dumps(event, default=str)
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.set(channel, payload, ex=TASK_EVENTS_TTL)
+        pipe.publish(channel, payload)
+        pipe.execute()
+    except redis.exceptions.RedisError as e:
+        log_event("task_event_publish_failed", logging.WARNING, task_id=event.get("task_id"), error=str(e))
+
+# Formata uma mensagem SSE
+def sse_message(payload: str) -> str:
+    return f"data: {payload}\n\n"
+
+# Stream SSE dos eventos de um pipeline: envia o último estado conhecido e depois cada evento novo,
+# terminando no evento final (SUCCESS da última etapa ou FAILURE de qualquer etapa).
+# A subscrição é feita antes de ler o último estado, para não perder eventos publicados entretanto.
+async def task_event_stream(aredis_client: aioredis.Redis, pipeline_id: str):
+    channel = f"{TASK_EVENTS_PREFIX}{pipeline_id}"
+    pubsub = aredis_client.pubsub()
+    await pubsub.subscribe(channel)
+    try:
+        last = await aredis_client.get(channel)
+        if last is None:
+            yield sse_message(json.dumps({"task_id": pipeline_id, "state": "PENDING", "final": False}))
+        else:
+            yield sse_message(last)
+            if json.loads(last).get("final"):
+                return
+        while True:
+            message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=SSE_KEEPALIVE_SECONDS)
+            if message is None:
+                yield ": keep-alive\n\n"
+                continue
+            yield sse_message(message["data"])
+            if json.loads(message["data"]).get("final"):
+                return
+    finally:
+        await pubsub.unsubscribe(channel)
+        await pubsub.aclose()
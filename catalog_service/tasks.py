@@ -1,18 +1,30 @@
 # Imports Gerais
 import os
-import shutil
+import time
 import uuid
+import shutil
+import logging
 import warnings
 import subprocess
+from typing import Optional
 
 # Imports Extra
 import redis
-from celery import Celery
+from celery import Celery, chain
+from celery.signals import (task_prerun, task_postrun, task_success, task_failure, worker_init,
+                            worker_process_init, worker_process_shutdown)
 from sqlalchemy.orm import Session
 
 # Imports dos Ficheiros
-from controller import create_video as create_video_in_db
-from model import SessionLocal
+from blobs import (BASE_UPLOAD_DIR, TEMP_UPLOAD_DIR, BLOB_DIR, ABR_DIR, PREVIEW_DIR, abr_dir, preview_dir,
+                   store_blob, remove_released_blobs, remove_temp_files, file_sha256, keyframe_index_path)
+from controller import (create_video as create_video_in_db, create_videos, video_to_dict, set_content_status,
+                        replace_video_file)
+from metrics import CELERY_TASK_DURATION, instrument_redis, log_event, start_worker_metrics_server
+from model import SessionLocal, Video, engine
+from task_events import publish_task_event
+from transcode import (transcode, probe, probe_duration, is_faststart, remux_faststart, keyframe_index, write_keyframe_index,
+                       render_previews, HLS_MASTER, DASH_MANIFEST, SPRITE_NAME)
 
 # Remove avisos do worker Celery sobre os privilégios de superuser
 try:
@@ -28,6 +40,9 @@ except ImportError:
         message="You're running the worker with superuser privileges"
     )
 
+# Porta do Redis (cache, eventos das tarefas)
+REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
+
 # Configuração do Celery
 BROKER_URL = os.getenv("CELERY_BROKER_URL", "redis://redis:6379/0")
 RESULT_BACKEND_URL = os.getenv("CELERY_RESULT_BACKEND_URL", BROKER_URL)
@@ -38,56 +53,342 @@ app_celery = Celery(
     broker=BROKER_URL,
     result_backend=RESULT_BACKEND_URL)
 
+# Filas por tipo de trabalho, cada uma servida por workers dimensionados para ela:
+# - CATALOG_QUEUE: etapas curtas limitadas por I/O (registo na base de dados, mover ficheiros), muitas em paralelo
+# - MEDIA_QUEUE: etapas limitadas por CPU e de duração moderada (remux faststart, miniaturas e sprites)
+# - TRANSCODE_QUEUE: transcodificação, longa, para que não atrase o registo de uploads nem as miniaturas
+CATALOG_QUEUE = os.getenv("CATALOG_QUEUE", "catalog_queue")
+MEDIA_QUEUE = os.getenv("MEDIA_QUEUE", "media_queue")
+TRANSCODE_QUEUE = os.getenv("TRANSCODE_QUEUE", "transcode_queue")
+
+# Prioridades das tarefas dentro de cada fila. No broker Redis, 0 é a prioridade mais alta e cada
+# prioridade é uma lista própria (<fila>:<prioridade>, a 0 é a própria fila); os workers consomem as
+# de maior prioridade primeiro. Os uploads feitos por utilizadores passam à frente das importações em massa.
+PRIORITY_STEPS = list(range(10))
+PRIORITY_SEP = ":"
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 6
+# Tempo máximo de uma transcodificação (s); o visibility timeout do broker tem de ser maior,
+# senão o Redis volta a entregar tarefas longas (acks_late) a outro worker
+TRANSCODE_TIME_LIMIT = int(os.getenv("TRANSCODE_TIME_LIMIT", str(3 * 3600)))
+
+# Nome de cada etapa do pipeline de upload nos eventos publicados para o SSE
+TASK_STAGES = {
+    "tasks.process_video_upload": "register",
+    "tasks.register_videos_batch": "register",
+    "tasks.faststart_video": "faststart",
+    "tasks.generate_previews": "previews",
+    "tasks.transcode_video": "transcode",
+}
+
+# Cliente Redis partilhado por todas as tarefas de um processo do worker (caches, eventos das tarefas),
+# com o seu pool de ligações; é criado de novo em cada processo filho (worker_process_init)
+_task_redis = None
+
+# Porta do servidor de métricas Prometheus do worker (vazio desativa). Com o pool prefork, as métricas dos
+# processos filhos são juntadas através de PROMETHEUS_MULTIPROC_DIR (um diretório vazio por worker).
+CELERY_METRICS_PORT = os.getenv("CELERY_METRICS_PORT")
+# Início de cada tarefa em execução neste processo (task_id -> perf_counter), para a duração
+_task_started = {}
+
 # Diretórios de Upload
-BASE_UPLOAD_DIR = os.getenv("UPLOAD_DIR", "/app/videos")
-TEMP_UPLOAD_DIR = os.path.join(BASE_UPLOAD_DIR, "temp")
 os.makedirs(BASE_UPLOAD_DIR, exist_ok=True)
 os.makedirs(TEMP_UPLOAD_DIR, exist_ok=True)
+os.makedirs(BLOB_DIR, exist_ok=True)
+os.makedirs(ABR_DIR, exist_ok=True)
+os.makedirs(PREVIEW_DIR, exist_ok=True)
+
+# Cliente Redis do processo atual (criado na primeira utilização)
+def task_redis() -> redis.Redis:
+    global _task_redis
+    if _task_redis is None:
+        _task_redis = instrument_redis(
+            redis.Redis(host=os.getenv("REDIS_HOST", "redis"), port=REDIS_PORT, db=0, decode_responses=True))
+    return _task_redis
+
+# Chaves das listas de uma fila no broker Redis, uma por prioridade (para medir o tamanho da fila)
+def broker_queue_keys(queue: str) -> list:
+    return [queue] + [f"{queue}{PRIORITY_SEP}{priority}" for priority in PRIORITY_STEPS if priority]
+
+# Etapas do pipeline de upload depois do registo (remux faststart, pré-visualizações e transcodificação),
+# com a fila de cada etapa e a prioridade indicada. Sem 'video', recebe o resultado da etapa anterior.
+def media_stages(priority: int, video: dict = None):
+    faststart = faststart_video.s(video) if video is not None else faststart_video.s()
+    return chain(
+        faststart.set(queue=MEDIA_QUEUE, priority=priority),
+        generate_previews.s().set(queue=MEDIA_QUEUE, priority=priority),
+        transcode_video.s().set(queue=TRANSCODE_QUEUE, priority=priority))
+
+# Publica um evento da tarefa atual no canal do pipeline a que pertence (identificado pela primeira tarefa)
+def task_event(task, state: str, final: bool = False, **info):
+    request = task.request
+    publish_task_event(task_redis(), request.root_id or request.id, {
+        "task_id": request.id, "stage": TASK_STAGES.get(task.name, task.name), "state": state, "final": final, **info})
+
+# Inicia o servidor de métricas do worker
+@worker_init.connect
+def on_worker_init(**kwargs):
+    if CELERY_METRICS_PORT:
+        start_worker_metrics_server(int(CELERY_METRICS_PORT))
+
+# Recursos de cada processo filho (pool prefork): as ligações à base de dados herdadas do processo pai
+# são descartadas sem as fechar (continuam a ser do pai) e o cliente Redis é criado de novo, por isso as
+# tarefas de um processo reutilizam as mesmas ligações em vez de abrirem uma nova em cada tarefa
+@worker_process_init.connect
+def on_worker_process_init(**kwargs):
+    global _task_redis
+    engine.dispose(close=False)
+    _task_redis = None
+    task_redis()
+
+# Marca um processo filho terminado, para as suas gauges deixarem de ser juntadas (modo multiprocess)
+@worker_process_shutdown.connect
+def on_worker_process_shutdown(pid=None, **kwargs):
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(pid or os.getpid())
 
-# Tarefa em background que move o vídeo para a localizção final e o regista na base de dados
+# Início de cada etapa
+@task_prerun.connect
+def on_task_started(sender=None, task_id=None, **kwargs):
+    _task_started[task_id] = time.perf_counter()
+    task_event(sender, "STARTED", progress=0.0)
+
+# Duração de cada tarefa, pelo estado final (SUCCESS, FAILURE, RETRY, ...)
+@task_postrun.connect
+def on_task_finished(sender=None, task_id=None, state=None, **kwargs):
+    started = _task_started.pop(task_id, None)
+    if started is not None:
+        elapsed = time.perf_counter() - started
+        CELERY_TASK_DURATION.labels(sender.name, state or "UNKNOWN").observe(elapsed)
+        log_event("task_finished", task=sender.name, task_id=task_id, state=state, seconds=round(elapsed, 3))
+
+# Fim de uma etapa; o evento é final quando não há mais etapas na chain
+@task_success.connect
+def on_task_success(sender=None, result=None, **kwargs):
+    task_event(sender, "SUCCESS", final=not sender.request.chain, progress=1.0, result=result)
+
+# Falha de uma etapa (as etapas seguintes da chain já não correm)
+@task_failure.connect
+def on_task_failure(sender=None, exception=None, **kwargs):
+    task_event(sender, "FAILURE", final=True, error=str(exception))
+
+# Duração de um upload enviado sem duração; 0 se o ffprobe não a conseguir ler (o vídeo é registado na mesma)
+def detect_duration(path: str) -> int:
+    try:
+        return probe_duration(path)
+    except (OSError, ValueError, KeyError, subprocess.SubprocessError) as e:
+        log_event("duration_probe_failed", logging.WARNING, path=path, error=str(e))
+        return 0
+
+# Tarefa em background que coloca o vídeo no armazenamento por conteúdo e o regista na base de dados.
+# Um conteúdo repetido reutiliza o ficheiro já existente; um conteúdo novo entra com um hard link, porque
+# TEMP_UPLOAD_DIR está dentro de BASE_UPLOAD_DIR (sem copiar bytes). O temporário só é apagado depois do
+# commit; se o registo falhar, o blob criado para ele é desfeito.
 @app_celery.task
-def process_video_upload(title: str, description: str, duration: int, temp_file_path: str, original_filename: str):
+def process_video_upload(title: str, description: str, duration: Optional[int], temp_file_path: str, original_filename: str,
+                         content_hash: str = None):
     db: Session = SessionLocal()
-    redis_client = redis.Redis(host=os.getenv("REDIS_HOST", "redis"), port=6379, db=0, decode_responses=True)
-    video_id = str(uuid.uuid4())
     _, ext = os.path.splitext(original_filename)
-    unique_filename = f"{video_id}{ext}"
-    final_file_path = os.path.join(BASE_UPLOAD_DIR, unique_filename)
-    
-    try:
-        shutil.move(temp_file_path, final_file_path)
+    file_path = None
 
+    try:
+        # Uploads enfileirados antes de o hash ser calculado no pipeline de upload
+        if not content_hash:
+            content_hash = file_sha256(temp_file_path)
+        if duration is None:
+            duration = detect_duration(temp_file_path)
+        file_path = store_blob(db, temp_file_path, content_hash, ext)
         video = create_video_in_db(
             db, title=title, description=description, duration=duration, 
-            file_path=final_file_path,
-            redis_client=redis_client
+            file_path=file_path,
+            redis_client=task_redis(),
+            content_hash=content_hash
         )
-        video_data = {
-            "id": video.id,
-            "title": video.title,
-            "description": video.description,
-            "duration": video.duration,
-            "file_path": video.file_path,
-            "upload_time": video.upload_time.isoformat(),
-            "updated_time": video.updated_time.isoformat()
-        }
-        return video_data
+        remove_temp_files([temp_file_path])
+        return video_to_dict(video)
     except Exception as e:
-        print(f"Erro ao processar o vídeo {original_filename}: {e}")
+        db.rollback()
+        if file_path:
+            remove_released_blobs(db, [(file_path, content_hash)])
+        log_event("upload_failed", logging.ERROR, filename=original_filename, error=str(e))
         if os.path.exists(temp_file_path):
             try:
                 os.remove(temp_file_path)
             except Exception as e_remove:
-                print(f"Erro ao remover ficheiro temporário {temp_file_path} após falha: {e_remove}")
+                log_event("temp_file_remove_failed", logging.ERROR, path=temp_file_path, error=str(e_remove))
+        raise
+    finally:
+        db.close()
+
+# Tarefa em background que regista vários vídeos numa só transação, com uma única invalidação das caches
+# (importações em massa). items: [{"title", "description", "duration" (opcional), "temp_file_path",
+# "original_filename", "content_hash" (opcional)}]. Cada ficheiro entra no armazenamento por conteúdo como em process_video_upload;
+# um item cujo ficheiro não pode ser lido é ignorado e devolvido em 'failed', sem impedir o registo dos
+# restantes. Os temporários só são apagados depois do commit; se o lote falhar, os blobs criados para ele
+# são desfeitos e os temporários ficam, para o lote poder ser repetido. Com stages=True enfileira as etapas seguintes de cada vídeo, com a prioridade indicada.
+@app_celery.task
+def register_videos_batch(items: list, stages: bool = True, priority: int = PRIORITY_BULK) -> dict:
+    prepared, failed = [], []
+    for item in items:
+        try:
+            content_hash = item.get("content_hash") or file_sha256(item["temp_file_path"])
+            duration = item["duration"] if item.get("duration") is not None else detect_duration(item["temp_file_path"])
+            prepared.append({**item, "content_hash": content_hash, "duration": duration})
+        except (OSError, KeyError) as e:
+            failed.append({"file": item.get("temp_file_path"), "error": str(e)})
+
+    db: Session = SessionLocal()
+    rows = []
+    try:
+        # Ordem fixa dos locks do armazenamento por conteúdo, para que dois lotes não fiquem bloqueados um no outro
+        for item in sorted(prepared, key=lambda item: item["content_hash"]):
+            _, ext = os.path.splitext(item["original_filename"])
+            rows.append({
+                "title": item["title"], "description": item.get("description"), "duration": item["duration"],
+                "file_path": store_blob(db, item["temp_file_path"], item["content_hash"], ext),
+                "content_hash": item["content_hash"]})
+        videos = [video_to_dict(video) for video in create_videos(db, rows, task_redis())]
+    except Exception as e:
+        db.rollback()
+        remove_released_blobs(db, [(row["file_path"], row["content_hash"]) for row in rows])
+        log_event("batch_register_failed", logging.ERROR, items=len(items), error=str(e))
+        raise
+    finally:
+        db.close()
+    remove_temp_files(item["temp_file_path"] for item in prepared)
+
+    if stages:
+        for video in videos:
+            media_stages(priority, video).apply_async()
+    log_event("batch_registered", videos=len(videos), failed=len(failed))
+    return {"videos": videos, "failed": failed}
+
+# Tarefa em background que prepara o ficheiro original para reprodução progressiva (etapa do pipeline de upload
+# entre o registo e a transcodificação):
+# - remuxa (sem recodificar) os MP4/MOV com o 'moov' no fim, para que o browser não tenha de pedir o fim do
+#   ficheiro antes de começar; o resultado é guardado como um blob novo, com o seu próprio content_hash, e os
+#   vídeos passam a referenciá-lo (o blob original nunca é alterado no lugar e continua a corresponder ao seu
+#   hash, também quando partilhado por hard link com a origem de uma importação)
+# - gera o índice de keyframes (tempo -> offset) usado pelo streaming_service no seek por tempo (/stream/{id}/keyframe)
+# Devolve o vídeo com o ficheiro e o hash atuais, para as etapas seguintes.
+# Uma falha não interrompe o pipeline: o vídeo continua a poder ser reproduzido tal como foi enviado.
+@app_celery.task
+def faststart_video(video: dict):
+    db: Session = SessionLocal()
+    tmp_path = None
+    try:
+        # O ficheiro pode ter mudado desde que a tarefa foi enfileirada (outro remux do mesmo conteúdo)
+        current = db.get(Video, video["id"])
+        if current is not None:
+            video = {**video, "file_path": current.file_path, "content_hash": current.content_hash}
+        file_path = video["file_path"]
+        if is_faststart(file_path) is False:
+            ext = os.path.splitext(file_path)[1]
+            tmp_path = os.path.join(TEMP_UPLOAD_DIR, f"faststart-{uuid.uuid4()}{ext}")
+            os.makedirs(TEMP_UPLOAD_DIR, exist_ok=True)
+            remux_faststart(file_path, tmp_path)
+            content_hash = file_sha256(tmp_path)
+            new_path = replace_video_file(db, file_path, video["content_hash"] or file_path, tmp_path, content_hash,
+                                          ext, task_redis())
+            if new_path is not None:
+                video = {**video, "file_path": new_path, "content_hash": content_hash}
+                file_path = new_path
+        index_path = keyframe_index_path(file_path)
+        if not os.path.exists(index_path) or os.path.getmtime(index_path) < os.path.getmtime(file_path):
+            write_keyframe_index(index_path, keyframe_index(file_path))
+    except Exception as e:
+        log_event("faststart_failed", logging.ERROR, video_id=video["id"], error=str(e))
+    finally:
+        db.close()
+        if tmp_path:
+            remove_temp_files([tmp_path])
+    return video
+
+# Tarefa em background que gera a miniatura e a sprite de pré-visualização de um vídeo (etapa do pipeline
+# de upload antes da transcodificação), para que as listagens não tenham de pedir o stream de cada vídeo.
+# São guardadas por conteúdo em previews/<hash>/ (um conteúdo repetido reutiliza as existentes).
+# Uma falha não interrompe o pipeline.
+@app_celery.task(bind=True)
+def generate_previews(self, video: dict):
+    db: Session = SessionLocal()
+    redis_client = task_redis()
+    content_hash = video["content_hash"]
+    target_dir = preview_dir(content_hash)
+    work_dir = f"{target_dir}.tmp-{uuid.uuid4()}"
+
+    def report(progress: float):
+        task_event(self, "PROGRESS", video_id=video["id"], progress=round(progress, 3))
+
+    try:
+        if not os.path.exists(os.path.join(target_dir, SPRITE_NAME)):
+            set_content_status(db, content_hash, "preview_status", "processing", redis_client)
+            render_previews(video["file_path"], work_dir, probe(video["file_path"])["duration"] or video["duration"],
+                            on_progress=report)
+            try:
+                os.rename(work_dir, target_dir)
+            except OSError:
+                shutil.rmtree(work_dir, ignore_errors=True)
+        set_content_status(db, content_hash, "preview_status", "ready", redis_client)
+    except Exception as e:
+        log_event("previews_failed", logging.ERROR, video_id=video["id"], error=str(e))
+        shutil.rmtree(work_dir, ignore_errors=True)
+        set_content_status(db, content_hash, "preview_status", "failed", redis_client)
+    finally:
+        db.close()
+    return video
+
+# Tarefa em background que gera as qualidades HLS/DASH de um vídeo (última etapa do pipeline de upload).
+# As qualidades são guardadas por conteúdo em abr/<hash>/, por isso um conteúdo repetido não é transcodificado
+# de novo. O progresso é reportado no estado PROGRESS da tarefa e nos eventos do pipeline (SSE).
+@app_celery.task(bind=True, time_limit=TRANSCODE_TIME_LIMIT)
+def transcode_video(self, video: dict):
+    db: Session = SessionLocal()
+    redis_client = task_redis()
+    content_hash = video["content_hash"]
+    target_dir = abr_dir(content_hash)
+    work_dir = f"{target_dir}.tmp-{uuid.uuid4()}"
+
+    def report(progress: float):
+        self.update_state(state="PROGRESS", meta={"video_id": video["id"], "stage": "transcode",
+                                                  "progress": round(progress, 3)})
+        task_event(self, "PROGRESS", video_id=video["id"], progress=round(progress, 3))
+
+    try:
+        if not os.path.exists(os.path.join(target_dir, DASH_MANIFEST)):
+            set_content_status(db, content_hash, "abr_status", "processing", redis_client)
+            transcode(video["file_path"], work_dir, on_progress=report)
+            # O rename do diretório completo é atómico; se outro worker já terminou o mesmo conteúdo, descarta este
+            try:
+                os.rename(work_dir, target_dir)
+            except OSError:
+                shutil.rmtree(work_dir, ignore_errors=True)
+        set_content_status(db, content_hash, "abr_status", "ready", redis_client)
+        return {"video_id": video["id"], "content_hash": content_hash, "abr_status": "ready",
+                "hls": HLS_MASTER, "dash": DASH_MANIFEST}
+    except Exception as e:
+        log_event("transcode_failed", logging.ERROR, video_id=video["id"], error=str(e))
+        shutil.rmtree(work_dir, ignore_errors=True)
+        set_content_status(db, content_hash, "abr_status", "failed", redis_client)
         raise
     finally:
         db.close()
-        if redis_client:
-            redis_client.close()
 
 # Configuração das Rotas de Tarefas Celery
 app_celery.conf.update(
     task_routes={
-        'tasks.process_video_upload': {'queue': 'catalog_queue'}},
+        'tasks.process_video_upload': {'queue': CATALOG_QUEUE},
+        'tasks.register_videos_batch': {'queue': CATALOG_QUEUE},
+        'tasks.faststart_video': {'queue': MEDIA_QUEUE},
+        'tasks.generate_previews': {'queue': MEDIA_QUEUE},
+        'tasks.transcode_video': {'queue': TRANSCODE_QUEUE}},
+    task_default_priority=PRIORITY_INTERACTIVE,
+    broker_transport_options={
+        "visibility_timeout": TRANSCODE_TIME_LIMIT + 600,
+        "priority_steps": PRIORITY_STEPS,
+        "sep": PRIORITY_SEP,
+        "queue_order_strategy": "priority"},
+    # Cada processo só reserva a tarefa que vai executar, para que as prioridades sejam respeitadas e
+    # uma tarefa longa não prenda outras já reservadas
     worker_prefetch_multiplier=1,
     task_acks_late=True,)
\ No newline at end of file
@@ -0,0 +1,210 @@
+# Imports Gerais
+import os
+import json
+import time
+import shutil
+import struct
+import tempfile
+import subprocess
+
+# Binários do ffmpeg (instalados na imagem do catalog_service)
+FFMPEG_BIN = os.getenv("FFMPEG_BIN", "ffmpeg")
+FFPROBE_BIN = os.getenv("FFPROBE_BIN", "ffprobe")
+
+# Escada de qualidades (altura:kbps de vídeo). Só são usadas as alturas até à do vídeo original.
+ABR_LADDER = [
+    tuple(int(v) for v in rung.split(":"))
+    for rung in os.getenv("ABR_LADDER", "1080:5000,720:2800,480:1400,360:800,240:400").split(",")
+]
+ABR_AUDIO_BITRATE = os.getenv("ABR_AUDIO_BITRATE", "128k")
+# Duração de cada segmento (s); os keyframes são forçados nestes limites em todas as qualidades
+ABR_SEGMENT_SECONDS = int(os.getenv("ABR_SEGMENT_SECONDS", "4"))
+ABR_PRESET = os.getenv("ABR_PRESET", "veryfast")
+
+# Pré-visualizações: miniatura (poster) e sprite com COLUNASxLINHAS imagens espaçadas ao longo do vídeo,
+# usada na pré-visualização ao passar o rato (a grelha tem de ser igual à do ui_service)
+POSTER_NAME = "poster.jpg"
+SPRITE_NAME = "sprite.jpg"
+POSTER_WIDTH = int(os.getenv("POSTER_WIDTH", "640"))
+SPRITE_TILE_WIDTH = int(os.getenv("SPRITE_TILE_WIDTH", "160"))
+SPRITE_COLUMNS, SPRITE_ROWS = (int(v) for v in os.getenv("PREVIEW_SPRITE_GRID", "5x5").split("x"))
+
+# Nomes dos manifestos gerados (o muxer DASH do ffmpeg gera também as playlists HLS com -hls_playlist)
+DASH_MANIFEST = "manifest.mpd"
+HLS_MASTER = "master.m3u8"
+
+
+# Lê a duração, a altura e a existência de áudio de um vídeo com o ffprobe
+def probe(path: str) -> dict:
+    out = subprocess.run(
+        [FFPROBE_BIN, "-v", "error", "-print_format", "json", "-show_format", "-show_streams", path],
+        capture_output=True, check=True, timeout=60).stdout
+    info = json.loads(out)
+    video = next((s for s in info["streams"] if s["codec_type"] == "video"), None)
+    if video is None:
+        raise ValueError("O ficheiro não tem nenhuma faixa de vídeo")
+    return {
+        "duration": float(info["format"].get("duration") or 0),
+        "height": int(video["height"]),
+        "has_audio": any(s["codec_type"] == "audio" for s in info["streams"]),
+    }
+
+# Duração de um vídeo em segundos inteiros, lida com o ffprobe (falha se o ficheiro não for um vídeo)
+def probe_duration(path: str) -> int:
+    return round(probe(path)["duration"])
+
+# Qualidades a gerar para um vídeo com a altura dada (pelo menos uma, sem aumentar a resolução)
+def ladder_for(height: int) -> list:
+    rungs = [(h, kbps) for h, kbps in ABR_LADDER if h <= height]
+    if not rungs:
+        _, kbps = min(ABR_LADDER)
+        rungs = [(height - height % 2, kbps)]
+    return rungs
+
+# Comando ffmpeg que gera, numa única passagem de descodificação, todas as qualidades em segmentos
+# fMP4 partilhados pelos manifestos DASH (manifest.mpd) e HLS (master.m3u8 + media_N.m3u8)
+def ffmpeg_command(src: str, out_dir: str, info: dict) -> list:
+    rungs = ladder_for(info["height"])
+    split = f"[0:v]split={len(rungs)}" + "".join(f"[v{i}]" for i in range(len(rungs)))
+    scales = [f"[v{i}]scale=-2:{h}[v{i}out]" for i, (h, _) in enumerate(rungs)]
+    cmd = [
+        FFMPEG_BIN, "-y", "-hide_banner", "-loglevel", "error", "-nostats", "-progress", "pipe:1",
+        "-i", src,
+        "-filter_complex", ";".join([split] + scales),
+    ]
+    for i, (_, kbps) in enumerate(rungs):
+        cmd += [
+            "-map", f"[v{i}out]",
+            f"-c:v:{i}", "libx264", f"-b:v:{i}", f"{kbps}k",
+            f"-maxrate:v:{i}", f"{int(kbps * 1.07)}k", f"-bufsize:v:{i}", f"{kbps * 2}k",
+        ]
+    adaptation_sets = "id=0,streams=v"
+    if info["has_audio"]:
+        cmd += ["-map", "0:a:0", "-c:a", "aac", "-b:a", ABR_AUDIO_BITRATE, "-ac", "2"]
+        adaptation_sets += " id=1,streams=a"
+    cmd += [
+        "-preset", ABR_PRESET, "-pix_fmt", "yuv420p", "-sc_threshold", "0",
+        "-force_key_frames", f"expr:gte(t,n_forced*{ABR_SEGMENT_SECONDS})",
+        "-f", "dash", "-seg_duration", str(ABR_SEGMENT_SECONDS),
+        "-use_template", "1", "-use_timeline", "1",
+        "-adaptation_sets", adaptation_sets,
+        "-init_seg_name", "init-$RepresentationID$.m4s",
+        "-media_seg_name", "chunk-$RepresentationID$-$Number%05d$.m4s",
+        "-hls_playlist", "1",
+        os.path.join(out_dir, DASH_MANIFEST),
+    ]
+    return cmd
+
+# Transcodifica um vídeo para 'out_dir', chamando on_progress(fração entre 0 e 1) no máximo uma vez
+# por segundo, a partir do progresso reportado pelo ffmpeg
+def transcode(src: str, out_dir: str, on_progress=None, info: dict = None) -> dict:
+    info = info or probe(src)
+    os.makedirs(out_dir, exist_ok=True)
+    duration_us = info["duration"] * 1_000_000
+    last_report = 0.0
+    with tempfile.TemporaryFile() as stderr:
+        process = subprocess.Popen(
+            ffmpeg_command(src, out_dir, info), stdout=subprocess.PIPE, stderr=stderr, text=True)
+        for line in process.stdout:
+            key, _, value = line.strip().partition("=")
+            if key == "out_time_us" and value.isdigit() and duration_us and on_progress:
+                now = time.monotonic()
+                if now - last_report >= 1:
+                    last_report = now
+                    on_progress(min(int(value) / duration_us, 1.0))
+        if process.wait() != 0:
+            stderr.seek(0)
+            raise RuntimeError(f"O ffmpeg falhou ({process.returncode}): {stderr.read().decode(errors='replace')[-2000:]}")
+    if on_progress:
+        on_progress(1.0)
+    return {"renditions": [h for h, _ in ladder_for(info["height"])], "audio": info["has_audio"]}
+
+# Percorre as caixas (atoms) de topo de um ficheiro MP4/MOV, devolvendo os tipos pela ordem em que aparecem
+def top_level_boxes(path: str) -> list:
+    boxes = []
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        offset = 0
+        while offset + 8 <= size:
+            f.seek(offset)
+            box_size, box_type = struct.unpack(">I4s", f.read(8))
+            if box_size == 1:
+                box_size = struct.unpack(">Q", f.read(8))[0]
+            elif box_size == 0:
+                box_size = size - offset
+            if box_size < 8:
+                break
+            boxes.append(box_type.decode("latin-1"))
+            offset += box_size
+    return boxes
+
+# Indica se um ficheiro é MP4/MOV e se o 'moov' já está antes dos dados ('mdat').
+# Devolve None para ficheiros que não são ISO BMFF (não há nada a remuxar).
+def is_faststart(path: str):
+    boxes = top_level_boxes(path)
+    if not boxes or boxes[0] not in ("ftyp", "moov", "free", "wide"):
+        return None
+    if "moov" not in boxes or "mdat" not in boxes:
+        return True
+    return boxes.index("moov") < boxes.index("mdat")
+
+# Remuxa um vídeo (sem recodificar) com o 'moov' no início, para que o browser comece a reproduzir
+# sem ter de pedir primeiro o fim do ficheiro
+def remux_faststart(src: str, dst: str):
+    subprocess.run(
+        [FFMPEG_BIN, "-y", "-hide_banner", "-loglevel", "error", "-i", src,
+         "-map", "0:v", "-map", "0:a?", "-c", "copy", "-movflags", "+faststart", "-f", "mp4", dst],
+        capture_output=True, check=True)
+
+# Índice de keyframes de um vídeo: lista de [tempo (s), offset em bytes] ordenada pelo tempo, lida dos
+# pacotes da primeira faixa de vídeo com o ffprobe (sem descodificar)
+def keyframe_index(path: str) -> dict:
+    out = subprocess.run(
+        [FFPROBE_BIN, "-v", "error", "-select_streams", "v:0",
+         "-show_entries", "packet=pts_time,pos,flags", "-of", "csv=p=0", path],
+        capture_output=True, check=True, text=True).stdout
+    keyframes = []
+    for line in out.splitlines():
+        pts_time, pos, flags = (line.split(",") + ["", "", ""])[:3]
+        if "K" in flags and pos.isdigit() and pts_time not in ("", "N/A"):
+            keyframes.append([round(float(pts_time), 3), int(pos)])
+    keyframes.sort()
+    return {"size": os.path.getsize(path), "keyframes": keyframes}
+
+# Grava o índice de keyframes (escrita atómica, o streaming_service nunca lê um índice a meio)
+def write_keyframe_index(index_path: str, index: dict):
+    tmp_path = f"{index_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(index, f, separators=(",", ":"))
+    os.replace(tmp_path, index_path)
+
+# Extrai uma imagem do vídeo no instante 'at' (s) com a largura dada. O -ss antes do -i salta para o
+# keyframe anterior, por isso só é descodificado o troço entre esse keyframe e o instante pedido.
+def extract_frame(src: str, dst: str, at: float, width: int):
+    subprocess.run(
+        [FFMPEG_BIN, "-y", "-hide_banner", "-loglevel", "error", "-ss", f"{at:.3f}", "-i", src,
+         "-frames:v", "1", "-vf", f"scale={width}:-2", "-q:v", "3", dst],
+        capture_output=True, check=True, timeout=60)
+
+# Gera em 'out_dir' a miniatura e a sprite de pré-visualização de um vídeo com a duração dada,
+# chamando on_progress(fração entre 0 e 1) depois de cada imagem
+def render_previews(src: str, out_dir: str, duration: float, on_progress=None):
+    os.makedirs(out_dir, exist_ok=True)
+    extract_frame(src, os.path.join(out_dir, POSTER_NAME), min(duration * 0.1, 10.0), POSTER_WIDTH)
+
+    tiles = SPRITE_COLUMNS * SPRITE_ROWS
+    tile_paths = [os.path.join(out_dir, f"tile-{i:03d}.jpg") for i in range(tiles)]
+    for i, tile_path in enumerate(tile_paths):
+        extract_frame(src, tile_path, duration * (i + 0.5) / tiles, SPRITE_TILE_WIDTH)
+        # Um instante depois da última imagem não gera nada: repete a imagem anterior
+        if not os.path.exists(tile_path) and i > 0:
+            shutil.copyfile(tile_paths[i - 1], tile_path)
+        if on_progress:
+            on_progress((i + 1) / (tiles + 1))
+    subprocess.run(
+        [FFMPEG_BIN, "-y", "-hide_banner", "-loglevel", "error", "-i", os.path.join(out_dir, "tile-%03d.jpg"),
+         "-vf", f"tile={SPRITE_COLUMNS}x{SPRITE_ROWS}", "-frames:v", "1", "-q:v", "4",
+         os.path.join(out_dir, SPRITE_NAME)],
+        capture_output=True, check=True, timeout=60)
+    for tile_path in tile_paths:
+        os.remove(tile_path)
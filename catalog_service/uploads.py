@@ -0,0 +1,224 @@
+# Imports Gerais
+import os
+import uuid
+import hashlib
+from dataclasses import dataclass, field
+from typing import Optional
+
+# Imports Extra
+import anyio
+from fastapi import HTTPException, Request
+from python_multipart.exceptions import MultipartParseError
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+# Tamanho máximo de um ficheiro de vídeo recebido (0 desativa o limite)
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(4 * 1024 ** 3)))
+# Bytes acumulados em memória antes de cada escrita no disco (feita numa thread, fora do event loop)
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+# Tamanho máximo de um campo de texto do formulário
+MAX_FIELD_BYTES = 64 * 1024
+
+
+# Ficheiro recebido num upload: já está no disco, com o hash e o tamanho calculados durante a cópia
+@dataclass
+class StoredUpload:
+    filename: str
+    content_type: str
+    path: str
+    size: int = 0
+    sha256: str = ""
+
+    # Move o ficheiro para o destino final. Como o diretório temporário está no mesmo sistema de
+    # ficheiros que o destino, é apenas um rename atómico (não há uma segunda cópia dos dados).
+    def commit(self, final_path: str):
+        os.replace(self.path, final_path)
+        self.path = final_path
+
+    # Remove o ficheiro temporário (upload falhado ou rejeitado, ou já registado no armazenamento por conteúdo)
+    def discard(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+# Escreve um ficheiro recebido em blocos de UPLOAD_CHUNK_SIZE, calculando o SHA-256 e o tamanho.
+# A criação do ficheiro, a escrita e o hash correm numa thread; a memória usada é limitada a um bloco por upload.
+class UploadWriter:
+    def __init__(self, upload: StoredUpload, max_bytes: int, file):
+        self.upload = upload
+        self.max_bytes = max_bytes
+        self.file = file
+        self.digest = hashlib.sha256()
+        self.buffer = bytearray()
+
+    # Cria o ficheiro do upload numa thread (a abertura pode bloquear, p.ex. num volume de rede)
+    @classmethod
+    async def create(cls, upload: StoredUpload, max_bytes: int) -> "UploadWriter":
+        return cls(upload, max_bytes, await anyio.to_thread.run_sync(open, upload.path, "wb"))
+
+    def _write(self, data: bytes):
+        self.digest.update(data)
+        self.file.write(data)
+
+    # Acrescenta dados, rejeitando o upload logo que excede o limite
+    async def write(self, data: bytes):
+        self.upload.size += len(data)
+        if self.max_bytes and self.upload.size > self.max_bytes:
+            raise HTTPException(status_code=413, detail=f"O ficheiro excede o tamanho máximo de {self.max_bytes} bytes")
+        self.buffer += data
+        if len(self.buffer) >= UPLOAD_CHUNK_SIZE:
+            chunk, self.buffer = bytes(self.buffer), bytearray()
+            await anyio.to_thread.run_sync(self._write, chunk)
+
+    # Escreve o que falta, sincroniza o ficheiro com o disco e fecha-o
+    async def close(self):
+        if self.buffer:
+            chunk, self.buffer = bytes(self.buffer), bytearray()
+            await anyio.to_thread.run_sync(self._write, chunk)
+
+        def finish():
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.file.close()
+        await anyio.to_thread.run_sync(finish)
+        self.upload.sha256 = self.digest.hexdigest()
+
+    def abort(self):
+        self.file.close()
+        self.upload.discard()
+
+
+# Valida os campos de texto do formulário de um vídeo e devolve (título, descrição, duração).
+# Com duration_optional, uma duração vazia devolve None (calculada com o ffprobe no registo do vídeo).
+def video_form_fields(fields: dict, duration_optional: bool = False) -> tuple:
+    title = fields.get("title", "").strip()
+    if not title:
+        raise HTTPException(status_code=422, detail="O título é obrigatório")
+    if duration_optional and not str(fields.get("duration") or "").strip():
+        return title, fields.get("description") or None, None
+    try:
+        duration = int(fields.get("duration", ""))
+    except ValueError:
+        raise HTTPException(status_code=422, detail="A duração tem de ser um número inteiro")
+    if not 0 <= duration <= 9999:
+        raise HTTPException(status_code=422, detail="A duração tem de estar entre 0 e 9999 segundos")
+    return title, fields.get("description") or None, duration
+
+
+# Descodifica um nome ou valor do formulário em UTF-8 (400 se não for UTF-8 válido)
+def _decode(value: bytes, what: str) -> str:
+    try:
+        return value.decode("utf-8")
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail=f"{what} não está em UTF-8")
+
+# Estado de uma parte do formulário multipart: cabeçalhos (durante o parsing), nome, nome do
+# ficheiro (None para campos de texto, "" para um campo de ficheiro vazio) e dados de um campo de texto
+@dataclass
+class _PartState:
+    headers: dict = field(default_factory=dict)
+    header_field: bytes = b""
+    header_value: bytes = b""
+    name: str = ""
+    filename: Optional[str] = None
+    data: bytearray = field(default_factory=bytearray)
+
+
+# Recebe um formulário multipart diretamente do corpo do pedido, sem o guardar em memória nem num
+# ficheiro temporário intermédio. O ficheiro (campo 'file_field') é escrito em 'upload_dir' à medida
+# que chega. Devolve os campos de texto e o ficheiro recebido (None se não foi enviado nenhum).
+async def receive_upload(request: Request, upload_dir: str, file_field: str = "file",
+                         max_bytes: int = MAX_UPLOAD_BYTES) -> tuple:
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise HTTPException(status_code=415, detail="O pedido tem de ser multipart/form-data")
+
+    # Rejeita logo pedidos cujo tamanho declarado já excede o limite, antes de ler o corpo
+    declared = request.headers.get("content-length")
+    if max_bytes and declared and declared.isdigit() and int(declared) > max_bytes + MAX_FIELD_BYTES:
+        raise HTTPException(status_code=413, detail=f"O ficheiro excede o tamanho máximo de {max_bytes} bytes")
+
+    # Os callbacks do parser são síncronos: registam eventos que são processados após cada bloco
+    events = []
+    part = _PartState()
+
+    def on_part_begin():
+        part.headers = {}
+        events.append(("begin", None))
+
+    def on_header_field(data, start, end):
+        part.header_field += data[start:end]
+
+    def on_header_value(data, start, end):
+        part.header_value += data[start:end]
+
+    def on_header_end():
+        part.headers[part.header_field.decode("latin-1").lower()] = part.header_value
+        part.header_field, part.header_value = b"", b""
+
+    def on_part_data(data, start, end):
+        events.append(("data", data[start:end]))
+
+    parser = MultipartParser(params[b"boundary"], {
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": lambda: events.append(("headers", dict(part.headers))),
+        "on_part_data": on_part_data,
+        "on_part_end": lambda: events.append(("end", None)),
+    })
+
+    fields, upload, writer, current, file_complete = {}, None, None, None, False
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            for kind, value in events:
+                if kind == "begin":
+                    current = _PartState()
+                elif kind == "headers":
+                    _, options = parse_options_header(value.get("content-disposition", b""))
+                    current.name = _decode(options.get(b"name", b""), "O nome de um campo")
+                    filename = options.get(b"filename")
+                    if filename is not None and current.name == file_field and filename:
+                        if upload is not None:
+                            raise HTTPException(status_code=400, detail="Apenas é permitido um ficheiro por pedido")
+                        basename = os.path.basename(_decode(filename, "O nome do ficheiro"))
+                        _, ext = os.path.splitext(basename)
+                        upload = StoredUpload(
+                            filename=basename,
+                            content_type=value.get("content-type", b"application/octet-stream").decode("latin-1"),
+                            path=os.path.join(upload_dir, f"{uuid.uuid4()}{ext}.part"))
+                        writer = await UploadWriter.create(upload, max_bytes)
+                        current.filename = upload.filename
+                    elif filename is not None:
+                        current.filename = ""
+                elif kind == "data":
+                    if current.filename:
+                        await writer.write(value)
+                    elif current.filename is None:
+                        current.data += value
+                        if len(current.data) > MAX_FIELD_BYTES:
+                            raise HTTPException(status_code=413, detail=f"O campo '{current.name}' é demasiado grande")
+                elif kind == "end":
+                    if current.filename is None:
+                        fields[current.name] = _decode(bytes(current.data), f"O campo '{current.name}'")
+                    elif current.filename:
+                        file_complete = True
+            events.clear()
+        parser.finalize()
+
+        if writer is not None:
+            if not file_complete:
+                raise HTTPException(status_code=400, detail="Upload incompleto")
+            await writer.close()
+        return fields, upload
+    except MultipartParseError as e:
+        if writer is not None:
+            writer.abort()
+        raise HTTPException(status_code=400, detail=f"Formulário multipart inválido: {e}")
+    except BaseException:
+        if writer is not None:
+            writer.abort()
+        raise
@@ -0,0 +1,80 @@
+# Pool de ligações HTTP partilhado pelos handlers de um serviço (ui_service, streaming_service) para falar
+# com os outros serviços, com ligações keep-alive reutilizadas entre pedidos.
+# Os pedidos em curso são contados por um transport próprio à volta do do httpx, sem ler o estado interno
+# do httpx/httpcore (que muda entre versões). Copiado para a imagem de cada serviço, como o metrics.py.
+
+# Imports Gerais
+import os
+
+# Imports Extra
+import httpx
+
+# Configuração do pool:
+# - HTTP_MAX_CONNECTIONS / HTTP_MAX_KEEPALIVE: ligações abertas no total e mantidas livres para reutilizar
+# - HTTP_KEEPALIVE_EXPIRY: segundos até uma ligação livre ser fechada
+# - HTTP2_ENABLED: HTTP/2 com os upstreams que o suportem (vários pedidos por ligação)
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "true").lower() in ("1", "true", "yes")
+
+
+# Corpo de uma resposta que avisa o transport quando é fechado (o pedido deixa de ocupar o pool)
+class _TrackedStream(httpx.AsyncByteStream):
+    def __init__(self, stream: httpx.AsyncByteStream, on_close):
+        self._stream = stream
+        self._on_close = on_close
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            if self._on_close is not None:
+                self._on_close()
+                self._on_close = None
+
+# Transport do pool: conta os pedidos em curso, desde o envio até o corpo da resposta ser fechado
+# (um stream reencaminhado ocupa uma ligação até ao fim)
+class PoolTransport(httpx.AsyncBaseTransport):
+    def __init__(self):
+        self._transport = httpx.AsyncHTTPTransport(
+            http2=HTTP2_ENABLED,
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY))
+        self.in_flight = 0
+        self.requests = 0
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.in_flight += 1
+        self.requests += 1
+        try:
+            response = await self._transport.handle_async_request(request)
+        except BaseException:
+            self.in_flight -= 1
+            raise
+        return httpx.Response(status_code=response.status_code, headers=response.headers,
+                              stream=_TrackedStream(response.stream, self._release),
+                              extensions=response.extensions)
+
+    def _release(self):
+        self.in_flight -= 1
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+    # Estado do pool: pedidos em curso e pedidos enviados desde o arranque. Em HTTP/1.1, os pedidos em curso
+    # acima de max_connections estão à espera de uma ligação livre.
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "max_connections": HTTP_MAX_CONNECTIONS,
+            "max_keepalive": HTTP_MAX_KEEPALIVE,
+            "http2": HTTP2_ENABLED,
+        }
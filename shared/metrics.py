@@ -0,0 +1,233 @@
+# Instrumentação partilhada pelos serviços: métricas Prometheus em /metrics, tempos dos pedidos HTTP,
+# do Redis e dos pedidos httpx a outros serviços, logs estruturados (JSON) com amostragem e spans de
+# tracing opcionais (OpenTelemetry).
+# Fica em shared/ e é copiado para a imagem de cada serviço (ver os Dockerfiles), ao lado do app.py; fora do
+# Docker, shared/ tem de estar no PYTHONPATH.
+
+# Imports Gerais
+import os
+import sys
+import json
+import time
+import queue
+import random
+import inspect
+import logging
+import logging.handlers
+from contextlib import nullcontext
+
+# Diretório das métricas partilhadas entre processos (workers Celery prefork); tem de existir antes
+# de importar o prometheus_client
+if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+    os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+
+# Imports Extra
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+from starlette.requests import Request
+from starlette.responses import Response
+
+# Tracing opcional: só é usado com o pacote opentelemetry instalado e TRACING_ENABLED=true
+try:
+    from opentelemetry import trace
+except ImportError:
+    trace = None
+
+# Configuração:
+# - SERVICE_NAME: nome do serviço nos logs e nos spans
+# - LOG_LEVEL: nível mínimo dos logs
+# - LOG_SAMPLE_RATE: fração dos eventos do hot path (um por pedido) que é registada nos logs
+SERVICE_NAME = os.getenv("SERVICE_NAME", "ualflix")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.01"))
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "false").lower() in ("1", "true", "yes") and trace is not None
+
+# Intervalos dos histogramas de latência (s), das leituras das caches (s, a partir de microssegundos)
+# e de duração das tarefas Celery (s)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CACHE_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1, 1.0)
+TASK_BUCKETS = (0.1, 0.5, 1.0, 5.0, 15.0, 60.0, 300.0, 900.0, 1800.0, 3600.0, 10800.0)
+
+# Métricas
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Latência dos pedidos HTTP até ao início da resposta",
+    ["method", "route", "status"], buckets=LATENCY_BUCKETS)
+HTTP_RESPONSE_BYTES = Counter(
+    "http_response_bytes", "Bytes enviados no corpo das respostas HTTP", ["route"])
+HTTP_REQUESTS_REJECTED = Counter(
+    "http_requests_rejected", "Pedidos recusados pelos limites de débito (rate_limit_*) e de admissão (overload)",
+    ["route", "reason"])
+CACHE_EVENTS = Counter(
+    "cache_events", "Acessos às caches por nível (memory, redis, ...) e resultado (hit, miss, evict)",
+    ["cache", "tier", "result"])
+CACHE_LOOKUP_DURATION = Histogram(
+    "cache_lookup_duration_seconds", "Latência das leituras das caches pelo nível que respondeu (memory, redis, database)",
+    ["cache", "tier"], buckets=CACHE_BUCKETS)
+DB_POOL_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds", "Espera por uma ligação do pool da base de dados", ["pool"],
+    buckets=LATENCY_BUCKETS)
+REDIS_COMMAND_DURATION = Histogram(
+    "redis_command_duration_seconds", "Latência dos comandos Redis", ["command"], buckets=LATENCY_BUCKETS)
+UPSTREAM_REQUEST_DURATION = Histogram(
+    "upstream_request_duration_seconds", "Latência dos pedidos httpx a outros serviços até aos cabeçalhos da resposta",
+    ["upstream", "method", "status"], buckets=LATENCY_BUCKETS)
+CELERY_TASK_DURATION = Histogram(
+    "celery_task_duration_seconds", "Duração das tarefas Celery", ["task", "state"], buckets=TASK_BUCKETS)
+
+
+# Logs estruturados: uma linha JSON por evento. As linhas são escritas por uma thread dedicada
+# (QueueHandler/QueueListener), por isso registar um evento num pedido não faz I/O síncrono no event loop.
+logger = logging.getLogger(SERVICE_NAME)
+logger.setLevel(LOG_LEVEL)
+logger.propagate = False
+_log_queue = queue.SimpleQueue()
+logger.addHandler(logging.handlers.QueueHandler(_log_queue))
+_listener, _listener_pid = None, None
+
+# Inicia a thread que escreve os logs (de novo em cada processo filho, p.ex. nos workers Celery)
+def _ensure_listener():
+    global _listener, _listener_pid
+    if _listener_pid != os.getpid():
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        _listener = logging.handlers.QueueListener(_log_queue, handler)
+        _listener.start()
+        _listener_pid = os.getpid()
+
+# Regista um evento estruturado. Com sample < 1 só essa fração dos eventos é registada (eventos do hot path).
+def log_event(event: str, level: int = logging.INFO, sample: float = 1.0, **fields):
+    if not logger.isEnabledFor(level) or (sample < 1.0 and random.random() >= sample):
+        return
+    _ensure_listener()
+    record = {"ts": round(time.time(), 3), "service": SERVICE_NAME, "level": logging.getLevelName(level),
+              "event": event, **fields}
+    if sample < 1.0:
+        record["sample_rate"] = sample
+    logger.log(level, json.dumps(record, default=str, ensure_ascii=False))
+
+
+# Span de tracing (sem efeito com o tracing desativado)
+def span(name: str, **attributes):
+    if not TRACING_ENABLED:
+        return nullcontext()
+    return trace.get_tracer(SERVICE_NAME).start_as_current_span(name, attributes=attributes)
+
+
+# Middleware ASGI que mede a latência de cada pedido (até ao início da resposta, o que num stream
+# corresponde ao TTFB) e os bytes enviados, por rota. A rota é o template (p.ex. /stream/{video_id}),
+# para o número de séries não crescer com os ids.
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] == "/metrics":
+            return await self.app(scope, receive, send)
+
+        start = time.perf_counter()
+        state = {"status": None, "bytes": 0}
+
+        def route() -> str:
+            return getattr(scope.get("route"), "path", None) or "unmatched"
+
+        async def send_with_metrics(message):
+            kind = message["type"]
+            if kind == "http.response.start":
+                state["status"] = message["status"]
+                state["length"] = next((int(value) for name, value in message.get("headers", [])
+                                        if name.lower() == b"content-length"), 0)
+                HTTP_REQUEST_DURATION.labels(scope["method"], route(), message["status"]).observe(
+                    time.perf_counter() - start)
+            elif kind == "http.response.body":
+                state["bytes"] += len(message.get("body", b""))
+            elif kind == "http.response.pathsend":
+                state["bytes"] += state["length"]
+            await send(message)
+
+        with span(f"{scope['method']} {scope['path']}", service=SERVICE_NAME):
+            try:
+                await self.app(scope, receive, send_with_metrics)
+            finally:
+                if state["status"] is None:
+                    HTTP_REQUEST_DURATION.labels(scope["method"], route(), 500).observe(time.perf_counter() - start)
+                HTTP_RESPONSE_BYTES.labels(route()).inc(state["bytes"])
+
+# Exposição das métricas no formato do Prometheus (síncrona: os coletores podem consultar o Redis)
+def metrics_endpoint(request: Request) -> Response:
+    return Response(generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
+
+# Ativa a instrumentação de uma aplicação: middleware de métricas e rota /metrics
+def setup_metrics(app):
+    app.add_middleware(MetricsMiddleware)
+    app.add_route("/metrics", metrics_endpoint, include_in_schema=False)
+
+
+# Coletor de gauges lidas no momento do scrape: fn devolve {valor do label (ou tuplo de valores): número}
+class GaugeCollector:
+    def __init__(self, name: str, documentation: str, labels: list, fn):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.fn = fn
+
+    def collect(self):
+        family = GaugeMetricFamily(self.name, self.documentation, labels=self.labels)
+        try:
+            values = self.fn()
+        except Exception as e:
+            log_event("metrics_collect_failed", logging.WARNING, metric=self.name, error=str(e))
+            values = {}
+        for key, value in values.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                keys = key if isinstance(key, tuple) else (key,)
+                family.add_metric([str(k) for k in keys], value)
+        yield family
+
+def register_gauges(name: str, documentation: str, labels: list, fn):
+    REGISTRY.register(GaugeCollector(name, documentation, labels, fn))
+
+
+# Mede a latência de cada comando de um cliente Redis (síncrono ou redis.asyncio)
+def instrument_redis(client):
+    execute = client.execute_command
+    if inspect.iscoroutinefunction(execute):
+        async def timed_execute(*args, **options):
+            start = time.perf_counter()
+            try:
+                return await execute(*args, **options)
+            finally:
+                REDIS_COMMAND_DURATION.labels(str(args[0]).upper()).observe(time.perf_counter() - start)
+    else:
+        def timed_execute(*args, **options):
+            start = time.perf_counter()
+            try:
+                return execute(*args, **options)
+            finally:
+                REDIS_COMMAND_DURATION.labels(str(args[0]).upper()).observe(time.perf_counter() - start)
+    client.execute_command = timed_execute
+    return client
+
+
+# Hooks de um httpx.AsyncClient que medem a latência de cada pedido a outro serviço
+async def _on_upstream_request(request):
+    request.extensions["metrics_start"] = time.perf_counter()
+
+async def _on_upstream_response(response):
+    start = response.request.extensions.get("metrics_start")
+    if start is not None:
+        UPSTREAM_REQUEST_DURATION.labels(
+            response.request.url.host, response.request.method, response.status_code).observe(time.perf_counter() - start)
+
+def httpx_event_hooks() -> dict:
+    return {"request": [_on_upstream_request], "response": [_on_upstream_response]}
+
+
+# Servidor de métricas de um worker Celery. Com PROMETHEUS_MULTIPROC_DIR definido (workers prefork),
+# junta as métricas de todos os processos filhos.
+def start_worker_metrics_server(port: int):
+    from prometheus_client import multiprocess, start_http_server
+    registry = REGISTRY
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    start_http_server(port, registry=registry)
@@ -1,34 +1,207 @@
 # Imports Gerais
+import asyncio
+import logging
+import math
 import os
 import re
+from contextlib import asynccontextmanager
 
 # Imports Extra
 import redis
-from fastapi import FastAPI, Header, HTTPException
-from fastapi.responses import FileResponse, StreamingResponse
+import redis.asyncio as aioredis
+from fastapi import FastAPI, Header, HTTPException, Query, Request
+from fastapi.responses import Response
+from starlette.concurrency import run_in_threadpool
 
 # Imports dos Ficheiros
-from controller import fetch_meta
+from cache import BlockCache, KeyframeIndexCache
+from controller import (fetch_meta, init_http_client, close_http_client, pool_stats,
+                        listen_video_events, meta_cache)
+from limits import (Pacer, RateLimiter, StreamAdmission, client_address, RATE_LIMIT_IP_RATE, RATE_LIMIT_IP_BURST,
+                    RATE_LIMIT_VIDEO_RATE, RATE_LIMIT_VIDEO_BURST, STREAM_PACING_RATE, STREAM_RETRY_AFTER)
+from metrics import HTTP_REQUESTS_REJECTED, instrument_redis, log_event, register_gauges, setup_metrics, LOG_SAMPLE_RATE
+from responses import (BlockStreamingResponse, RangeFileResponse, file_validators, is_not_modified,
+                       range_allowed, simple_range)
+
+# URL do Redis usado para receber os eventos de invalidação do catálogo
+REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
+REDIS_URL = f"redis://{os.getenv('REDIS_HOST', 'redis')}:{REDIS_PORT}/0"
+
+# Gere o ciclo de vida da aplicação, criando o cliente HTTP partilhado para o catálogo
+# e a subscrição dos eventos de alteração de vídeos
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    init_http_client()
+    events_task = asyncio.create_task(listen_video_events(REDIS_URL))
+    yield
+    events_task.cancel()
+    await close_http_client()
+    await limiter_redis.aclose()
 
 # Configuração da Aplicação
-app = FastAPI(title="Streaming Service")
+app = FastAPI(title="Streaming Service", lifespan=lifespan)
+setup_metrics(app)
 
 # Ligação ao Redis
 try:
-    redis_client = redis.Redis(host=os.getenv("REDIS_HOST", "redis"), port=6379, db=0)
+    redis_client = instrument_redis(redis.Redis(host=os.getenv("REDIS_HOST", "redis"), port=REDIS_PORT, db=0))
     redis_client.ping()
-    print("Ligação ao Redis feita com Sucesso.")
+    log_event("redis_connected")
 except redis.exceptions.ConnectionError as e:
-    print(f"Não foi possível ligar ao Redis: {e}")
+    log_event("redis_unavailable", logging.WARNING, error=str(e))
     redis_client = None
 
+# Limites dos streams (ver limits.py): token buckets por cliente e por vídeo no Redis, partilhados entre pods,
+# e número de streams em simultâneo neste processo. Sem Redis os pedidos não são limitados.
+limiter_redis = instrument_redis(aioredis.Redis(host=os.getenv("REDIS_HOST", "redis"), port=REDIS_PORT, db=0))
+rate_limiter = RateLimiter(limiter_redis, {"ip": (RATE_LIMIT_IP_RATE, RATE_LIMIT_IP_BURST),
+                                           "video": (RATE_LIMIT_VIDEO_RATE, RATE_LIMIT_VIDEO_BURST)})
+stream_admission = StreamAdmission()
+STREAM_ROUTE = "/stream/{video_id}"
+
 # Diretório onde vão estar os videos
 VIDEO_DIR = os.getenv("VIDEO_DIR", "/app/videos")
 
+# Qualidades HLS/DASH geradas pelo catalog_service, em <VIDEO_DIR>/abr/<hash do conteúdo>/.
+# O URL inclui o hash, por isso o conteúdo de um URL nunca muda e pode ficar em cache indefinidamente.
+ABR_DIR = os.path.join(VIDEO_DIR, "abr")
+ABR_CACHE_CONTROL = "public, max-age=31536000, immutable"
+ABR_MEDIA_TYPES = {
+    ".m3u8": "application/vnd.apple.mpegurl",
+    ".mpd": "application/dash+xml",
+    ".m4s": "video/iso.segment",
+}
+ABR_HASH_RE = re.compile(r"^[0-9a-f]{64}$")
+ABR_NAME_RE = re.compile(r"^[\w-]+\.(m3u8|mpd|m4s)$")
+
+# Miniatura e sprite de pré-visualização de cada conteúdo, em <VIDEO_DIR>/previews/<hash do conteúdo>/
+# (também endereçadas pelo hash, com a mesma cache imutável)
+PREVIEW_DIR = os.path.join(VIDEO_DIR, "previews")
+PREVIEW_NAMES = ("poster.jpg", "sprite.jpg")
+
+# Cache dos ficheiros de vídeo em /stream/{id}: o URL versionado pelo ui_service (?v=<updated_time do vídeo>)
+# muda sempre que o vídeo é alterado, por isso quando a versão é a atual a resposta é imutável; sem versão
+# (ou com uma versão antiga) o browser e as caches intermédias têm de a revalidar (ETag/Last-Modified).
+STREAM_VERSIONED_CACHE_CONTROL = ABR_CACHE_CONTROL
+STREAM_CACHE_CONTROL = "no-cache"
+
+# Cache de blocos de vídeo (memória local + Redis, cada nível com o seu orçamento; ver cache.py).
+# Desativada por omissão: todos os pedidos são servidos diretamente do ficheiro.
+STREAM_CACHE_ENABLED = os.getenv("STREAM_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+block_cache = BlockCache(redis_client=redis_client)
+# Índices de keyframes (tempo -> offset) gerados pelo catalog_service, para os seeks por tempo
+keyframe_indexes = KeyframeIndexCache()
+
+# Gauges lidas em cada scrape de /metrics: ocupação da cache de blocos, streams em curso e pedidos em curso ao catálogo
+register_gauges("block_cache_bytes", "Bytes e blocos na cache local de blocos de vídeo", ["kind"],
+                lambda: {k: v for k, v in block_cache.stats().items() if k in ("bytes", "blocks", "max_bytes")})
+register_gauges("stream_admission", "Streams em curso e à espera de lugar neste processo", ["state"],
+                lambda: {k: v for k, v in stream_admission.stats().items() if k in ("active", "queued")})
+register_gauges("http_pool_requests", "Pedidos em curso no pool HTTP ao catálogo", ["state"],
+                lambda: {k: v for k, v in pool_stats().items() if k == "in_flight"})
+
+# Métricas do pool de ligações HTTP ao catálogo
+@app.get("/metrics/http-pool")
+async def http_pool_metrics():
+    return pool_stats()
+
+# Estatísticas das caches de blocos de vídeo e de metadados
+@app.get("/cache/stats")
+async def cache_stats():
+    return {"blocks": block_cache.stats(), "meta": meta_cache.stats()}
+
+# Estado do limitador de pedidos e do controlo de admissão dos streams
+@app.get("/limits/stats")
+async def limits_stats():
+    return {"rate_limiter": rate_limiter.stats(), "admission": stream_admission.stats()}
+
+# Aplica os token buckets do cliente e do vídeo; um pedido acima do limite recebe 429 com Retry-After
+async def check_rate_limit(client: str, video_id: int):
+    limit, wait = await rate_limiter.check({"ip": client, "video": video_id})
+    if limit is not None:
+        HTTP_REQUESTS_REJECTED.labels(STREAM_ROUTE, f"rate_limit_{limit}").inc()
+        raise HTTPException(status_code=429, detail="Demasiados pedidos, tente novamente mais tarde",
+                            headers={"Retry-After": str(max(1, math.ceil(wait)))})
+
+# Reserva um lugar para um stream (esperando na fila, se necessário) e devolve a função que o liberta,
+# chamada quando a resposta termina. Um cliente com demasiados streams em curso recebe 429 e, com o
+# processo sobrecarregado, o pedido é recusado com 503; ambos com Retry-After.
+async def admit_stream(client: str):
+    reason = await stream_admission.acquire(client)
+    if reason == "client":
+        HTTP_REQUESTS_REJECTED.labels(STREAM_ROUTE, "rate_limit_streams").inc()
+        raise HTTPException(status_code=429, detail="Demasiados streams em simultâneo deste cliente",
+                            headers={"Retry-After": str(STREAM_RETRY_AFTER)})
+    if reason is not None:
+        HTTP_REQUESTS_REJECTED.labels(STREAM_ROUTE, "overload").inc()
+        raise HTTPException(status_code=503, detail="Demasiados streams em curso, tente novamente mais tarde",
+                            headers={"Retry-After": str(STREAM_RETRY_AFTER)})
+    return stream_admission.releaser(client)
+
+# Pacer de uma resposta, se o débito por stream estiver limitado
+def stream_pacer():
+    return Pacer() if STREAM_PACING_RATE > 0 else None
+
+# Fornece os manifestos (HLS/DASH) e os segmentos das qualidades transcodificadas de um conteúdo,
+# com cabeçalhos de cache de longa duração (o URL identifica o conteúdo pelo hash)
+@app.get("/stream/abr/{content_hash}/{name}")
+async def stream_abr(content_hash: str, name: str):
+    if not ABR_HASH_RE.match(content_hash) or not ABR_NAME_RE.match(name):
+        raise HTTPException(status_code=404, detail="Ficheiro não encontrado")
+    path = os.path.join(ABR_DIR, content_hash, name)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Ficheiro não encontrado")
+    media_type = ABR_MEDIA_TYPES[os.path.splitext(name)[1]]
+    return RangeFileResponse(path, media_type=media_type, stat_result=stat,
+                             headers={"Cache-Control": ABR_CACHE_CONTROL})
+
+# Fornece a miniatura ou a sprite de pré-visualização de um conteúdo, com cache de longa duração
+@app.get("/previews/{content_hash}/{name}")
+async def preview_image(content_hash: str, name: str):
+    if not ABR_HASH_RE.match(content_hash) or name not in PREVIEW_NAMES:
+        raise HTTPException(status_code=404, detail="Imagem não encontrada")
+    path = os.path.join(PREVIEW_DIR, content_hash, name)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Imagem não encontrada")
+    return RangeFileResponse(path, media_type="image/jpeg", stat_result=stat,
+                             headers={"Cache-Control": ABR_CACHE_CONTROL})
+
+# Seek por tempo: devolve o keyframe no instante 't' ou imediatamente antes e o seu offset em bytes, lidos do
+# índice de keyframes sem abrir o vídeo. O player pede depois esse offset com um Range normal
+# (404 se o vídeo ainda não tiver índice).
+@app.get(STREAM_ROUTE + "/keyframe")
+async def keyframe_lookup(video_id: int, t: float = Query(..., ge=0, allow_inf_nan=False)):
+    try:
+        meta = await fetch_meta(video_id)
+    except Exception as e:
+        raise HTTPException(status_code=404, detail=f"Metadados do vídeo não encontrados ou serviço de catálogo indisponível: {e}")
+    try:
+        stat = os.stat(meta.file_path)
+    except OSError:
+        raise HTTPException(status_code=404, detail=f"Ficheiro de vídeo não encontrado no caminho: {meta.file_path}")
+    seek = await run_in_threadpool(keyframe_indexes.seek, meta.file_path, stat, t)
+    if seek is None:
+        raise HTTPException(status_code=404, detail="Índice de keyframes não disponível para este vídeo")
+    return {"time": seek[0], "offset": seek[1], "size": stat.st_size}
+
 # Fornece o stream de um vídeo, suportando 'byte range requests' para streaming parcial
-# Utiliza um cache em Redis para acelerar a entrega de segmentos de vídeo
-@app.get("/stream/{video_id}")
-async def stream_video(video_id: int, range: str = Header(None)):
+# Com a cache ativa, ranges simples são montados a partir da cache de blocos alinhados, partilhada entre
+# pedidos e viewers; os restantes pedidos (sem Range, ranges de sufixo, multi-range, ranges inválidos ou fora
+# do ficheiro, ou cache desativada) são servidos diretamente do ficheiro (RangeFileResponse).
+# Todas as respostas levam ETag e Last-Modified: If-None-Match/If-Modified-Since devolvem um 304 sem corpo e
+# um Range com If-Range de outra versão do ficheiro é ignorado (o ficheiro é enviado inteiro).
+# Cada pedido passa pelos limites de débito (429) e cada resposta com corpo pelo controlo de admissão
+# (429 acima dos streams por cliente, 503 com o processo sobrecarregado).
+@app.get(STREAM_ROUTE)
+async def stream_video(request: Request, video_id: int, range: str = Header(None), if_range: str = Header(None),
+                       if_none_match: str = Header(None), if_modified_since: str = Header(None),
+                       v: int = Query(None)):
+    client = client_address(request)
+    await check_rate_limit(client, video_id)
     try:
         meta = await fetch_meta(video_id)
         path = meta.file_path
@@ -37,64 +210,43 @@ async def stream_video(video_id: int, range: str = Header(None)):
 
     if not os.path.exists(path):
         raise HTTPException(status_code=404, detail=f"Ficheiro de vídeo não encontrado no caminho: {path}")
-    size = os.path.getsize(path)
-
-    if range:
-        m = re.match(r"bytes=(\d+)-(\d*)", range)
-        if not m:
-            raise HTTPException(status_code=400, detail="Cabeçalho 'Range' inválido")
-        start = int(m.group(1))
-        end = int(m.group(2)) if m.group(2) else size - 1
-        end = min(end, size - 1)
+    stat = os.stat(path)
+    size = stat.st_size
+
+    etag, last_modified = file_validators(stat, meta.content_hash)
+    versioned = v is not None and v == int(meta.updated_time.timestamp())
+    cache_headers = {"ETag": etag, "Last-Modified": last_modified,
+                     "Cache-Control": STREAM_VERSIONED_CACHE_CONTROL if versioned else STREAM_CACHE_CONTROL}
+    if is_not_modified(if_none_match, if_modified_since, etag, stat):
+        return Response(status_code=304, headers=cache_headers)
+    if range and not range_allowed(if_range, etag, last_modified):
+        range = None
+
+    block_range = simple_range(range, size) if range and STREAM_CACHE_ENABLED else None
+    if block_range:
+        start, end = block_range
         length = end - start + 1
 
-        cache_key = f"video:{video_id}:range:{start}:{end}"
-        
-        # Tenta obter o segmento de vídeo do cache.
-        if redis_client:
-            cached_chunk = redis_client.get(cache_key)
-            if cached_chunk:
-                print(f"CACHE HIT para {cache_key}")
-                headers = {
-                    "Content-Range": f"bytes {start}-{end}/{size}",
-                    "Accept-Ranges": "bytes",
-                    "Content-Length": str(len(cached_chunk)),
-                    "X-Cache-Status": "HIT"
-                }
-                return StreamingResponse(iter([cached_chunk]), status_code=206, media_type="video/mp4", headers=headers)
-            print(f"CACHE MISS para {cache_key}")
-
-        def chunker(start_pos, chunk_size):
-            with open(path, "rb") as f:
-                f.seek(start_pos)
-                bytes_read = 0
-                while bytes_read < chunk_size:
-                    chunk = f.read(min(1024 * 1024, chunk_size - bytes_read))
-                    if not chunk:
-                        break
-                    yield chunk
-                    bytes_read += len(chunk)
-
-        def cache_and_stream(start_pos, chunk_size):
-            # Guarda o segmento de vídeo na cache antes de o enviar.
-            with open(path, "rb") as f:
-                f.seek(start_pos)
-                chunk_to_cache = f.read(chunk_size)
-            
-            # Armazena o segmento no Redis com um tempo de expiração como 10 minutos
-            if redis_client and chunk_to_cache:
-                redis_client.setex(cache_key, 600, chunk_to_cache)
-                print(f"CACHE GUARDADO para {cache_key}")
-
-            # Envia o segmento de vídeo a partir da memória.
-            yield chunk_to_cache
-        
+        file_key = BlockCache.file_key(path, stat)
+        total_blocks = end // block_cache.block_size - start // block_cache.block_size + 1
+        cached = block_cache.cached_blocks(file_key, start, end)
+        cache_status = "HIT" if cached == total_blocks else ("PARTIAL" if cached else "MISS")
+
         headers = {
             "Content-Range": f"bytes {start}-{end}/{size}",
             "Accept-Ranges": "bytes",
             "Content-Length": str(length),
-            "X-Cache-Status": "MISS"
+            "X-Cache-Status": cache_status,
+            **cache_headers,
         }
-        return StreamingResponse(cache_and_stream(start, length), status_code=206, media_type="video/mp4", headers=headers)
-
-    return FileResponse(path, media_type="video/mp4", filename=os.path.basename(path))
\ No newline at end of file
+        log_event("stream", sample=LOG_SAMPLE_RATE, video_id=video_id, start=start, end=end, cache=cache_status)
+        response = BlockStreamingResponse(
+            block_cache.iter_range(path, file_key, start, end), status_code=206, media_type="video/mp4",
+            headers=headers)
+    else:
+        log_event("stream", sample=LOG_SAMPLE_RATE, video_id=video_id, range=range, cache="BYPASS")
+        response = RangeFileResponse(
+            path, media_type="video/mp4", filename=os.path.basename(path), stat_result=stat,
+            headers=cache_headers)
+    # O lugar só é reservado com a resposta já construída: a partir daqui é a resposta que o liberta
+    return response.controlled(await admit_stream(client), stream_pacer())
\ No newline at end of file
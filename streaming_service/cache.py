@@ -0,0 +1,249 @@
+# Imports Gerais
+import os
+import json
+import bisect
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterator, Optional
+
+# Imports Extra
+import redis
+
+# Imports dos Ficheiros
+from metrics import CACHE_EVENTS
+
+# Configuração da cache de blocos:
+# - CACHE_BLOCK_SIZE: tamanho de cada bloco alinhado (1 MiB por omissão)
+# - CACHE_MAX_BYTES: orçamento de memória da cache local do processo
+# - CACHE_REDIS_TTL: tempo de vida dos blocos no Redis, partilhados entre pods (0 desativa)
+# - CACHE_REDIS_MAX_BYTES: orçamento do nível Redis, somando todos os pods (o Redis também guarda a fila do
+#   Celery e as caches do catálogo, por isso este nível nunca pode crescer com o tamanho dos vídeos)
+# - CACHE_REDIS_HEAD_BLOCKS: só os primeiros blocos de cada ficheiro (o início do vídeo, pedido por todos os
+#   viewers) vão para o Redis; os restantes ficam só na memória local
+CACHE_BLOCK_SIZE = int(os.getenv("CACHE_BLOCK_SIZE", str(1024 * 1024)))
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+CACHE_REDIS_TTL = int(os.getenv("CACHE_REDIS_TTL", "600"))
+CACHE_REDIS_MAX_BYTES = int(os.getenv("CACHE_REDIS_MAX_BYTES", str(128 * 1024 * 1024)))
+CACHE_REDIS_HEAD_BLOCKS = int(os.getenv("CACHE_REDIS_HEAD_BLOCKS", "8"))
+
+# Guarda um bloco no Redis dentro do orçamento, de forma atómica entre pods. Os blocos guardados ficam num
+# sorted set (por ordem de entrada) e os seus tamanhos num hash; o total é um contador. Quando o total passa
+# o orçamento, os blocos mais antigos são apagados até caber. Um bloco que expirou pelo TTL continua a contar
+# até sair pelo mesmo caminho, por isso o contador é sempre um limite superior dos bytes ocupados.
+# KEYS: bloco, índice, tamanhos, total; ARGV: dados, TTL (s), orçamento (bytes), hora atual
+REDIS_PUT_SCRIPT = """
+local size = string.len(ARGV[1])
+local budget = tonumber(ARGV[3])
+if size > budget or redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+local old = redis.call('HGET', KEYS[3], KEYS[1])
+if old then
+    redis.call('DECRBY', KEYS[4], old)
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+redis.call('ZADD', KEYS[2], ARGV[4], KEYS[1])
+redis.call('HSET', KEYS[3], KEYS[1], size)
+local total = redis.call('INCRBY', KEYS[4], size)
+while total > budget do
+    local oldest = redis.call('ZPOPMIN', KEYS[2])
+    if #oldest == 0 then
+        redis.call('SET', KEYS[4], 0)
+        break
+    end
+    local evicted = redis.call('HGET', KEYS[3], oldest[1]) or 0
+    redis.call('HDEL', KEYS[3], oldest[1])
+    redis.call('DEL', oldest[1])
+    total = redis.call('DECRBY', KEYS[4], evicted)
+end
+return 1
+"""
+REDIS_INDEX_KEYS = ("blocks:index", "blocks:sizes", "blocks:bytes")
+
+# Índices de keyframes gerados pelo catalog_service ao lado de cada vídeo (<ficheiro>.keyframes.json)
+# e número máximo de índices mantidos em memória
+KEYFRAME_INDEX_SUFFIX = ".keyframes.json"
+KEYFRAME_CACHE_SIZE = int(os.getenv("KEYFRAME_CACHE_SIZE", "256"))
+
+
+# Cache de blocos de vídeo com tamanho fixo e alinhados ao início do ficheiro.
+# Qualquer range pedido é montado a partir dos blocos que o cobrem, por isso pedidos diferentes
+# (seeks, players distintos) reutilizam os mesmos blocos. Tem dois níveis:
+# memória local (LRU limitada a max_bytes) e Redis (opcional, com TTL, só para os primeiros redis_head_blocks
+# blocos de cada ficheiro e limitado a redis_max_bytes no total).
+class BlockCache:
+    def __init__(self, block_size: int = CACHE_BLOCK_SIZE, max_bytes: int = CACHE_MAX_BYTES,
+                 redis_client: Optional[redis.Redis] = None, redis_ttl: int = CACHE_REDIS_TTL,
+                 redis_max_bytes: int = CACHE_REDIS_MAX_BYTES, redis_head_blocks: int = CACHE_REDIS_HEAD_BLOCKS):
+        self.block_size = block_size
+        self.max_bytes = max_bytes
+        enabled = redis_ttl > 0 and redis_max_bytes > 0 and redis_head_blocks > 0
+        self.redis_client = redis_client if enabled else None
+        self.redis_ttl = redis_ttl
+        self.redis_max_bytes = redis_max_bytes
+        self.redis_head_blocks = redis_head_blocks
+        self._redis_put = redis_client.register_script(REDIS_PUT_SCRIPT) if self.redis_client is not None else None
+        self._blocks: "OrderedDict[str, bytes]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # Identificador de uma versão de um ficheiro; muda sempre que o ficheiro é reescrito
+    @staticmethod
+    def file_key(path: str, stat: os.stat_result) -> str:
+        return f"{os.path.basename(path)}:{stat.st_mtime_ns}:{stat.st_size}"
+
+    # Indica se um bloco (chave "<ficheiro>:<índice>") pode estar no Redis
+    def _in_redis_tier(self, key: str) -> bool:
+        return self.redis_client is not None and int(key.rsplit(":", 1)[1]) < self.redis_head_blocks
+
+    # Procura um bloco na memória local e depois no Redis
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            data = self._blocks.get(key)
+            if data is not None:
+                self._blocks.move_to_end(key)
+                self.hits += 1
+                CACHE_EVENTS.labels("blocks", "memory", "hit").inc()
+                return data
+
+        if self._in_redis_tier(key):
+            try:
+                data = self.redis_client.get(f"block:{key}")
+            except redis.exceptions.RedisError:
+                data = None
+            if data is not None:
+                self._store_local(key, data)
+                with self._lock:
+                    self.redis_hits += 1
+                CACHE_EVENTS.labels("blocks", "redis", "hit").inc()
+                return data
+
+        with self._lock:
+            self.misses += 1
+        CACHE_EVENTS.labels("blocks", "redis" if self._in_redis_tier(key) else "memory", "miss").inc()
+        return None
+
+    # Guarda um bloco lido do disco na memória local e, se for um dos primeiros do ficheiro, no Redis
+    def put(self, key: str, data: bytes):
+        self._store_local(key, data)
+        if self._in_redis_tier(key):
+            try:
+                self._redis_put(keys=[f"block:{key}", *REDIS_INDEX_KEYS],
+                                args=[data, self.redis_ttl, self.redis_max_bytes, time.time()])
+            except redis.exceptions.RedisError:
+                pass
+
+    # Insere um bloco na memória local, removendo os menos usados recentemente até caber no orçamento
+    def _store_local(self, key: str, data: bytes):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._blocks.pop(key, None)
+            if old is not None:
+                self._size -= len(old)
+            self._blocks[key] = data
+            self._size += len(data)
+            while self._size > self.max_bytes:
+                _, evicted = self._blocks.popitem(last=False)
+                self._size -= len(evicted)
+                self.evictions += 1
+                CACHE_EVENTS.labels("blocks", "memory", "evict").inc()
+
+    # Indica quantos dos blocos de um range já estão em memória local
+    def cached_blocks(self, file_key: str, start: int, end: int) -> int:
+        first, last = start // self.block_size, end // self.block_size
+        with self._lock:
+            return sum(1 for i in range(first, last + 1) if f"{file_key}:{i}" in self._blocks)
+
+    # Gera os bytes [start, end] de um ficheiro, bloco a bloco.
+    # Cada bloco é enviado assim que está disponível (da cache ou do disco), por isso a memória
+    # usada por pedido fica limitada a um bloco, independentemente do tamanho do range.
+    def iter_range(self, path: str, file_key: str, start: int, end: int) -> Iterator[bytes]:
+        first, last = start // self.block_size, end // self.block_size
+        f = None
+        try:
+            for index in range(first, last + 1):
+                key = f"{file_key}:{index}"
+                data = self.get(key)
+                if data is None:
+                    if f is None:
+                        f = open(path, "rb")
+                    f.seek(index * self.block_size)
+                    data = f.read(self.block_size)
+                    if not data:
+                        break
+                    self.put(key, data)
+
+                block_start = index * self.block_size
+                lo = max(start - block_start, 0)
+                hi = min(end + 1 - block_start, len(data))
+                yield data if (lo == 0 and hi == len(data)) else data[lo:hi]
+        finally:
+            if f is not None:
+                f.close()
+
+    # Contadores da cache para monitorização
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.redis_hits + self.misses
+            return {
+                "block_size": self.block_size,
+                "max_bytes": self.max_bytes,
+                "redis_max_bytes": self.redis_max_bytes if self.redis_client is not None else 0,
+                "redis_head_blocks": self.redis_head_blocks if self.redis_client is not None else 0,
+                "bytes": self._size,
+                "blocks": len(self._blocks),
+                "hits": self.hits,
+                "redis_hits": self.redis_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round((self.hits + self.redis_hits) / lookups, 4) if lookups else 0.0,
+            }
+
+
+# Cache em memória (LRU) dos índices de keyframes, usados para converter um tempo no offset em
+# bytes do keyframe anterior sem percorrer o ficheiro. Cada índice é lido do disco uma vez por versão
+# do ficheiro de vídeo; um índice que não corresponde ao tamanho atual do ficheiro é ignorado.
+class KeyframeIndexCache:
+    def __init__(self, max_size: int = KEYFRAME_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    # Lê o índice de um ficheiro e devolve (tempos, offsets), ou None se não existir ou estiver desatualizado
+    def _load(self, path: str, stat: os.stat_result) -> Optional[tuple]:
+        try:
+            with open(f"{path}{KEYFRAME_INDEX_SUFFIX}") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return None
+        keyframes = index.get("keyframes") or []
+        if index.get("size") != stat.st_size or not keyframes:
+            return None
+        return [t for t, _ in keyframes], [offset for _, offset in keyframes]
+
+    # Keyframe no instante 't' ou imediatamente antes: (tempo, offset em bytes), ou None sem índice
+    def seek(self, path: str, stat: os.stat_result, t: float) -> Optional[tuple]:
+        key = f"{path}:{stat.st_mtime_ns}:{stat.st_size}"
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        CACHE_EVENTS.labels("keyframes", "memory", "miss" if entry is None else "hit").inc()
+        if entry is None:
+            entry = self._load(path, stat)
+            if entry is None:
+                return None
+            with self._lock:
+                self._entries[key] = entry
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+                    CACHE_EVENTS.labels("keyframes", "memory", "evict").inc()
+        times, offsets = entry
+        i = max(bisect.bisect_right(times, t) - 1, 0)
+        return times[i], offsets[i]
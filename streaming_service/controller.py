@@ -1,21 +1,170 @@
 # Imports Gerais
+import asyncio
+import json
+import logging
 import os
-from typing import Iterator
+import time
+from collections import OrderedDict
 
 # Imports Extra
 import httpx
+import redis.asyncio as aioredis
 from fastapi import HTTPException
 
 # Imports dos Ficheiros
+from http_pool import PoolTransport
+from metrics import CACHE_EVENTS, httpx_event_hooks, log_event
 from model import VideoMeta
 
 # Configuração do URL
 CATALOG_URL = os.getenv("CATALOG_URL", "http://catalog_service:5000")
 
+# Timeout dos pedidos de metadados, que estão no caminho crítico de cada pedido de stream
+TIMEOUT_META = httpx.Timeout(
+    float(os.getenv("HTTP_TIMEOUT_META", "3")),
+    pool=float(os.getenv("HTTP_POOL_TIMEOUT", "5")))
+
+# Configuração da cache local de metadados e do canal Redis onde o catálogo publica alterações
+META_CACHE_TTL = float(os.getenv("META_CACHE_TTL", "60"))
+META_CACHE_SIZE = int(os.getenv("META_CACHE_SIZE", "1024"))
+VIDEO_EVENTS_CHANNEL = os.getenv("VIDEO_EVENTS_CHANNEL", "video_events")
+
+# Cliente HTTP partilhado e o seu pool de ligações ao catálogo (ver http_pool.py), criados no arranque da aplicação
+http_client: httpx.AsyncClient = None
+http_pool: PoolTransport = None
+
+
+# Cache em memória dos metadados dos vídeos, limitada em tamanho (LRU) e em tempo (TTL).
+# Pedidos concorrentes para o mesmo id enquanto não há valor em cache partilham um único pedido
+# ao catálogo. As entradas são invalidadas pelos eventos publicados pelo catalog_service.
+class MetaCache:
+    def __init__(self, max_size: int = META_CACHE_SIZE, ttl: float = META_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()
+        self._inflight: dict = {}
+        self.started = time.monotonic()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.catalog_calls = 0
+        self.invalidations = 0
+
+    # Devolve os metadados em cache ou carrega-os com 'loader', partilhando pedidos em curso
+    async def get(self, video_id: int, loader) -> VideoMeta:
+        entry = self._entries.get(video_id)
+        if entry is not None and entry[0] > time.monotonic():
+            self._entries.move_to_end(video_id)
+            self.hits += 1
+            CACHE_EVENTS.labels("meta", "memory", "hit").inc()
+            return entry[1]
+
+        task = self._inflight.get(video_id)
+        if task is not None:
+            self.coalesced += 1
+            CACHE_EVENTS.labels("meta", "memory", "coalesced").inc()
+            return await asyncio.shield(task)
+
+        self.misses += 1
+        CACHE_EVENTS.labels("meta", "memory", "miss").inc()
+        self.catalog_calls += 1
+        task = asyncio.ensure_future(loader(video_id))
+        self._inflight[video_id] = task
+        try:
+            meta = await asyncio.shield(task)
+        finally:
+            # Só guarda o valor se não houve invalidação entretanto (que remove o pedido em curso)
+            if self._inflight.get(video_id) is task:
+                del self._inflight[video_id]
+                if task.done() and not task.cancelled() and task.exception() is None:
+                    self._store(video_id, task.result())
+        return meta
+
+    def _store(self, video_id: int, meta: VideoMeta):
+        self._entries[video_id] = (time.monotonic() + self.ttl, meta)
+        self._entries.move_to_end(video_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            CACHE_EVENTS.labels("meta", "memory", "evict").inc()
+
+    # Remove um vídeo da cache (ou toda a cache, sem id)
+    def invalidate(self, video_id: int = None):
+        self.invalidations += 1
+        CACHE_EVENTS.labels("meta", "memory", "invalidation").inc()
+        if video_id is None:
+            self._entries.clear()
+            self._inflight.clear()
+        else:
+            self._entries.pop(video_id, None)
+            self._inflight.pop(video_id, None)
+
+    # Contadores da cache para monitorização
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses + self.coalesced
+        uptime = time.monotonic() - self.started
+        return {
+            "entries": len(self._entries),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "invalidations": self.invalidations,
+            "hit_ratio": round((self.hits + self.coalesced) / lookups, 4) if lookups else 0.0,
+            "catalog_calls": self.catalog_calls,
+            "catalog_calls_per_s": round(self.catalog_calls / uptime, 3) if uptime else 0.0,
+        }
+
+meta_cache = MetaCache()
+
+# Escuta o canal de eventos do catálogo e invalida a cache local de metadados.
+# Se a ligação ao Redis cair, a cache é limpa ao voltar a ligar, porque podem ter sido perdidos eventos.
+async def listen_video_events(redis_url: str):
+    while True:
+        client = aioredis.from_url(redis_url)
+        try:
+            pubsub = client.pubsub()
+            await pubsub.subscribe(VIDEO_EVENTS_CHANNEL)
+            meta_cache.invalidate()
+            async for message in pubsub.listen():
+                if message["type"] != "message":
+                    continue
+                try:
+                    event = json.loads(message["data"])
+                    meta_cache.invalidate(int(event["id"]))
+                except (ValueError, KeyError, TypeError):
+                    meta_cache.invalidate()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log_event("video_events_disconnected", logging.WARNING, channel=VIDEO_EVENTS_CHANNEL, error=str(e))
+            await asyncio.sleep(5)
+        finally:
+            await client.aclose()
+
+# Cria o cliente HTTP partilhado com ligações keep-alive reutilizadas entre pedidos
+def init_http_client():
+    global http_client, http_pool
+    http_pool = PoolTransport()
+    http_client = httpx.AsyncClient(transport=http_pool, timeout=TIMEOUT_META, event_hooks=httpx_event_hooks())
+    return http_client
+
+# Fecha o cliente HTTP partilhado no encerramento da aplicação
+async def close_http_client():
+    if http_client is not None:
+        await http_client.aclose()
+
+# Devolve o estado do pool de ligações ao catálogo (pedidos em curso e enviados)
+def pool_stats() -> dict:
+    return http_pool.stats() if http_pool else {}
+
 # Fecth dos metadados de um vídeo a partir do serviço de catálogo
+async def fetch_meta_from_catalog(video_id: int) -> VideoMeta:
+    resp = await http_client.get(f"{CATALOG_URL}/videos/{video_id}")
+    if resp.status_code != 200:
+        raise HTTPException(status_code=resp.status_code, detail="Metadados não encontrados")
+    return VideoMeta(**resp.json())
+
+# Metadados de um vídeo, servidos da cache local sempre que possível
 async def fetch_meta(video_id: int) -> VideoMeta:
-    async with httpx.AsyncClient() as client:
-        resp = await client.get(f"{CATALOG_URL}/videos/{video_id}")
-        if resp.status_code != 200:
-            raise HTTPException(status_code=resp.status_code, detail="Metadados não encontrados")
-        return VideoMeta(**resp.json())
\ No newline at end of file
+    return await meta_cache.get(video_id, fetch_meta_from_catalog)
\ No newline at end of file
@@ -0,0 +1,228 @@
+# Imports Gerais
+import os
+import time
+import asyncio
+import logging
+import ipaddress
+from typing import Optional
+
+# Imports Extra
+import redis
+import redis.asyncio as aioredis
+from fastapi import Request
+
+# Imports dos Ficheiros
+from metrics import log_event, LOG_SAMPLE_RATE
+
+# Limites dos pedidos de stream (0 desativa cada um):
+# - RATE_LIMIT_IP_RATE / RATE_LIMIT_IP_BURST: pedidos por segundo de cada cliente (IP) e rajada máxima
+# - RATE_LIMIT_VIDEO_RATE / RATE_LIMIT_VIDEO_BURST: pedidos por segundo a cada vídeo, somando todos os clientes
+# - RATE_LIMIT_FORWARDED_HOPS: proxies confiáveis à frente do serviço que acrescentam ao X-Forwarded-For;
+#   0 usa o endereço da ligação. Depende da topologia:
+#   - kubernetes (browser -> ingress-nginx -> ui_service -> streaming): 2, porque o ui_service acrescenta o
+#     endereço do pod do ingress depois do do browser
+#   - streaming exposto diretamente aos browsers (p.ex. a porta publicada no docker-compose): 0
+# - RATE_LIMIT_TRUSTED_PROXIES: endereços ou redes (CIDR), separados por vírgulas, de onde o X-Forwarded-For é
+#   aceite; de qualquer outro endereço o cabeçalho é ignorado, para que um cliente ligado diretamente não o
+#   possa forjar. Vazio: o cabeçalho nunca é usado.
+# - STREAM_MAX_ACTIVE: streams servidos em simultâneo por processo
+# - STREAM_MAX_PER_CLIENT: streams em simultâneo de um mesmo cliente (IP) por processo; um player usa 1 a 3
+# - STREAM_MAX_QUEUED / STREAM_QUEUE_TIMEOUT: pedidos à espera de um lugar e tempo máximo de espera (s); além
+#   disso o pedido é recusado com 503 e Retry-After: STREAM_RETRY_AFTER (s)
+# - STREAM_PACING_RATE / STREAM_PACING_BURST: débito máximo (bytes/s) de cada resposta e bytes enviados sem
+#   pausa no início (o buffer inicial do player)
+RATE_LIMIT_IP_RATE = float(os.getenv("RATE_LIMIT_IP_RATE", "20"))
+RATE_LIMIT_IP_BURST = float(os.getenv("RATE_LIMIT_IP_BURST", "100"))
+RATE_LIMIT_VIDEO_RATE = float(os.getenv("RATE_LIMIT_VIDEO_RATE", "1000"))
+RATE_LIMIT_VIDEO_BURST = float(os.getenv("RATE_LIMIT_VIDEO_BURST", "2000"))
+RATE_LIMIT_FORWARDED_HOPS = int(os.getenv("RATE_LIMIT_FORWARDED_HOPS", "0"))
+RATE_LIMIT_TRUSTED_PROXIES = [ipaddress.ip_network(network.strip(), strict=False)
+                              for network in os.getenv("RATE_LIMIT_TRUSTED_PROXIES", "").split(",") if network.strip()]
+STREAM_MAX_ACTIVE = int(os.getenv("STREAM_MAX_ACTIVE", "256"))
+STREAM_MAX_PER_CLIENT = int(os.getenv("STREAM_MAX_PER_CLIENT", "8"))
+STREAM_MAX_QUEUED = int(os.getenv("STREAM_MAX_QUEUED", "256"))
+STREAM_QUEUE_TIMEOUT = float(os.getenv("STREAM_QUEUE_TIMEOUT", "2"))
+STREAM_RETRY_AFTER = int(os.getenv("STREAM_RETRY_AFTER", "1"))
+STREAM_PACING_RATE = float(os.getenv("STREAM_PACING_RATE", "0"))
+STREAM_PACING_BURST = int(os.getenv("STREAM_PACING_BURST", str(4 * 1024 * 1024)))
+
+# Token bucket atómico sobre várias chaves (KEYS), com ARGV = [taxa1, rajada1, taxa2, rajada2, ...].
+# O relógio é o do Redis, comum a todos os pods. Só consome um token se todas as chaves o tiverem.
+# Devolve {0, 0} ou {milissegundos até haver um token, índice da chave que limitou}.
+TOKEN_BUCKET_SCRIPT = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local tokens, wait, limited = {}, 0, 0
+for i, key in ipairs(KEYS) do
+  local rate, burst = tonumber(ARGV[2 * i - 1]), tonumber(ARGV[2 * i])
+  local bucket = redis.call('HMGET', key, 'tokens', 'ts')
+  local available = tonumber(bucket[1]) or burst
+  local elapsed = math.max(0, now - (tonumber(bucket[2]) or now))
+  tokens[i] = math.min(burst, available + elapsed * rate)
+  if tokens[i] < 1 and (1 - tokens[i]) / rate > wait then
+    wait, limited = (1 - tokens[i]) / rate, i
+  end
+end
+for i, key in ipairs(KEYS) do
+  local rate, burst = tonumber(ARGV[2 * i - 1]), tonumber(ARGV[2 * i])
+  if limited == 0 then
+    tokens[i] = tokens[i] - 1
+  end
+  redis.call('HSET', key, 'tokens', tokens[i], 'ts', now)
+  redis.call('PEXPIRE', key, math.ceil(burst / rate * 1000) + 1000)
+end
+return {math.ceil(wait * 1000), limited}
+"""
+
+
+# Indica se um endereço pertence a um dos proxies confiáveis (RATE_LIMIT_TRUSTED_PROXIES)
+def trusted_proxy(address: str) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in RATE_LIMIT_TRUSTED_PROXIES)
+
+# Endereço do cliente: numa ligação de um proxy confiável, com RATE_LIMIT_FORWARDED_HOPS proxies à frente, o
+# endereço acrescentado ao X-Forwarded-For pelo proxy confiável mais distante; nos restantes casos (ligação
+# direta, sem proxies ou sem o cabeçalho), o da ligação
+def client_address(request: Request) -> str:
+    peer = request.client.host if request.client else "unknown"
+    if RATE_LIMIT_FORWARDED_HOPS <= 0 or not trusted_proxy(peer):
+        return peer
+    forwarded = [a.strip() for a in request.headers.get("x-forwarded-for", "").split(",") if a.strip()]
+    if forwarded:
+        return forwarded[-min(RATE_LIMIT_FORWARDED_HOPS, len(forwarded))]
+    return peer
+
+
+# Limitador de pedidos por token bucket no Redis, partilhado por todos os pods. Cada limite tem um nome
+# (p.ex. "ip" ou "video"), uma taxa (tokens/s) e uma rajada; um pedido consome um token de cada limite.
+# Se o Redis falhar, os pedidos não são limitados (a disponibilidade do stream não depende do limitador).
+class RateLimiter:
+    def __init__(self, redis_client: aioredis.Redis, limits: dict):
+        self.limits = {name: limit for name, limit in limits.items() if limit[0] > 0 and limit[1] >= 1}
+        self._script = redis_client.register_script(TOKEN_BUCKET_SCRIPT) if self.limits else None
+        self.allowed = 0
+        self.limited = 0
+        self.errors = 0
+
+    # Consome um token para cada sujeito ({"ip": "10.0.0.1", "video": 3}). Devolve (None, 0) se o pedido
+    # pode seguir, ou (nome do limite excedido, segundos até haver um token).
+    async def check(self, subjects: dict) -> tuple:
+        names = [name for name in subjects if name in self.limits]
+        if not names:
+            return None, 0
+        keys = [f"ratelimit:{name}:{subjects[name]}" for name in names]
+        args = [value for name in names for value in self.limits[name]]
+        try:
+            wait_ms, limited = await self._script(keys=keys, args=args)
+        except redis.exceptions.RedisError as e:
+            self.errors += 1
+            log_event("rate_limit_unavailable", logging.WARNING, sample=LOG_SAMPLE_RATE, error=str(e))
+            return None, 0
+        if not limited:
+            self.allowed += 1
+            return None, 0
+        self.limited += 1
+        return names[int(limited) - 1], int(wait_ms) / 1000
+
+    # Contadores do limitador para monitorização
+    def stats(self) -> dict:
+        return {"allowed": self.allowed, "limited": self.limited, "errors": self.errors}
+
+
+# Controlo de admissão dos streams de um processo: no máximo max_active em simultâneo; os seguintes esperam
+# (até max_queued pedidos, durante no máximo queue_timeout segundos) e, além disso, são recusados de imediato,
+# para que uma sobrecarga não aumente a latência de todos os streams. Cada cliente tem no máximo
+# max_per_client streams em curso ou em espera, para que um só cliente não ocupe os lugares de todos.
+# max_active = 0 e max_per_client = 0 desativam os respetivos limites.
+class StreamAdmission:
+    def __init__(self, max_active: int = STREAM_MAX_ACTIVE, max_queued: int = STREAM_MAX_QUEUED,
+                 queue_timeout: float = STREAM_QUEUE_TIMEOUT, max_per_client: int = STREAM_MAX_PER_CLIENT):
+        self.max_active = max_active
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.max_per_client = max_per_client
+        self._semaphore = asyncio.Semaphore(max_active) if max_active > 0 else None
+        self._clients = {}
+        self.active = 0
+        self.queued = 0
+        self.admitted = 0
+        self.shed = 0
+        self.client_limited = 0
+
+    # Reserva um lugar para um stream do cliente. Devolve None, ou o motivo da recusa: "client" (o cliente já
+    # tem max_per_client streams) ou "overload" (sem lugar livre nem na fila).
+    async def acquire(self, client: str) -> Optional[str]:
+        if self.max_per_client > 0 and self._clients.get(client, 0) >= self.max_per_client:
+            self.client_limited += 1
+            return "client"
+        self._clients[client] = self._clients.get(client, 0) + 1
+        if self._semaphore is not None:
+            if self._semaphore.locked() and self.queued >= self.max_queued:
+                return self._reject(client)
+            self.queued += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                return self._reject(client)
+            except BaseException:
+                # Pedido cancelado (o cliente desligou-se) durante a espera
+                self._forget(client)
+                raise
+            finally:
+                self.queued -= 1
+        self.active += 1
+        self.admitted += 1
+        return None
+
+    def _reject(self, client: str) -> str:
+        self.shed += 1
+        self._forget(client)
+        return "overload"
+
+    def _forget(self, client: str):
+        count = self._clients.pop(client) - 1
+        if count:
+            self._clients[client] = count
+
+    # Liberta o lugar de um stream do cliente que terminou
+    def release(self, client: str):
+        self.active -= 1
+        self._forget(client)
+        if self._semaphore is not None:
+            self._semaphore.release()
+
+    # Função que liberta o lugar reservado por acquire(client); pode ser chamada mais do que uma vez
+    # (no fim do envio e quando a resposta é descartada sem ser enviada), mas só liberta o lugar uma vez
+    def releaser(self, client: str):
+        pending = [client]
+
+        def release():
+            if pending:
+                self.release(pending.pop())
+        return release
+
+    # Estado da admissão para monitorização
+    def stats(self) -> dict:
+        return {"active": self.active, "queued": self.queued, "clients": len(self._clients),
+                "max_active": self.max_active, "max_queued": self.max_queued, "max_per_client": self.max_per_client,
+                "admitted": self.admitted, "shed": self.shed, "client_limited": self.client_limited}
+
+
+# Limita o débito de uma resposta (bytes/s): os primeiros 'burst' bytes seguem sem pausa e a partir daí
+# cada bloco espera o tempo necessário para não exceder a taxa
+class Pacer:
+    def __init__(self, rate: float = STREAM_PACING_RATE, burst: int = STREAM_PACING_BURST):
+        self.rate = rate
+        self.burst = burst
+        self._allowance = float(burst)
+        self._last = time.monotonic()
+
+    async def consume(self, size: int):
+        now = time.monotonic()
+        self._allowance = min(self.burst, self._allowance + (now - self._last) * self.rate) - size
+        self._last = now
+        if self._allowance < 0:
+            await asyncio.sleep(-self._allowance / self.rate)
@@ -12,5 +12,6 @@ class VideoMeta(BaseModel):
     description: Optional[str] = None
     duration: int
     file_path: str
+    content_hash: Optional[str] = None
     upload_time: datetime
     updated_time: datetime
\ No newline at end of file
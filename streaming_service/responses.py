@@ -0,0 +1,107 @@
+# Imports Gerais
+import os
+import re
+from email.utils import formatdate, parsedate_to_datetime
+
+# Imports Extra
+from starlette.responses import FileResponse, StreamingResponse
+
+# Tamanho dos blocos lidos dos ficheiros servidos por RangeFileResponse.
+# Blocos grandes reduzem o número de saltos para a threadpool e de mensagens ASGI por byte enviado.
+FILE_CHUNK_SIZE = int(os.getenv("FILE_CHUNK_SIZE", str(1024 * 1024)))
+# Range simples, o único servido pela cache de blocos
+SIMPLE_RANGE_RE = re.compile(r"bytes=(\d+)-(\d*)")
+
+
+# ETag forte e Last-Modified do ficheiro de um vídeo. O ETag junta o hash do conteúdo ao mtime e ao tamanho
+# do ficheiro (os únicos que identificam os vídeos antigos, sem hash); é igual em todas as réplicas que
+# partilham o volume dos vídeos.
+def file_validators(stat, content_hash: str = None) -> tuple:
+    etag = f'"{(content_hash or "file")[:16]}-{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+    return etag, formatdate(stat.st_mtime, usegmt=True)
+
+# Verifica se o cliente já tem esta versão do ficheiro: If-None-Match (comparação fraca, vários ETags ou '*')
+# ou, só quando não há If-None-Match, If-Modified-Since (com resolução de segundos)
+def is_not_modified(if_none_match: str, if_modified_since: str, etag: str, stat) -> bool:
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags
+    if not if_modified_since:
+        return False
+    try:
+        return int(stat.st_mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+    except (TypeError, ValueError):
+        return False
+
+# Verifica se o Range de um pedido deve ser respeitado segundo o If-Range: só se o ETag (comparação forte)
+# ou a data indicados corresponderem à versão atual; caso contrário o ficheiro é enviado inteiro
+def range_allowed(if_range: str, etag: str, last_modified: str) -> bool:
+    return not if_range or if_range.strip() in (etag, last_modified)
+
+# Range simples ('bytes=<início>-[<fim>]') dentro do ficheiro, como (início, fim inclusive), para ser servido
+# pela cache de blocos; None para os restantes (sufixo, vários ranges, inválidos ou fora do ficheiro), que
+# são tratados pelo RangeFileResponse (206, 416 ou ficheiro inteiro, conforme o RFC 9110)
+def simple_range(range_header: str, size: int):
+    m = SIMPLE_RANGE_RE.fullmatch(range_header.strip())
+    if not m:
+        return None
+    start = int(m.group(1))
+    end = min(int(m.group(2)), size - 1) if m.group(2) else size - 1
+    return (start, end) if start <= end else None
+
+
+# Controlo do envio de uma resposta de stream (usado antes da classe base da resposta):
+# - 'release' é chamado quando a resposta termina (enviada, com erro ou com o cliente desligado), para
+#   libertar o lugar do stream no controlo de admissão; uma resposta descartada sem chegar a ser enviada
+#   (p.ex. por um middleware ou uma exceção) liberta-o quando é destruída
+# - com um 'pacer' (limits.Pacer), cada bloco do corpo espera pelo débito permitido antes de ser enviado
+class ControlledResponse:
+    release = None
+    pacer = None
+
+    def controlled(self, release=None, pacer=None):
+        self.release = release
+        self.pacer = pacer
+        return self
+
+    async def __call__(self, scope, receive, send):
+        if self.pacer is not None:
+            send = self._paced(send)
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self._release()
+
+    def _release(self):
+        release, self.release = self.release, None
+        if release is not None:
+            release()
+
+    def __del__(self):
+        self._release()
+
+    def _paced(self, send):
+        async def paced_send(message):
+            if message["type"] == "http.response.body":
+                await self.pacer.consume(len(message.get("body", b"")))
+            await send(message)
+        return paced_send
+
+
+# Resposta de um range montado a partir da cache de blocos
+class BlockStreamingResponse(ControlledResponse, StreamingResponse):
+    pass
+
+
+# Resposta de ficheiro com suporte a ranges (simples e multipart/byteranges), sobre o FileResponse do Starlette:
+# o parsing do Range, o If-Range e o 416 são tratados por ele, e sem Range o ficheiro é enviado com a extensão
+# 'http.response.pathsend' quando o servidor ASGI a suporta. Os restantes envios são feitos em blocos de
+# FILE_CHUNK_SIZE. Com um pacer o pathsend não é usado, porque o servidor enviaria o ficheiro sem passar pelo pacer.
+class RangeFileResponse(ControlledResponse, FileResponse):
+    chunk_size = FILE_CHUNK_SIZE
+
+    async def __call__(self, scope, receive, send):
+        if self.pacer is not None and "http.response.pathsend" in scope.get("extensions", {}):
+            extensions = {k: v for k, v in scope["extensions"].items() if k != "http.response.pathsend"}
+            scope = {**scope, "extensions": extensions}
+        await super().__call__(scope, receive, send)
@@ -0,0 +1,41 @@
+# Configuração dos testes do catalog_service: base de dados SQLite e diretório de vídeos temporários e
+# clientes Redis sobre o fakeredis
+
+# Imports Gerais
+import os
+import tempfile
+
+# Imports Extra
+import fakeredis
+import pytest
+
+# Imports dos Ficheiros
+from tests.conftest import use_service
+
+WORKDIR = tempfile.mkdtemp(prefix="ualflix-tests-catalog-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(WORKDIR, 'catalog.db')}"
+os.environ["UPLOAD_DIR"] = WORKDIR
+use_service("catalog")
+
+from model import SessionLocal, init_db  # noqa: E402 (depois de escolher o serviço e a base de dados)
+
+init_db()
+
+
+# Sessão da base de dados de um teste
+@pytest.fixture
+def db():
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+# Clientes Redis (síncrono e assíncrono) sobre o mesmo servidor fakeredis
+@pytest.fixture
+def redis_server():
+    return fakeredis.FakeServer()
+
+@pytest.fixture
+def redis_client(redis_server):
+    return fakeredis.FakeRedis(server=redis_server, decode_responses=True)
@@ -0,0 +1,153 @@
+# Contagem de referências dos ficheiros guardados por conteúdo: um ficheiro partilhado só é apagado quando
+# o último vídeo que o referencia é removido, e apenas depois do commit; os temporários dos uploads também
+# só são apagados depois do commit
+
+# Imports Gerais
+import hashlib
+import os
+import uuid
+
+# Imports Extra
+import pytest
+
+# Imports dos Ficheiros
+import controller
+import tasks
+from blobs import TEMP_UPLOAD_DIR, abr_dir, blob_path, keyframe_index_path, preview_dir, remove_temp_files, store_blob
+from model import Video
+
+
+# Escreve um upload temporário com o conteúdo indicado e devolve (caminho, hash)
+def write_temp(content: bytes) -> tuple:
+    content_hash = hashlib.sha256(content).hexdigest()
+    os.makedirs(TEMP_UPLOAD_DIR, exist_ok=True)
+    temp_path = os.path.join(TEMP_UPLOAD_DIR, f"{uuid.uuid4()}.part")
+    with open(temp_path, "wb") as f:
+        f.write(content)
+    return temp_path, content_hash
+
+# Coloca um upload (temporário) com o conteúdo indicado no armazenamento e cria um vídeo que o referencia
+def add_video(db, content: bytes) -> Video:
+    temp_path, content_hash = write_temp(content)
+    video = Video(title="Blob", description="", duration=1, content_hash=content_hash,
+                  file_path=store_blob(db, temp_path, content_hash, ".mp4"))
+    db.add(video)
+    db.commit()
+    remove_temp_files([temp_path])
+    return video
+
+
+def test_shared_blob_kept_until_last_reference(db, redis_client):
+    first = add_video(db, b"shared content")
+    second = add_video(db, b"shared content")
+    assert first.file_path == second.file_path
+    path = first.file_path
+    os.makedirs(abr_dir(first.content_hash))
+    os.makedirs(preview_dir(first.content_hash))
+    open(keyframe_index_path(path), "w").close()
+
+    controller.delete_video(db, first.id, redis_client)
+    assert os.path.exists(path)
+
+    controller.delete_video(db, second.id, redis_client)
+    assert not os.path.exists(path)
+    assert not os.path.exists(keyframe_index_path(path))
+    assert not os.path.exists(abr_dir(first.content_hash))
+    assert not os.path.exists(preview_dir(first.content_hash))
+
+def test_batch_delete_releases_each_blob_once(db, redis_client):
+    videos = [add_video(db, b"batch a"), add_video(db, b"batch a"), add_video(db, b"batch b")]
+    paths = {video.file_path for video in videos}
+    assert len(paths) == 2
+
+    controller.delete_videos(db, [video.id for video in videos], redis_client)
+    assert not any(os.path.exists(path) for path in paths)
+
+def test_blob_kept_when_commit_fails(db, redis_client, monkeypatch):
+    video = add_video(db, b"failed commit")
+
+    def fail():
+        raise RuntimeError("commit falhou")
+    with monkeypatch.context() as m:
+        m.setattr(db, "commit", fail)
+        with pytest.raises(RuntimeError):
+            controller.delete_video(db, video.id, redis_client)
+    db.rollback()
+    assert os.path.exists(video.file_path)
+    assert db.get(Video, video.id) is not None
+
+# Um conteúdo repetido reutiliza o blob sem apagar o temporário antes do commit
+def test_dedup_keeps_temp_until_commit(db):
+    video = add_video(db, b"dedup content")
+    temp_path, content_hash = write_temp(b"dedup content")
+    assert store_blob(db, temp_path, content_hash, ".mp4") == video.file_path
+    db.rollback()
+    assert os.path.exists(temp_path)
+    assert os.path.exists(video.file_path)
+    os.remove(temp_path)
+
+# Um ficheiro novo de uma atualização cujo commit falha não fica no armazenamento, e o temporário fica
+# com quem o recebeu (o vídeo continua com o ficheiro anterior)
+def test_new_blob_undone_when_commit_fails(db, redis_client, monkeypatch):
+    video = add_video(db, b"before update")
+    old_path = video.file_path
+    temp_path, content_hash = write_temp(b"after update")
+
+    def fail():
+        raise RuntimeError("commit falhou")
+    with monkeypatch.context() as m:
+        m.setattr(db, "commit", fail)
+        with pytest.raises(RuntimeError):
+            controller.update_video(db, video.id, "Blob", "", 1, redis_client,
+                                    upload_path=temp_path, content_hash=content_hash)
+    db.expire_all()
+    assert db.get(Video, video.id).file_path == old_path
+    assert os.path.exists(old_path)
+    assert os.path.exists(temp_path)
+    assert not os.path.exists(blob_path(content_hash))
+    os.remove(temp_path)
+
+# Um lote cujo registo falha não deixa blobs sem vídeo e não apaga os temporários; um lote registado
+# apaga-os só depois do commit
+def test_batch_register_moves_blobs_after_commit(db, redis_client, monkeypatch):
+    monkeypatch.setattr(tasks, "task_redis", lambda: redis_client)
+    items = []
+    for content in (b"batch register a", b"batch register b"):
+        temp_path, content_hash = write_temp(content)
+        items.append({"title": "Lote", "duration": 1, "temp_file_path": temp_path,
+                      "original_filename": "lote.mp4", "content_hash": content_hash})
+
+    def fail(*args):
+        raise RuntimeError("commit falhou")
+    with monkeypatch.context() as m:
+        m.setattr(tasks, "create_videos", fail)
+        with pytest.raises(RuntimeError):
+            tasks.register_videos_batch(items, stages=False)
+    assert all(os.path.exists(item["temp_file_path"]) for item in items)
+    assert not any(os.path.exists(blob_path(item["content_hash"], ".mp4")) for item in items)
+
+    result = tasks.register_videos_batch(items, stages=False)
+    assert len(result["videos"]) == 2
+    assert all(os.path.exists(video["file_path"]) for video in result["videos"])
+    assert not any(os.path.exists(item["temp_file_path"]) for item in items)
+
+# Um conteúdo derivado (remux faststart) entra como um blob novo com o seu hash: os vídeos que partilhavam o
+# ficheiro original passam a referenciá-lo e o original, que continua a corresponder ao seu hash, é apagado
+def test_replace_video_file(db, redis_client):
+    videos = [add_video(db, b"original layout"), add_video(db, b"original layout")]
+    old_path, old_hash = videos[0].file_path, videos[0].content_hash
+    temp_path, content_hash = write_temp(b"faststart layout")
+
+    new_path = controller.replace_video_file(db, old_path, old_hash, temp_path, content_hash, ".mp4",
+                                             redis_client)
+    assert new_path == blob_path(content_hash, ".mp4")
+    db.expire_all()
+    assert all(db.get(Video, video.id).file_path == new_path for video in videos)
+    assert all(db.get(Video, video.id).content_hash == content_hash for video in videos)
+    assert not os.path.exists(old_path)
+    with open(new_path, "rb") as f:
+        assert hashlib.sha256(f.read()).hexdigest() == content_hash
+    assert os.path.exists(temp_path)
+    assert controller.replace_video_file(db, old_path, old_hash, temp_path, content_hash, ".mp4",
+                                         redis_client) is None
+    os.remove(temp_path)
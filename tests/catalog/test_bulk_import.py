@@ -0,0 +1,42 @@
+# Importação em massa (bulk_import.register_batch): voltar a correr um lote já registado, p.ex. depois de uma
+# interrupção entre o commit e o checkpoint, não duplica vídeos
+
+# Imports Gerais
+import argparse
+import hashlib
+import uuid
+
+# Imports dos Ficheiros
+import bulk_import
+from model import Video
+
+
+# Ficheiro de origem com conteúdo único e o item devolvido pelo inspect_file para ele
+def source_item(tmp_path) -> dict:
+    content = uuid.uuid4().bytes * 100
+    path = str(tmp_path / f"{uuid.uuid4()}.mp4")
+    with open(path, "wb") as f:
+        f.write(content)
+    return {"path": path, "size": len(content), "content_hash": hashlib.sha256(content).hexdigest(), "duration": 1}
+
+def new_report() -> dict:
+    return {"imported": 0, "already_registered": 0, "bytes": 0, "stages_failed": 0}
+
+
+def test_rerun_does_not_duplicate_videos(db, redis_client, tmp_path):
+    args = argparse.Namespace(mode="link", description=None, no_stages=True)
+    items = [source_item(tmp_path) for _ in range(3)]
+    hashes = [item["content_hash"] for item in items]
+    with open(tmp_path / "lote.checkpoint", "a") as checkpoint:
+        report = new_report()
+        bulk_import.register_batch(items[:2], args, checkpoint, redis_client, report)
+        assert report["imported"] == 2
+
+        # Execução retomada sem o checkpoint do primeiro lote: os dois primeiros já estão no catálogo e só o
+        # terceiro é inserido
+        report = new_report()
+        bulk_import.register_batch(items, args, checkpoint, redis_client, report)
+    assert report["imported"] == 1
+    assert report["already_registered"] == 2
+    for content_hash in hashes:
+        assert db.query(Video).filter(Video.content_hash == content_hash).count() == 1
@@ -0,0 +1,138 @@
+# Proteção contra stampedes das caches do catálogo: com 500 misses concorrentes da mesma chave há uma só
+# query à base de dados, nas camadas síncrona (threads) e assíncrona (corrotinas)
+# (o benchmarks/cache_stampede.py faz o mesmo contra um Redis real)
+
+# Imports Gerais
+import asyncio
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Imports Extra
+import fakeredis
+import pytest
+from sqlalchemy import event
+
+# Imports dos Ficheiros
+import async_controller
+import controller
+from cache import _aload_and_store, _load_and_store, decode_entry, encode_entry, lock_key
+from model import Video, SessionLocal, AsyncSessionLocal, engine, make_async_engine
+
+CONCURRENCY = 500
+
+
+# Conta as queries SELECT à tabela 'videos' de um engine
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT") and "videos" in statement:
+            with self._lock:
+                self.count += 1
+
+# Vídeo usado nos testes e contador das queries dos engines síncrono e assíncrono
+@pytest.fixture(scope="module")
+def video_id():
+    with SessionLocal() as db:
+        video = Video(title="Stampede", description="", duration=60, file_path="/tests/stampede.mp4")
+        db.add(video)
+        db.commit()
+        return video.id
+
+@pytest.fixture
+def counter():
+    counter = QueryCounter()
+    event.listen(engine, "before_cursor_execute", counter)
+    yield counter
+    event.remove(engine, "before_cursor_execute", counter)
+
+@pytest.fixture(scope="module")
+def async_engine():
+    return make_async_engine(engine)
+
+@pytest.fixture(autouse=True)
+def clear_local_cache():
+    controller.video_local_cache.invalidate()
+
+# Corre 'fn' com uma sessão própria em CONCURRENCY threads ao mesmo tempo
+def run_threads(fn) -> list:
+    barrier = threading.Barrier(CONCURRENCY)
+
+    def call(_):
+        barrier.wait()
+        with SessionLocal() as db:
+            return fn(db)
+
+    with ThreadPoolExecutor(max_workers=CONCURRENCY) as pool:
+        return list(pool.map(call, range(CONCURRENCY)))
+
+# Corre 'fn' com uma sessão assíncrona própria em CONCURRENCY corrotinas concorrentes
+def run_coroutines(async_engine, fn) -> list:
+    async def call():
+        async with AsyncSessionLocal(bind=async_engine) as db:
+            return await fn(db)
+
+    async def gather():
+        return await asyncio.gather(*[call() for _ in range(CONCURRENCY)])
+    return asyncio.run(gather())
+
+
+def test_video_miss_loads_once(redis_client, counter, video_id):
+    values = run_threads(lambda db: controller.get_video(db, video_id, redis_client))
+    assert counter.count == 1
+    assert all(value["title"] == "Stampede" for value in values)
+
+def test_list_miss_after_write_loads_once(redis_client, counter, video_id):
+    controller.list_videos(SessionLocal(), redis_client, limit=20)
+    controller.invalidate_list_cache(redis_client)
+    counter.count = 0
+    run_threads(lambda db: controller.list_videos(db, redis_client, limit=20))
+    assert counter.count == 1
+
+# Entrada expirada, ainda dentro da janela de stale-while-revalidate: um pedido recalcula e os outros
+# recebem o valor antigo (ou o novo, se chegarem depois de ele ser guardado) sem esperar
+def test_stale_entry_refreshed_once(redis_client, counter, video_id):
+    stale = json.dumps({"id": video_id, "title": "antigo"})
+    redis_client.set(f"video:{video_id}", encode_entry(stale, -1, 0.01), ex=60)
+    values = run_threads(lambda db: controller.get_video(db, video_id, redis_client))
+    assert counter.count == 1
+    assert any(value["title"] == "antigo" for value in values)
+    assert json.loads(decode_entry(redis_client.get(f"video:{video_id}"))[2])["title"] == "Stampede"
+
+def test_async_video_miss_loads_once(redis_server, async_engine, video_id):
+    counter = QueryCounter()
+    event.listen(async_engine.sync_engine, "before_cursor_execute", counter)
+    try:
+        redis_client = fakeredis.FakeAsyncRedis(server=redis_server, decode_responses=True,
+                                                max_connections=CONCURRENCY * 2)
+        values = run_coroutines(async_engine, lambda db: async_controller.get_video(db, video_id, redis_client))
+    finally:
+        event.remove(async_engine.sync_engine, "before_cursor_execute", counter)
+    assert counter.count == 1
+    assert all(value["title"] == "Stampede" for value in values)
+
+# O lock de uma chave só é libertado por quem o tem: se expirou durante o cálculo e outro pedido o obteve,
+# o primeiro guarda o valor mas não apaga o lock do segundo (nas camadas síncrona e assíncrona)
+def test_lock_release_keeps_lock_taken_by_another_request(redis_server, redis_client):
+    def loader():
+        redis_client.set(lock_key("sync"), "outro", px=5000)
+        return "valor"
+    assert _load_and_store(redis_client, "sync", 60, loader, "dono") == "valor"
+    assert redis_client.get(lock_key("sync")) == "outro"
+    redis_client.set(lock_key("own"), "dono", px=5000)
+    _load_and_store(redis_client, "own", 60, lambda: "valor", "dono")
+    assert not redis_client.exists(lock_key("own"))
+
+    async def main():
+        async_client = fakeredis.FakeAsyncRedis(server=redis_server, decode_responses=True)
+
+        async def aloader():
+            await async_client.set(lock_key("async"), "outro", px=5000)
+            return "valor"
+        assert await _aload_and_store(async_client, "async", 60, aloader, "dono") == "valor"
+        assert await async_client.get(lock_key("async")) == "outro"
+        await async_client.aclose()
+    asyncio.run(main())
@@ -0,0 +1,42 @@
+# Filtro por título da listagem e pesquisa simples (SQLite): o texto procurado é literal, sem os
+# carateres especiais do LIKE ('%' e '_') a funcionarem como padrões
+
+# Imports Extra
+import pytest
+
+# Imports dos Ficheiros
+import controller
+from model import Video
+
+TITLES = ["desconto 50% hoje", "500 vídeos", "gato_preto", "gatoXpreto"]
+
+
+@pytest.fixture
+def videos(db):
+    rows = [Video(title=title, description="", duration=1, file_path=f"/tests/{i}.mp4")
+            for i, title in enumerate(TITLES)]
+    db.add_all(rows)
+    db.commit()
+    yield rows
+    for row in rows:
+        db.delete(row)
+    db.commit()
+
+# Títulos dos vídeos de teste devolvidos por uma listagem filtrada pelo título
+def listed_titles(db, title: str) -> set:
+    stmt = controller.list_statement(50, None, "-upload_time", title, None, None)
+    return {video.title for video in db.execute(stmt).scalars()} & set(TITLES)
+
+
+@pytest.mark.parametrize("title, expected", [
+    ("50%", {"desconto 50% hoje"}),
+    ("gato_preto", {"gato_preto"}),
+    ("GATO", {"gato_preto", "gatoXpreto"}),
+])
+def test_title_filter_is_literal(db, videos, title, expected):
+    assert listed_titles(db, title) == expected
+
+def test_simple_search_is_literal(db, videos):
+    rows, fuzzy = controller.query_search(db, "gato_preto", 20)
+    assert {video.title for video, _ in rows} == {"gato_preto"}
+    assert not fuzzy
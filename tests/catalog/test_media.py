@@ -0,0 +1,92 @@
+# Ferramentas de media sobre um vídeo real gerado com o ffmpeg (lavfi): ffprobe, índice de keyframes e remux
+# faststart. São ignorados quando o ffmpeg/ffprobe não estão instalados.
+
+# Imports Gerais
+import json
+import os
+import shutil
+import subprocess
+
+# Imports Extra
+import pytest
+
+# Imports dos Ficheiros
+import tasks
+from blobs import TEMP_UPLOAD_DIR, file_sha256, keyframe_index_path, store_blob
+from model import Video
+from transcode import (FFMPEG_BIN, FFPROBE_BIN, is_faststart, keyframe_index, probe, probe_duration,
+                       remux_faststart, top_level_boxes)
+
+pytestmark = pytest.mark.skipif(shutil.which(FFMPEG_BIN) is None or shutil.which(FFPROBE_BIN) is None,
+                                reason="ffmpeg/ffprobe não instalados")
+
+CLIP_SECONDS = 2
+CLIP_HEIGHT = 120
+# Um keyframe a cada 12 imagens (0,5 s a 24 imagens/s)
+CLIP_FPS, CLIP_GOP = 24, 12
+
+
+# Clip de teste com vídeo e áudio, com o 'moov' no fim (a escrita por omissão do muxer MP4 do ffmpeg)
+@pytest.fixture(scope="module")
+def clip(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("media") / "clip.mp4")
+    subprocess.run(
+        [FFMPEG_BIN, "-y", "-hide_banner", "-loglevel", "error",
+         "-f", "lavfi", "-i", f"testsrc=duration={CLIP_SECONDS}:size=160x{CLIP_HEIGHT}:rate={CLIP_FPS}",
+         "-f", "lavfi", "-i", f"sine=frequency=440:duration={CLIP_SECONDS}",
+         "-c:v", "mpeg4", "-g", str(CLIP_GOP), "-c:a", "aac", "-shortest", path],
+        capture_output=True, check=True, timeout=60)
+    return path
+
+
+def test_probe(clip):
+    info = probe(clip)
+    assert info["duration"] == pytest.approx(CLIP_SECONDS, abs=0.2)
+    assert info["height"] == CLIP_HEIGHT
+    assert info["has_audio"]
+    assert probe_duration(clip) == CLIP_SECONDS
+
+def test_keyframe_index(clip):
+    index = keyframe_index(clip)
+    assert index["size"] == os.path.getsize(clip)
+    times = [t for t, _ in index["keyframes"]]
+    offsets = [offset for _, offset in index["keyframes"]]
+    assert times[0] == 0
+    assert times == pytest.approx([i * CLIP_GOP / CLIP_FPS for i in range(len(times))], abs=0.05)
+    assert len(times) == CLIP_SECONDS * CLIP_FPS // CLIP_GOP
+    assert offsets == sorted(offsets) and offsets[-1] < index["size"]
+
+def test_remux_faststart(clip, tmp_path):
+    assert is_faststart(clip) is False
+    dst = str(tmp_path / "faststart.mp4")
+    remux_faststart(clip, dst)
+    boxes = top_level_boxes(dst)
+    assert boxes.index("moov") < boxes.index("mdat")
+    assert is_faststart(dst) is True
+    assert probe(dst)["duration"] == pytest.approx(probe(clip)["duration"], abs=0.05)
+    # O remux só muda a posição dos dados: os mesmos keyframes, com os offsets deslocados
+    assert [t for t, _ in keyframe_index(dst)["keyframes"]] == [t for t, _ in keyframe_index(clip)["keyframes"]]
+
+# A etapa faststart guarda o remux como um blob novo com o seu próprio hash e gera o índice de keyframes dele
+def test_faststart_video_task(clip, db, redis_client, monkeypatch):
+    monkeypatch.setattr(tasks, "task_redis", lambda: redis_client)
+    os.makedirs(TEMP_UPLOAD_DIR, exist_ok=True)
+    temp_path = os.path.join(TEMP_UPLOAD_DIR, "clip.part")
+    shutil.copyfile(clip, temp_path)
+    original_hash = file_sha256(temp_path)
+    video = Video(title="Clip", description="", duration=CLIP_SECONDS, content_hash=original_hash,
+                  file_path=store_blob(db, temp_path, original_hash, ".mp4"))
+    db.add(video)
+    db.commit()
+    os.remove(temp_path)
+    original_path = video.file_path
+
+    result = tasks.faststart_video({"id": video.id, "file_path": original_path, "content_hash": original_hash})
+    assert result["content_hash"] != original_hash
+    assert result["content_hash"] == file_sha256(result["file_path"])
+    assert is_faststart(result["file_path"]) is True
+    assert not os.path.exists(original_path)
+    db.expire_all()
+    assert db.get(Video, video.id).file_path == result["file_path"]
+    with open(keyframe_index_path(result["file_path"])) as f:
+        assert json.load(f)["size"] == os.path.getsize(result["file_path"])
@@ -0,0 +1,44 @@
+# Encaminhamento das leituras depois de uma escrita: só o cliente que escreveu (read-your-writes) e o detalhe
+# do vídeo escrito vão ao primário; as restantes leituras ficam nas réplicas, com um TTL curto em cache
+
+# Imports Gerais
+import math
+
+# Imports Extra
+import pytest
+from starlette.requests import Request
+
+# Imports dos Ficheiros
+import controller
+from model import ReadRouter, DB_REPLICA_MAX_LAG
+
+
+@pytest.fixture
+def router(monkeypatch):
+    router = ReadRouter("primário", [])
+    monkeypatch.setattr(controller, "read_router", router)
+    return router
+
+# Pedido de leitura com os parâmetros do caminho e os cabeçalhos indicados
+def read_request(path_params: dict = None, headers: dict = None) -> Request:
+    return Request({"type": "http", "method": "GET", "path": "/", "query_string": b"", "path_params": path_params or {},
+                    "headers": [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()]})
+
+
+def test_other_writes_do_not_pin_reads_to_primary(router):
+    router.note_write(1)
+    assert controller.read_from_primary(read_request({"video_id": "1"}))
+    assert not controller.read_from_primary(read_request({"video_id": "2"}))
+    assert not controller.read_from_primary(read_request())
+
+def test_writer_reads_from_primary(router):
+    marker = {controller.READ_YOUR_WRITES_HEADER: controller.write_marker()}
+    assert controller.read_from_primary(read_request(headers=marker))
+
+def test_replica_reads_after_write_cached_briefly(router):
+    assert router.cache_ttl("réplica", 3600) == 3600
+    router.note_write(1)
+    assert router.cache_ttl("réplica", 3600) == math.ceil(DB_REPLICA_MAX_LAG)
+    assert router.cache_ttl("réplica", 3600, video_id=1) == math.ceil(DB_REPLICA_MAX_LAG)
+    assert router.cache_ttl("réplica", 3600, video_id=2) == 3600
+    assert router.cache_ttl("primário", 3600) == 3600
@@ -0,0 +1,157 @@
+# Uploads retomáveis em blocos: validação do Upload-Offset, blocos repetidos ou incompletos, retoma a partir
+# do estado no Redis e finalização (que nunca acontece com um bloco a ser escrito)
+
+# Imports Gerais
+import asyncio
+import base64
+import hashlib
+import os
+
+# Imports Extra
+import fakeredis
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+# Imports dos Ficheiros
+import resumable
+from blobs import TEMP_UPLOAD_DIR
+from resumable import (CHUNK_CONTENT_TYPE, abort_session, create_session, finalize_session, load_session,
+                       receive_chunk, upload_state)
+
+CHUNK_SIZE = 4
+CONTENT = b"0123456789"
+
+
+# Pedido PATCH com o corpo enviado nas partes indicadas; 'gate' (opcional) atrasa a última parte
+def chunk_request(offset: int, parts: list, headers: dict = None, gate: asyncio.Event = None) -> Request:
+    messages = [{"type": "http.request", "body": part, "more_body": i < len(parts) - 1}
+                for i, part in enumerate(parts)]
+
+    async def receive():
+        if gate is not None and len(messages) == 1:
+            await gate.wait()
+        return messages.pop(0)
+    raw = {"content-type": CHUNK_CONTENT_TYPE, "upload-offset": str(offset), **(headers or {})}
+    scope = {"type": "http", "method": "PATCH", "path": "/uploads/x", "query_string": b"",
+             "headers": [(k.encode(), v.encode()) for k, v in raw.items()]}
+    return Request(scope, receive)
+
+# Corre um teste assíncrono com uma sessão nova (blocos de CHUNK_SIZE bytes) sobre o fakeredis
+def run(redis_server, test):
+    async def main():
+        redis_client = fakeredis.FakeAsyncRedis(server=redis_server, decode_responses=True)
+        os.makedirs(TEMP_UPLOAD_DIR, exist_ok=True)
+        session = await create_session(redis_client, TEMP_UPLOAD_DIR, "video.mp4", len(CONTENT), "Título", "", None)
+        try:
+            return await test(redis_client, session)
+        finally:
+            await redis_client.aclose()
+    return asyncio.run(main())
+
+# Envia um bloco completo do CONTENT
+async def send(redis_client, session, index: int, **kwargs) -> dict:
+    data = CONTENT[index * CHUNK_SIZE:(index + 1) * CHUNK_SIZE]
+    return await receive_chunk(redis_client, session, chunk_request(index * CHUNK_SIZE, [data], **kwargs))
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    monkeypatch.setattr(resumable, "RESUMABLE_CHUNK_SIZE", CHUNK_SIZE)
+
+
+@pytest.mark.parametrize("offset, status", [("2", 409), ("-4", 409), ("12", 409), ("abc", 400)])
+def test_invalid_offset(redis_server, offset, status):
+    async def test(redis_client, session):
+        request = chunk_request(0, [b"0123"], headers={"upload-offset": offset})
+        with pytest.raises(HTTPException) as error:
+            await receive_chunk(redis_client, session, request)
+        assert error.value.status_code == status
+        assert (await upload_state(redis_client, session))["received"] == 0
+    run(redis_server, test)
+
+def test_wrong_length_and_checksum(redis_server):
+    async def test(redis_client, session):
+        wrong_checksum = {"upload-checksum": "sha256 " + base64.b64encode(hashlib.sha256(b"x").digest()).decode()}
+        for parts, headers, status in [([b"01"], None, 400), ([b"01234"], None, 413), ([b"0123"], wrong_checksum, 460)]:
+            with pytest.raises(HTTPException) as error:
+                await receive_chunk(redis_client, session, chunk_request(0, parts, headers=headers))
+            assert error.value.status_code == status
+        assert (await upload_state(redis_client, session))["missing"] == [0, 1, 2]
+    run(redis_server, test)
+
+# Um bloco repetido (p.ex. reenviado depois de uma resposta perdida) só conta uma vez, e a última parte
+# do ficheiro pode chegar antes das outras
+def test_duplicate_and_out_of_order_chunks(redis_server):
+    async def test(redis_client, session):
+        await send(redis_client, session, 2)
+        await send(redis_client, session, 0)
+        state = await send(redis_client, session, 0)
+        assert state["received"] == 2
+        assert state["missing"] == [1]
+        assert state["offset"] == CHUNK_SIZE
+    run(redis_server, test)
+
+# Um cliente que perdeu o seu estado retoma a partir do Redis: um bloco interrompido a meio não conta, e
+# só os blocos em falta são reenviados
+def test_resume_after_state_loss(redis_server):
+    async def test(redis_client, session):
+        await send(redis_client, session, 0)
+        with pytest.raises(HTTPException):
+            await receive_chunk(redis_client, session, chunk_request(CHUNK_SIZE, [b"45"]))
+        reloaded = await load_session(redis_client, session.id)
+        state = await upload_state(redis_client, reloaded)
+        assert state["offset"] == CHUNK_SIZE
+        for index in state["missing"]:
+            await send(redis_client, reloaded, index)
+        await finalize_session(redis_client, reloaded)
+        with open(session.path, "rb") as f:
+            assert f.read() == CONTENT
+        os.remove(session.path)
+    run(redis_server, test)
+
+def test_finalize(redis_server):
+    async def test(redis_client, session):
+        await send(redis_client, session, 0)
+        with pytest.raises(HTTPException) as error:
+            await finalize_session(redis_client, session)
+        assert error.value.status_code == 409
+        await send(redis_client, session, 1)
+        await send(redis_client, session, 2)
+        await finalize_session(redis_client, session)
+        # Depois de finalizada, a sessão não aceita blocos (nem de um pedido que a leu antes) nem outra finalização
+        for call in (finalize_session(redis_client, session), send(redis_client, session, 0),
+                     load_session(redis_client, session.id)):
+            with pytest.raises(HTTPException) as error:
+                await call
+            assert error.value.status_code == 404
+        os.remove(session.path)
+    run(redis_server, test)
+
+# Um bloco a ser escrito impede a finalização, para que nenhum byte seja escrito depois de o ficheiro ser
+# entregue ao registo; a finalização é possível assim que ele termina
+def test_finalize_waits_for_chunks_in_flight(redis_server):
+    async def test(redis_client, session):
+        for index in range(3):
+            await send(redis_client, session, index)
+        gate = asyncio.Event()
+        request = chunk_request(0, [b"01", b"23"], gate=gate)
+        resend = asyncio.create_task(receive_chunk(redis_client, session, request))
+        await asyncio.sleep(0.05)
+        with pytest.raises(HTTPException) as error:
+            await finalize_session(redis_client, session)
+        assert error.value.status_code == 409
+        gate.set()
+        await resend
+        await finalize_session(redis_client, session)
+        os.remove(session.path)
+    run(redis_server, test)
+
+def test_abort(redis_server):
+    async def test(redis_client, session):
+        await send(redis_client, session, 0)
+        await abort_session(redis_client, session)
+        assert not os.path.exists(session.path)
+        with pytest.raises(HTTPException) as error:
+            await load_session(redis_client, session.id)
+        assert error.value.status_code == 404
+    run(redis_server, test)
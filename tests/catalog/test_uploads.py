@@ -0,0 +1,62 @@
+# Receção de formulários multipart em streaming (uploads.receive_upload): ficheiro escrito no disco com o
+# hash calculado durante a cópia e erros do cliente devolvidos como 4xx, sem deixar ficheiros para trás
+
+# Imports Gerais
+import asyncio
+import hashlib
+import os
+
+# Imports Extra
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+# Imports dos Ficheiros
+from uploads import receive_upload
+
+BOUNDARY = "limite-de-teste"
+
+
+# Corpo multipart com os campos de texto e o ficheiro indicados (valores em bytes, sem validação)
+def multipart_body(fields: dict, filename: bytes = None, content: bytes = b"") -> bytes:
+    body = b""
+    for name, value in fields.items():
+        body += (f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"{name}\"\r\n\r\n").encode() + value + b"\r\n"
+    if filename is not None:
+        body += (f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"".encode() + filename
+                 + b"\"\r\nContent-Type: video/mp4\r\n\r\n" + content + b"\r\n")
+    return body + f"--{BOUNDARY}--\r\n".encode()
+
+# Recebe um corpo multipart enviado em partes pequenas, como num pedido real
+def receive(upload_dir: str, body: bytes) -> tuple:
+    parts = [body[i:i + 7] for i in range(0, len(body), 7)]
+    messages = [{"type": "http.request", "body": part, "more_body": i < len(parts) - 1}
+                for i, part in enumerate(parts)]
+
+    async def receive_message():
+        return messages.pop(0)
+    scope = {"type": "http", "method": "POST", "path": "/videos/", "query_string": b"",
+             "headers": [(b"content-type", f"multipart/form-data; boundary={BOUNDARY}".encode())]}
+    return asyncio.run(receive_upload(Request(scope, receive_message), upload_dir))
+
+
+def test_receive_upload(tmp_path):
+    content = os.urandom(3000)
+    fields, upload = receive(str(tmp_path), multipart_body(
+        {"title": "Título".encode(), "description": b""}, "vídeo.mp4".encode(), content))
+    assert fields == {"title": "Título", "description": ""}
+    assert upload.filename == "vídeo.mp4"
+    assert upload.size == len(content)
+    assert upload.sha256 == hashlib.sha256(content).hexdigest()
+    with open(upload.path, "rb") as f:
+        assert f.read() == content
+
+@pytest.mark.parametrize("fields, filename", [
+    ({"title": b"\xff\xfe"}, b"video.mp4"),
+    ({"title": b"ok"}, b"v\xffdeo.mp4"),
+])
+def test_invalid_utf8_is_a_client_error(tmp_path, fields, filename):
+    with pytest.raises(HTTPException) as error:
+        receive(str(tmp_path), multipart_body(fields, filename, b"dados"))
+    assert error.value.status_code == 400
+    assert os.listdir(tmp_path) == []
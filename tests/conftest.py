@@ -0,0 +1,37 @@
+# Configuração comum dos testes: cada serviço é importado a partir do seu diretório (catalog_service/,
+# streaming_service/) com os módulos no nível de topo, e alguns têm o mesmo nome nos vários serviços.
+# Antes de importar os testes de um serviço, os módulos do outro são postos de parte e os deste repostos.
+# Os módulos de shared/ (copiados para a imagem de cada serviço) são os mesmos para todos.
+
+# Imports Gerais
+import os
+import sys
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+SERVICE_DIRS = {"catalog": "catalog_service", "streaming": "streaming_service"}
+SHARED_MODULES = ("app", "cache", "controller", "model")
+
+_modules = {}
+_active = None
+sys.path.insert(0, os.path.join(ROOT_DIR, "shared"))
+
+
+# Torna ativo o serviço dos testes seguintes (o nome do seu diretório em tests/)
+def use_service(service: str):
+    global _active
+    if service == _active:
+        return
+    if _active is not None:
+        _modules[_active] = {name: sys.modules.pop(name) for name in SHARED_MODULES if name in sys.modules}
+    sys.modules.update(_modules.get(service, {}))
+    path = os.path.join(ROOT_DIR, SERVICE_DIRS[service])
+    if path in sys.path:
+        sys.path.remove(path)
+    sys.path.insert(0, path)
+    _active = service
+
+# Ativa o serviço de cada módulo de testes antes de ele ser importado
+def pytest_pycollect_makemodule(module_path, parent):
+    service = module_path.parent.name
+    if service in SERVICE_DIRS:
+        use_service(service)
@@ -0,0 +1,28 @@
+# Configuração dos testes do streaming_service: diretório de vídeos temporário, limites de débito desativados
+# e Redis indisponível (cache de blocos só em memória)
+
+# Imports Gerais
+import os
+import tempfile
+
+# Imports Extra
+import pytest
+
+# Imports dos Ficheiros
+from tests.conftest import use_service
+
+os.environ["VIDEO_DIR"] = tempfile.mkdtemp(prefix="ualflix-tests-streaming-")
+os.environ["REDIS_HOST"] = "127.0.0.1"
+os.environ["REDIS_PORT"] = "1"
+os.environ["RATE_LIMIT_IP_RATE"] = "0"
+os.environ["RATE_LIMIT_VIDEO_RATE"] = "0"
+use_service("streaming")
+
+import app as streaming_app  # noqa: E402 (depois de escolher o serviço e o ambiente)
+
+
+# Ativa ou desativa a cache de blocos (os ranges simples são montados a partir dela)
+@pytest.fixture(params=[True, False], ids=["cache", "bypass"])
+def stream_cache(request, monkeypatch):
+    monkeypatch.setattr(streaming_app, "STREAM_CACHE_ENABLED", request.param)
+    return request.param
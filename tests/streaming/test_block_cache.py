@@ -0,0 +1,64 @@
+# Orçamentos da cache de blocos: a memória local e o nível Redis nunca passam o seu limite, mesmo quando um
+# ficheiro inteiro é lido do início ao fim
+
+# Imports Gerais
+import os
+
+# Imports Extra
+import fakeredis
+import pytest
+
+# Imports dos Ficheiros
+from cache import BlockCache
+
+BLOCK_SIZE = 1024
+
+
+# Ficheiro com 64 blocos
+@pytest.fixture
+def video_path(tmp_path):
+    path = os.path.join(tmp_path, "video.mp4")
+    with open(path, "wb") as f:
+        f.write(bytes(i % 251 for i in range(64 * BLOCK_SIZE)))
+    return path
+
+@pytest.fixture
+def redis_client():
+    return fakeredis.FakeRedis()
+
+# Lê o ficheiro inteiro através da cache
+def read_all(cache: BlockCache, path: str) -> bytes:
+    stat = os.stat(path)
+    return b"".join(cache.iter_range(path, BlockCache.file_key(path, stat), 0, stat.st_size - 1))
+
+# Bytes dos blocos guardados no Redis
+def redis_block_bytes(redis_client) -> int:
+    return sum(len(redis_client.get(key)) for key in redis_client.scan_iter("block:*"))
+
+
+def test_local_tier_within_budget(video_path):
+    cache = BlockCache(block_size=BLOCK_SIZE, max_bytes=8 * BLOCK_SIZE, redis_ttl=0)
+    with open(video_path, "rb") as f:
+        assert read_all(cache, video_path) == f.read()
+    assert cache.stats()["bytes"] <= 8 * BLOCK_SIZE
+
+def test_only_head_blocks_go_to_redis(video_path, redis_client):
+    cache = BlockCache(block_size=BLOCK_SIZE, redis_client=redis_client, redis_head_blocks=4,
+                       redis_max_bytes=1024 * BLOCK_SIZE)
+    read_all(cache, video_path)
+    assert sorted(int(key.rsplit(b":", 1)[1]) for key in redis_client.scan_iter("block:*")) == [0, 1, 2, 3]
+
+def test_redis_tier_within_budget(video_path, redis_client):
+    cache = BlockCache(block_size=BLOCK_SIZE, redis_client=redis_client, redis_head_blocks=64,
+                       redis_max_bytes=10 * BLOCK_SIZE)
+    read_all(cache, video_path)
+    assert redis_block_bytes(redis_client) <= 10 * BLOCK_SIZE
+    assert int(redis_client.get("blocks:bytes")) == redis_block_bytes(redis_client)
+
+# Os blocos no Redis são partilhados: outro processo (com a memória local vazia) lê-os sem ir ao disco
+def test_redis_blocks_shared_between_processes(video_path, redis_client):
+    first = BlockCache(block_size=BLOCK_SIZE, redis_client=redis_client, redis_head_blocks=2)
+    read_all(first, video_path)
+    second = BlockCache(block_size=BLOCK_SIZE, redis_client=redis_client, redis_head_blocks=2)
+    read_all(second, video_path)
+    assert second.stats()["redis_hits"] == 2
@@ -0,0 +1,64 @@
+# Endereço do cliente para os limites (X-Forwarded-For só de proxies confiáveis) e libertação dos lugares do
+# controlo de admissão, também quando a resposta nunca chega a ser enviada
+
+# Imports Gerais
+import asyncio
+import gc
+import ipaddress
+
+# Imports Extra
+import pytest
+from starlette.requests import Request
+
+# Imports dos Ficheiros
+import limits
+from limits import StreamAdmission, client_address
+from responses import BlockStreamingResponse
+
+
+# Pedido vindo de 'peer' com o X-Forwarded-For indicado
+def request_from(peer: str, forwarded: str = None) -> Request:
+    headers = [(b"x-forwarded-for", forwarded.encode())] if forwarded else []
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": headers, "client": (peer, 1234)})
+
+
+@pytest.mark.parametrize("peer, forwarded, hops, expected", [
+    # Ligação direta de um cliente que forja o cabeçalho
+    ("203.0.113.7", "1.2.3.4", 1, "203.0.113.7"),
+    # Ligação do proxy confiável: o endereço que ele acrescentou
+    ("10.1.0.5", "1.2.3.4, 198.51.100.9", 1, "198.51.100.9"),
+    ("10.1.0.5", "1.2.3.4, 198.51.100.9, 10.2.0.3", 2, "198.51.100.9"),
+    ("10.1.0.5", None, 1, "10.1.0.5"),
+    # Sem proxies à frente, o cabeçalho é ignorado mesmo vindo de um endereço confiável
+    ("10.1.0.5", "1.2.3.4", 0, "10.1.0.5"),
+])
+def test_client_address(monkeypatch, peer, forwarded, hops, expected):
+    monkeypatch.setattr(limits, "RATE_LIMIT_TRUSTED_PROXIES", [ipaddress.ip_network("10.0.0.0/8")])
+    monkeypatch.setattr(limits, "RATE_LIMIT_FORWARDED_HOPS", hops)
+    assert client_address(request_from(peer, forwarded)) == expected
+
+def test_release_is_idempotent():
+    admission = StreamAdmission(max_active=1, max_queued=0, queue_timeout=0.1, max_per_client=1)
+
+    async def scenario():
+        assert await admission.acquire("a") is None
+        release = admission.releaser("a")
+        release()
+        release()
+        assert admission.stats()["active"] == 0
+        assert await admission.acquire("b") is None
+        assert await admission.acquire("c") == "overload"
+    asyncio.run(scenario())
+
+# Uma resposta descartada sem ser enviada (p.ex. substituída por um middleware) liberta o lugar
+def test_unsent_response_releases_slot():
+    admission = StreamAdmission(max_active=1, max_queued=0, queue_timeout=0.1, max_per_client=1)
+
+    async def scenario():
+        assert await admission.acquire("a") is None
+        response = BlockStreamingResponse(iter([b"x"])).controlled(admission.releaser("a"))
+        del response
+        gc.collect()
+        assert admission.stats()["active"] == 0
+        assert await admission.acquire("a") is None
+    asyncio.run(scenario())
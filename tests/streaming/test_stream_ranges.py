@@ -0,0 +1,119 @@
+# Ranges e pedidos condicionais em GET /stream/{id}, com e sem a cache de blocos
+
+# Imports Gerais
+import json
+import os
+from datetime import datetime, timezone
+from email.utils import formatdate
+
+# Imports Extra
+import pytest
+from fastapi.testclient import TestClient
+
+# Imports dos Ficheiros
+import app as streaming_app
+from cache import KEYFRAME_INDEX_SUFFIX
+from model import VideoMeta
+
+VIDEO_ID = 1
+VIDEO_SIZE = 3 * 1024 * 1024 + 123
+VIDEO_PATH = os.path.join(os.environ["VIDEO_DIR"], "video.mp4")
+URL = f"/stream/{VIDEO_ID}"
+
+
+# Ficheiro de vídeo de teste, com bytes diferentes em cada posição
+@pytest.fixture(scope="module")
+def video_bytes():
+    data = bytes(i % 251 for i in range(VIDEO_SIZE))
+    with open(VIDEO_PATH, "wb") as f:
+        f.write(data)
+    return data
+
+# Cliente HTTP da aplicação, com os metadados do vídeo servidos sem o catalog_service
+@pytest.fixture
+def client(video_bytes, monkeypatch):
+    now = datetime.now(timezone.utc)
+    meta = VideoMeta(id=VIDEO_ID, title="Teste", duration=1, file_path=VIDEO_PATH, upload_time=now, updated_time=now)
+
+    async def fetch_meta(video_id: int) -> VideoMeta:
+        if video_id != VIDEO_ID:
+            raise LookupError(video_id)
+        return meta
+    monkeypatch.setattr(streaming_app, "fetch_meta", fetch_meta)
+    return TestClient(streaming_app.app)
+
+
+def test_full_file(client, stream_cache, video_bytes):
+    response = client.get(URL)
+    assert response.status_code == 200
+    assert response.content == video_bytes
+    assert response.headers["etag"]
+
+@pytest.mark.parametrize("range_header, start, end", [
+    ("bytes=0-99", 0, 99),
+    ("bytes=1048570-1048600", 1048570, 1048600),
+    (f"bytes={VIDEO_SIZE - 10}-", VIDEO_SIZE - 10, VIDEO_SIZE - 1),
+    (f"bytes=100-{VIDEO_SIZE + 1000}", 100, VIDEO_SIZE - 1),
+    ("bytes=-500", VIDEO_SIZE - 500, VIDEO_SIZE - 1),
+])
+def test_range(client, stream_cache, video_bytes, range_header, start, end):
+    response = client.get(URL, headers={"Range": range_header})
+    assert response.status_code == 206
+    assert response.headers["content-range"] == f"bytes {start}-{end}/{VIDEO_SIZE}"
+    assert response.content == video_bytes[start:end + 1]
+    # Os ranges simples são montados a partir da cache de blocos; os de sufixo vão sempre ao ficheiro
+    assert ("x-cache-status" in response.headers) == (stream_cache and not range_header.startswith("bytes=-"))
+
+def test_unsatisfiable_range(client, stream_cache):
+    response = client.get(URL, headers={"Range": f"bytes={VIDEO_SIZE}-"})
+    assert response.status_code == 416
+    assert response.headers["content-range"] == f"bytes */{VIDEO_SIZE}"
+
+def test_malformed_range(client, stream_cache):
+    assert client.get(URL, headers={"Range": "bytes=abc"}).status_code == 400
+
+def test_if_none_match(client, stream_cache):
+    etag = client.get(URL, headers={"Range": "bytes=0-0"}).headers["etag"]
+    response = client.get(URL, headers={"If-None-Match": etag, "Range": "bytes=0-99"})
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["etag"] == etag
+    assert client.get(URL, headers={"If-None-Match": '"outro"'}).status_code == 200
+
+def test_if_modified_since(client, stream_cache):
+    last_modified = client.get(URL, headers={"Range": "bytes=0-0"}).headers["last-modified"]
+    assert client.get(URL, headers={"If-Modified-Since": last_modified}).status_code == 304
+    assert client.get(URL, headers={"If-Modified-Since": formatdate(0, usegmt=True)}).status_code == 200
+
+# Um Range com If-Range de outra versão recebe o ficheiro inteiro
+def test_if_range(client, stream_cache, video_bytes):
+    etag = client.get(URL, headers={"Range": "bytes=0-0"}).headers["etag"]
+    assert client.get(URL, headers={"Range": "bytes=0-99", "If-Range": etag}).status_code == 206
+    response = client.get(URL, headers={"Range": "bytes=0-99", "If-Range": '"outra-versao"'})
+    assert response.status_code == 200
+    assert response.content == video_bytes
+
+def test_unknown_video(client):
+    assert client.get("/stream/999").status_code == 404
+
+# Um parâmetro de tempo sem Range não transforma a resposta num 206: o ficheiro é enviado inteiro
+def test_time_without_range(client, stream_cache, video_bytes):
+    response = client.get(URL, params={"t": 5})
+    assert response.status_code == 200
+    assert "content-range" not in response.headers
+    assert response.content == video_bytes
+
+# O seek por tempo consulta o índice de keyframes e o player pede o offset devolvido com um Range
+def test_keyframe_lookup(client, video_bytes):
+    index_path = f"{VIDEO_PATH}{KEYFRAME_INDEX_SUFFIX}"
+    assert client.get(f"{URL}/keyframe", params={"t": 1}).status_code == 404
+    with open(index_path, "w") as f:
+        json.dump({"size": VIDEO_SIZE, "keyframes": [[0.0, 48], [2.0, 500000], [4.0, 1500000]]}, f)
+    try:
+        assert client.get(f"{URL}/keyframe", params={"t": 3.5}).json() == {
+            "time": 2.0, "offset": 500000, "size": VIDEO_SIZE}
+        assert client.get(f"{URL}/keyframe", params={"t": 0}).json()["offset"] == 48
+        for t in ("-1", "inf", "nan"):
+            assert client.get(f"{URL}/keyframe", params={"t": t}).status_code == 422
+    finally:
+        os.remove(index_path)
@@ -1,20 +1,46 @@
 # Imports Gerais
 import os
+import asyncio
+import math
+from contextlib import asynccontextmanager
 from datetime import datetime
+from urllib.parse import urlencode
 
 # Imports Extra
-import aiofiles
 import httpx
-from fastapi import (FastAPI, Request, UploadFile, File, Form, Header, Response, HTTPException)
+from fastapi import (FastAPI, Request, Response, HTTPException)
+from fastapi.responses import StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from starlette.staticfiles import StaticFiles
 
 # Imports dos Ficheiros
+from http_pool import PoolTransport
+from metrics import httpx_event_hooks, register_gauges, setup_metrics
+
 BASE_DIR = os.path.dirname(__file__)
 CATALOG_URL = os.getenv("CATALOG_URL", "http://catalog_service:5000")
 STREAMING_URL = os.getenv("STREAMING_URL", "http://streaming_service:5001")
-UPLOAD_DIR = os.getenv("UPLOAD_DIR", os.path.join(BASE_DIR, "static", "uploads"))
+
+# Tempo máximo de espera por uma ligação livre do pool HTTP partilhado pelos handlers (ver http_pool.py)
+HTTP_POOL_TIMEOUT = float(os.getenv("HTTP_POOL_TIMEOUT", "5"))
+
+# Timeouts por tipo de rota:
+# - páginas: pedidos curtos de metadados ao catálogo
+# - stream: sem limite de leitura, um vídeo pode demorar o tempo que o utilizador quiser
+# - upload: sem limite de escrita/leitura, o corpo pode ter vários GB
+TIMEOUT_PAGE = httpx.Timeout(float(os.getenv("HTTP_TIMEOUT_PAGE", "5")), pool=HTTP_POOL_TIMEOUT)
+TIMEOUT_STREAM = httpx.Timeout(10.0, read=None, pool=HTTP_POOL_TIMEOUT)
+TIMEOUT_UPLOAD = httpx.Timeout(10.0, read=None, write=None, pool=HTTP_POOL_TIMEOUT)
+# - blocos de um upload retomável: cada pedido tem no máximo um bloco (RESUMABLE_CHUNK_SIZE do catálogo)
+TIMEOUT_CHUNK = httpx.Timeout(float(os.getenv("HTTP_TIMEOUT_CHUNK", "60")), pool=HTTP_POOL_TIMEOUT)
+
+# Grelha (colunas x linhas) das sprites de pré-visualização geradas pelo catalog_service (tem de ser igual)
+SPRITE_COLUMNS, SPRITE_ROWS = (int(v) for v in os.getenv("PREVIEW_SPRITE_GRID", "5x5").split("x"))
+
+# Cliente HTTP partilhado e o seu pool de ligações, criados no arranque da aplicação
+http_client: httpx.AsyncClient = None
+http_pool: PoolTransport = None
 
 class CachingStaticFiles(StaticFiles):
     def __init__(self, *args, **kwargs):
@@ -26,31 +52,110 @@ class CachingStaticFiles(StaticFiles):
             response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
         return response
 
-app = FastAPI(title="UI Service")
+# Cabeçalhos do browser reencaminhados para o streaming_service (range e pedidos condicionais)
+STREAM_REQUEST_HEADERS = ("range", "if-range", "if-none-match", "if-modified-since")
+# Cabeçalhos da resposta do streaming_service reencaminhados para o browser
+STREAM_RESPONSE_HEADERS = (
+    "content-length", "content-range", "accept-ranges", "content-type",
+    "etag", "last-modified", "cache-control", "expires", "x-cache-status",
+    "retry-after")
+
+# Cabeçalhos dos uploads retomáveis reencaminhados para o catalog_service e de volta para o browser
+UPLOAD_REQUEST_HEADERS = ("content-type", "content-length", "upload-offset", "upload-checksum")
+UPLOAD_RESPONSE_HEADERS = ("content-type", "upload-offset", "upload-length", "upload-chunk-size", "cache-control")
+
+# Read-your-writes: o catalog_service indica a hora de cada escrita no cabeçalho X-Read-Your-Writes. O UI
+# guarda-a num cookie do browser que a fez e reenvia-a nas leituras desse browser, que vão ao primário
+# enquanto a escrita for recente; os outros browsers continuam a ler das réplicas.
+READ_YOUR_WRITES_HEADER = "X-Read-Your-Writes"
+READ_YOUR_WRITES_COOKIE = "read_your_writes"
+READ_YOUR_WRITES_COOKIE_MAX_AGE = 60
+
+# Resposta que reencaminha o corpo do upstream à medida que chega, sem o carregar em memória.
+# O próximo bloco só é lido do upstream depois de o anterior ser enviado ao browser (backpressure),
+# e a ligação ao upstream é sempre fechada no fim, inclusive quando o cliente se desliga a meio.
+class ProxyStreamingResponse(StreamingResponse):
+    def __init__(self, upstream: httpx.Response, headers: dict):
+        super().__init__(upstream.aiter_raw(), status_code=upstream.status_code, headers=headers)
+        self.upstream = upstream
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.upstream.aclose()
+
+# Cabeçalhos das leituras ao catalog_service feitas em nome de um browser (read-your-writes)
+def catalog_read_headers(request: Request) -> dict:
+    marker = request.cookies.get(READ_YOUR_WRITES_COOKIE)
+    return {READ_YOUR_WRITES_HEADER: marker} if marker else {}
+
+# Guarda no browser a hora de uma escrita indicada numa resposta do catalog_service
+def remember_write(response: Response, upstream: httpx.Response) -> Response:
+    marker = upstream.headers.get(READ_YOUR_WRITES_HEADER)
+    if marker:
+        response.set_cookie(READ_YOUR_WRITES_COOKIE, marker, max_age=READ_YOUR_WRITES_COOKIE_MAX_AGE,
+                            httponly=True, samesite="lax")
+    return response
+
+# Gere o ciclo de vida da aplicação, criando um único cliente HTTP com pool de ligações keep-alive
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global http_client, http_pool
+    http_pool = PoolTransport()
+    http_client = httpx.AsyncClient(transport=http_pool, timeout=TIMEOUT_PAGE, event_hooks=httpx_event_hooks())
+    yield
+    await http_client.aclose()
+
+app = FastAPI(title="UI Service", lifespan=lifespan)
+setup_metrics(app)
+register_gauges("http_pool_requests", "Pedidos em curso no pool HTTP aos serviços upstream", ["state"],
+                lambda: {"in_flight": http_pool.in_flight} if http_pool else {})
 app.mount("/static", CachingStaticFiles(directory=os.path.join(BASE_DIR, "static")), name="static")
 templates = Jinja2Templates(directory=os.path.join(BASE_DIR, "templates"))
-os.makedirs(UPLOAD_DIR, exist_ok=True)
+templates.env.globals.update(sprite_columns=SPRITE_COLUMNS, sprite_rows=SPRITE_ROWS)
 
 
+# URLs da miniatura e da sprite de pré-visualização de um vídeo, quando já foram geradas.
+# As listagens usam-nas em vez do stream, para não pedir nenhum vídeo antes de o utilizador carregar no play.
+def add_preview_urls(video: dict):
+    ready = video.get("preview_status") == "ready" and video.get("content_hash")
+    video["poster_url"] = f"/previews/{video['content_hash']}/poster.jpg" if ready else None
+    video["sprite_url"] = f"/previews/{video['content_hash']}/sprite.jpg" if ready else None
+
 # Endpoint para verificação de saúde do serviço do UI
 @app.get("/healthz", status_code=200)
 async def health_check():
     return {"status": "ok"}
 
+# Métricas do pool de ligações HTTP para os serviços upstream
+@app.get("/metrics/http-pool")
+async def http_pool_metrics():
+    return http_pool.stats() if http_pool else {}
+
 # Mostra a página principal com o catálogo de vídeos
 @app.get("/")
-async def index(request: Request):
-    async with httpx.AsyncClient() as client:
-        response = await client.get(f"{CATALOG_URL}/videos/")
+async def index(request: Request, cursor: str = None, q: str = None):
+    if q:
+        # Pesquisa no catálogo em vez de listar todos os vídeos
+        response = await http_client.get(f"{CATALOG_URL}/videos/search", params={"q": q, "limit": 50},
+                                         headers=catalog_read_headers(request))
         response.raise_for_status()
-        videos = response.json()
-    
-    # Adiciona um parâmetro para evitar cache do browser no streaming
+        page = {"items": response.json()["items"], "next_cursor": None}
+    else:
+        params = {"cursor": cursor} if cursor else {}
+        response = await http_client.get(f"{CATALOG_URL}/videos/", params=params,
+                                         headers=catalog_read_headers(request))
+        response.raise_for_status()
+        page = response.json()
+    videos = page["items"]
+
     for video in videos:
-        updated_ts = int(datetime.fromisoformat(video["updated_time"]).timestamp())
-        video["stream_url"] = f"/stream/{video['id']}?v={updated_ts}"
+        add_preview_urls(video)
     return templates.TemplateResponse(request, "index.html", {
-        "videos": videos
+        "videos": videos,
+        "next_cursor": page["next_cursor"],
+        "q": q
     })
 
 # Mostra a página de upload de vídeos
@@ -61,128 +166,168 @@ async def upload_form(request: Request):
 # Faz proxy do upload do ficheiro para o catalog_service
 @app.post("/upload")
 async def upload(request: Request):
-    async with httpx.AsyncClient() as client:
-        # Faz stream do corpo do pedido diretamente para o catalog_service
-        resp = await client.post(
-            f"{CATALOG_URL}/videos/",
-            headers={k: v for k, v in request.headers.items() if k.lower() not in ('host', 'transfer-encoding')},
-            content=request.stream(),
-            timeout=None
-        )
+    # Faz stream do corpo do pedido diretamente para o catalog_service
+    resp = await http_client.post(
+        f"{CATALOG_URL}/videos/",
+        headers={k: v for k, v in request.headers.items() if k.lower() not in ('host', 'transfer-encoding')},
+        content=request.stream(),
+        timeout=TIMEOUT_UPLOAD
+    )
     # Retorna a resposta exata do catalog_service para o browser
     return Response(content=resp.content, status_code=resp.status_code, headers=dict(resp.headers))
 
 # Mostra a página para ver o video
 @app.get("/watch/{video_id}")
-async def watch(request: Request, video_id: int):
-    async with httpx.AsyncClient() as client:
-        # Fetch do video que é para ser visualizado
-        video_resp = await client.get(f"{CATALOG_URL}/videos/{video_id}")
-        if video_resp.status_code != 200:
-            raise HTTPException(status_code=404, detail="Vídeo não encontrado")
-        video = video_resp.json()
-
-        # Fetch de todos os videos para a sidebar
-        videos_resp = await client.get(f"{CATALOG_URL}/videos/")
-        videos_resp.raise_for_status()
-        all_videos = videos_resp.json()
-
-    # Adicionar um URL de Stream para todos os videos
+async def watch(request: Request, video_id: int, t: float = None):
+    # Fetch do video que é para ser visualizado e dos videos para a sidebar, em paralelo
+    headers = catalog_read_headers(request)
+    video_resp, videos_resp = await asyncio.gather(
+        http_client.get(f"{CATALOG_URL}/videos/{video_id}", headers=headers),
+        http_client.get(f"{CATALOG_URL}/videos/", headers=headers))
+    if video_resp.status_code != 200:
+        raise HTTPException(status_code=404, detail="Vídeo não encontrado")
+    video = video_resp.json()
+    videos_resp.raise_for_status()
+    all_videos = videos_resp.json()["items"]
+
+    # Miniaturas dos vídeos da sidebar
     for v in all_videos:
-        updated_ts = int(datetime.fromisoformat(v["updated_time"]).timestamp())
-        v["stream_url"] = f"/stream/{v['id']}?v={updated_ts}"
-        
-    # Cria um URL de Stream para o video atual
+        add_preview_urls(v)
+    add_preview_urls(video)
+
+    # Cria um URL de Stream para o video atual e, se já foi transcodificado, o da playlist HLS adaptativa.
+    # '?t=' começa a reprodução nesse instante (media fragment: o browser lê o 'moov' no início do
+    # ficheiro e pede logo o range do instante pedido). Um 't' negativo, infinito ou NaN é ignorado.
+    if t is not None and not (math.isfinite(t) and t >= 0):
+        t = None
     updated_ts = int(datetime.fromisoformat(video["updated_time"]).timestamp())
     stream_url = f"/stream/{video_id}?v={updated_ts}"
+    if t:
+        stream_url += f"#t={t}"
+    hls_url = None
+    if video.get("abr_status") == "ready" and video.get("content_hash"):
+        hls_url = f"/stream/abr/{video['content_hash']}/master.m3u8"
 
     return templates.TemplateResponse(request, "watch.html", {
         "video": video,
         "stream_url": stream_url,
+        "hls_url": hls_url,
+        "start_time": t or 0,
         "videos": [v for v in all_videos if v['id'] != video_id]
     })
 
 # Mostra o painel de administração com a lista de vídeos
 @app.get("/admin")
-async def admin_panel(request: Request):
-    async with httpx.AsyncClient() as client:
-        response = await client.get(f"{CATALOG_URL}/videos/")
-        response.raise_for_status()
-        videos = response.json()
+async def admin_panel(request: Request, cursor: str = None):
+    params = {"cursor": cursor} if cursor else {}
+    response = await http_client.get(f"{CATALOG_URL}/videos/", params=params, headers=catalog_read_headers(request))
+    response.raise_for_status()
+    page = response.json()
     return templates.TemplateResponse(request, "admin.html", {
-        "videos": videos
+        "videos": page["items"],
+        "next_cursor": page["next_cursor"]
     })
 
 # Mostra a pagina do formulário para editar um vídeo
 @app.get("/admin/edit/{video_id}")
 async def edit_form(request: Request, video_id: int):
-    async with httpx.AsyncClient() as client:
-        response = await client.get(f"{CATALOG_URL}/videos/{video_id}")
-        response.raise_for_status()
-        video = response.json()
+    response = await http_client.get(f"{CATALOG_URL}/videos/{video_id}", headers=catalog_read_headers(request))
+    response.raise_for_status()
+    video = response.json()
     return templates.TemplateResponse(request, "edit.html", {
         "video": video
     })
 
-# Processa a edição de um vídeo, enviando os dados para o catalog_service
+# Processa a edição de um vídeo, fazendo stream do formulário (e do novo ficheiro, se existir)
+# diretamente para o catalog_service, sem o guardar em memória nem em disco
 @app.post("/admin/edit/{video_id}")
-async def do_edit(
-    video_id: int,
-    title: str = Form(...),
-    description: str = Form(None),
-    duration: int = Form(...),
-    file: UploadFile = File(None)):
-    data = {"title": title, "description": description, "duration": duration}
-    async with httpx.AsyncClient() as client:
-        if file and file.filename:
-            temp_path = os.path.join(UPLOAD_DIR, file.filename)
-            try:
-                async with aiofiles.open(temp_path, "wb") as out_f:
-                    content = await file.read()
-                    await out_f.write(content)
-                
-                with open(temp_path, "rb") as f:
-                    files = {"file": (file.filename, f, file.content_type)}
-                    resp = await client.put(f"{CATALOG_URL}/videos/{video_id}", data=data, files=files, timeout=None)
-            finally:
-                if os.path.exists(temp_path):
-                    os.remove(temp_path)
-        else:
-            resp = await client.put(f"{CATALOG_URL}/videos/{video_id}", data=data, timeout=None)
-
-    return Response(content=resp.content, status_code=resp.status_code, headers=dict(resp.headers))
+async def do_edit(request: Request, video_id: int):
+    resp = await http_client.put(
+        f"{CATALOG_URL}/videos/{video_id}",
+        headers={k: v for k, v in request.headers.items() if k.lower() not in ('host', 'transfer-encoding')},
+        content=request.stream(),
+        timeout=TIMEOUT_UPLOAD
+    )
+    return remember_write(Response(content=resp.content, status_code=resp.status_code, headers=dict(resp.headers)),
+                          resp)
 
 # Faz proxy do pedido de apagar para o catalog_service
 @app.delete("/api/videos/{video_id}")
-async def delete_proxy(video_id: int):
-    async with httpx.AsyncClient() as client:
-        resp = await client.delete(f"{CATALOG_URL}/videos/{video_id}")
+async def delete_proxy(video_id: int, response: Response):
+    resp = await http_client.delete(f"{CATALOG_URL}/videos/{video_id}")
+    remember_write(response, resp)
     return {"ok": resp.status_code == 200}
 
+# Faz proxy do pedido de apagar vários vídeos ({"ids": [...]}) para o catalog_service, numa só chamada
+@app.post("/api/videos/bulk-delete")
+async def bulk_delete_proxy(request: Request):
+    resp = await http_client.post(f"{CATALOG_URL}/videos/batch/delete", content=await request.body(),
+                                  headers={"Content-Type": "application/json"})
+    return remember_write(Response(content=resp.content, status_code=resp.status_code, media_type="application/json"),
+                          resp)
+
+# Faz proxy dos pedidos de um upload retomável para o catalog_service (criar sessão, enviar um bloco,
+# consultar o estado, finalizar e cancelar). Cada pedido transporta no máximo um bloco, em streaming.
+@app.post("/api/uploads/")
+@app.api_route("/api/uploads/{upload_id}", methods=["HEAD", "GET", "PATCH", "DELETE"])
+@app.post("/api/uploads/{upload_id}/finalize")
+async def upload_proxy(request: Request):
+    headers = {k: v for k, v in request.headers.items() if k.lower() in UPLOAD_REQUEST_HEADERS}
+    upstream_req = http_client.build_request(
+        request.method, f"{CATALOG_URL}{request.url.path.removeprefix('/api')}", headers=headers,
+        content=request.stream() if request.method in ("POST", "PATCH") else None, timeout=TIMEOUT_CHUNK)
+    resp = await http_client.send(upstream_req)
+    return Response(content=resp.content, status_code=resp.status_code,
+                    headers={k: v for k, v in resp.headers.items() if k.lower() in UPLOAD_RESPONSE_HEADERS})
+
 # Faz proxy da verificação de estado da tarefa para o catalog_service
 @app.get("/api/videos/task/{task_id}")
 async def task_status_proxy(task_id: str):
-    async with httpx.AsyncClient() as client:
-        resp = await client.get(f"{CATALOG_URL}/videos/task/{task_id}")
-    return Response(content=resp.content, status_code=resp.status_code, headers=dict(resp.headers))
+    resp = await http_client.get(f"{CATALOG_URL}/videos/task/{task_id}")
+    return remember_write(Response(content=resp.content, status_code=resp.status_code, headers=dict(resp.headers)),
+                          resp)
 
-# Faz proxy do stream de vídeo, preservando cabeçalhos Range
-@app.get("/stream/{video_id}")
-async def proxy_stream(video_id: int, range: str = Header(None)):
-    headers = {"Range": range} if range else {}
-    async with httpx.AsyncClient() as client:
-        upstream = await client.get(
-            f"{STREAMING_URL}/stream/{video_id}",
-            headers=headers,
-            timeout=None
-        )
-    # Reencaminha apenas os cabeçalhos necessários para o streaming
+# Faz proxy dos eventos (SSE) de um pipeline de upload do catalog_service, reencaminhados à medida que chegam
+@app.get("/api/videos/task/{task_id}/events")
+async def task_events_proxy(task_id: str):
+    upstream_req = http_client.build_request(
+        "GET", f"{CATALOG_URL}/videos/task/{task_id}/events", timeout=TIMEOUT_STREAM)
+    upstream = await http_client.send(upstream_req, stream=True)
+    return ProxyStreamingResponse(upstream, {
+        "Content-Type": upstream.headers.get("content-type", "text/event-stream"),
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+
+# Faz proxy de um pedido GET ao streaming_service em streaming, preservando cabeçalhos Range e condicionais.
+# O endereço do browser é acrescentado ao X-Forwarded-For, usado pelos limites por cliente do streaming_service.
+async def proxy_streaming(request: Request, path: str) -> ProxyStreamingResponse:
+    headers = {k: v for k, v in request.headers.items() if k.lower() in STREAM_REQUEST_HEADERS}
+    if request.client is not None:
+        forwarded = request.headers.get("x-forwarded-for")
+        headers["X-Forwarded-For"] = f"{forwarded}, {request.client.host}" if forwarded else request.client.host
+    upstream_req = http_client.build_request(
+        "GET", f"{STREAMING_URL}{path}", headers=headers, timeout=TIMEOUT_STREAM)
+    upstream = await http_client.send(upstream_req, stream=True)
+    # Reencaminha apenas os cabeçalhos necessários para o streaming e validação de cache
     resp_headers = {
         k: v for k, v in upstream.headers.items()
-        if k.lower() in ("content-length", "content-range", "accept-ranges", "content-type")
+        if k.lower() in STREAM_RESPONSE_HEADERS
     }
-    return Response(
-        content=upstream.content,
-        status_code=upstream.status_code,
-        headers=resp_headers
-    )
\ No newline at end of file
+    return ProxyStreamingResponse(upstream, resp_headers)
+
+# Faz proxy do stream de vídeo em streaming (com a versão '?v=' do URL, que torna a resposta imutável
+# enquanto for a versão atual do vídeo)
+@app.get("/stream/{video_id}")
+async def proxy_stream(request: Request, video_id: int, v: int = None):
+    return await proxy_streaming(request, f"/stream/{video_id}" + (f"?{urlencode({'v': v})}" if v is not None else ""))
+
+# Faz proxy das miniaturas e sprites de pré-visualização (cache imutável, endereçadas pelo hash do conteúdo)
+@app.get("/previews/{content_hash}/{name}")
+async def proxy_preview(request: Request, content_hash: str, name: str):
+    return await proxy_streaming(request, f"/previews/{content_hash}/{name}")
+
+# Faz proxy dos manifestos e segmentos HLS/DASH (os cabeçalhos de cache imutável vêm do streaming_service)
+@app.get("/stream/abr/{content_hash}/{name}")
+async def proxy_abr(request: Request, content_hash: str, name: str):
+    return await proxy_streaming(request, f"/stream/abr/{content_hash}/{name}")
@@ -20,4 +20,42 @@ document.addEventListener("DOMContentLoaded", () => {
             }
         });
     });
+
+    // Seleção de vários vídeos para apagar de uma vez (um único pedido e uma única transação no catálogo)
+    const selectAll = document.getElementById("select-all-videos");
+    const deleteSelected = document.getElementById("btn-delete-selected");
+    const checkboxes = Array.from(document.querySelectorAll(".select-video"));
+    const selectedIds = () => checkboxes.filter(cb => cb.checked).map(cb => Number(cb.value));
+    const updateSelection = () => {
+        const count = selectedIds().length;
+        deleteSelected.disabled = count === 0;
+        selectAll.checked = count > 0 && count === checkboxes.length;
+    };
+    checkboxes.forEach(cb => cb.addEventListener("change", updateSelection));
+    selectAll.addEventListener("change", () => {
+        checkboxes.forEach(cb => { cb.checked = selectAll.checked; });
+        updateSelection();
+    });
+    deleteSelected.addEventListener("click", async () => {
+        const ids = selectedIds();
+        if (!confirm(`Tem a certeza que quer eliminar ${ids.length} vídeo(s)?`)) {
+            return;
+        }
+        try {
+            const resp = await fetch("/api/videos/bulk-delete", {
+                method: "POST",
+                headers: { "Content-Type": "application/json" },
+                body: JSON.stringify({ ids })
+            });
+            if (resp.ok) {
+                location.reload();
+            } else {
+                const body = await resp.json().catch(() => ({}));
+                alert(body.detail || "Ocorreu um erro ao eliminar os vídeos");
+            }
+        } catch (error) {
+            console.error("Falha de comunicação ao apagar:", error);
+            alert("Falha de comunicação com o servidor");
+        }
+    });
 });
\ No newline at end of file